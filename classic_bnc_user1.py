@@ -1,7 +1,10 @@
+from datetime import datetime
+
 from apscheduler.schedulers.blocking import BlockingScheduler
 
 from utils.binance_classic import init_exchange, init_db, update_data, get_valid_usdt_symbols
 from utils.constants import CONFIG
+from utils.markets import get_registry
 
 account = 'binance_strategy_9'
 
@@ -19,12 +22,14 @@ config = {
 USER = account
 
 if __name__ == '__main__':
-    binance = init_exchange(config)
+    binance = get_registry().attach(init_exchange(config))
     init_db(USER)
 
-    valid_usdt_symbols = get_valid_usdt_symbols(binance)
+    def update():
+        update_data(USER, binance, get_valid_usdt_symbols(binance))
+
     scheduler = BlockingScheduler()
-    scheduler.add_job(update_data, 'interval', seconds=60, args=[USER, binance, valid_usdt_symbols])
+    scheduler.add_job(update, 'interval', seconds=60, next_run_time=datetime.now())
 
     try:
         scheduler.start()
@@ -0,0 +1,190 @@
+import argparse
+import asyncio
+
+from apscheduler.executors.pool import ThreadPoolExecutor
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from apscheduler.schedulers.blocking import BlockingScheduler
+
+from utils.accounts import init_account, init_account_async, init_shared, load_accounts, make_async_fetch, make_async_update_job, make_update_job
+from utils.api import API_PORT, serve_api, store_service
+from utils.constants import CONFIG
+from utils.events import EVENTS_PORT, serve_events
+from utils.metrics import METRICS_PORT, serve
+from utils.polling import MAX_INTERVAL, MIN_INTERVAL, AdaptivePolicy
+from utils.prices import DEFAULT_TTL
+from utils.ratelimit import get_governor
+from utils.rollup import DAY, RAW_RETENTION
+from utils.scheduling import JOB_DEFAULTS, CycleMonitor, schedule_cycles
+from utils.snapshot import SNAPSHOT_PATH, SnapshotWriter
+from utils.storage import connect_readonly, get_store
+from utils.valuation import get_engine
+
+INTERVAL = 60
+MAX_WORKERS = 8
+STATS_INTERVAL = 600
+PRUNE_INTERVAL = 3600
+RECONCILE_INTERVAL = 600
+DEADLINE = 45
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Update every account configured in .keys/config.cfg')
+    parser.add_argument('--interval', type=int, default=INTERVAL, help='seconds between update cycles')
+    parser.add_argument('--workers', type=int, default=MAX_WORKERS, help='maximum concurrent update cycles')
+    parser.add_argument('--adaptive', action='store_true', help='poll accounts with open positions and moving equity more often and idle ones less, at the same total request rate as --interval')
+    parser.add_argument('--min-interval', type=float, default=MIN_INTERVAL, help='shortest interval --adaptive may pick')
+    parser.add_argument('--max-interval', type=float, default=MAX_INTERVAL, help='longest interval --adaptive may pick')
+    parser.add_argument('--deadline', type=float, default=DEADLINE, help='seconds one account cycle may take before it counts as overrun (and is cancelled with --asyncio)')
+    parser.add_argument('--price-ttl', type=float, default=DEFAULT_TTL, help='seconds a cached USDT price stays valid')
+    parser.add_argument('--raw-days', type=float, default=RAW_RETENTION / DAY, help='days of raw equity samples to keep; older history is served from rollups')
+    parser.add_argument('--metrics-port', type=int, default=METRICS_PORT, help='serve Prometheus metrics on 127.0.0.1:<port>/metrics (0 disables)')
+    parser.add_argument('--events-port', type=int, default=EVENTS_PORT, help='stream change events on 127.0.0.1:<port>/events (0 disables)')
+    parser.add_argument('--api-port', type=int, default=API_PORT, help='serve the read API on 127.0.0.1:<port> (0 disables)')
+    parser.add_argument('--snapshot', default=SNAPSHOT_PATH, help="publish the latest state of every wallet to this memory-mapped file ('' disables)")
+    parser.add_argument('--asyncio', action='store_true', help='run every account on one event loop with ccxt.async_support')
+    parser.add_argument('--stream', action='store_true', help='follow account websocket streams instead of polling (implies --asyncio)')
+    parser.add_argument('--reconcile', type=int, default=RECONCILE_INTERVAL, help='seconds between REST reconciliations in --stream mode')
+    return parser.parse_args()
+
+
+def print_stats(shared, monitor, policy):
+    print(f"Cycles: {monitor.summary()}")
+    if policy is not None:
+        print(f"Intervals: {policy.intervals()}")
+    if 'price_cache' in shared:
+        print(f"Price cache: {shared['price_cache'].stats()}")
+    print(f"Request weight: {get_governor().stats()}")
+    valuation = get_engine().value()
+    equity, borrowed, notional = valuation.total()
+    print(f"Valuation of {len(valuation.wallets)} wallets: equity {equity:.2f}, borrowed {borrowed:.2f}, notional {notional:.2f}")
+
+
+def prune_history(raw_days):
+    get_store().prune(int(raw_days * DAY))
+
+
+def init_valuation(shared):
+    """Reprice every wallet on each price refresh; updaters hand the engine their holdings every cycle."""
+    if 'price_cache' in shared:
+        shared['price_cache'].subscribe(get_engine().set_tickers)
+
+
+def init_snapshot(path):
+    """Mirror every written cycle into the shared-memory snapshot, starting from what the database holds."""
+    store = get_store()
+    writer = SnapshotWriter(path)
+    conn = connect_readonly(store.path)
+    writer.seed(conn)
+    conn.close()
+    store.subscribe(writer.observe)
+
+
+def make_policy(args):
+    if not args.adaptive or args.stream:
+        return None
+    policy = AdaptivePolicy(args.interval, args.min_interval, args.max_interval)
+    get_store().subscribe(policy.observe)
+    return policy
+
+
+def add_stats_job(scheduler, shared, monitor, policy, args):
+    scheduler.add_job(print_stats, 'interval', seconds=STATS_INTERVAL, args=[shared, monitor, policy], id='stats')
+    scheduler.add_job(prune_history, 'interval', seconds=PRUNE_INTERVAL, args=[args.raw_days], id='prune')
+
+
+def run_threaded(accounts, args):
+    scheduler = BlockingScheduler(
+        executors={'default': ThreadPoolExecutor(args.workers)},
+        job_defaults=JOB_DEFAULTS,
+    )
+    monitor = CycleMonitor()
+    monitor.listen(scheduler)
+
+    shared = init_shared(accounts, args.price_ttl)
+    init_valuation(shared)
+    jobs = []
+    for account in accounts:
+        exchange = init_account(account)
+        jobs.append((account.user, account.section, make_update_job(account, exchange, shared)))
+        print(f"Scheduled {account.section} ({account.venue}) as {account.user}")
+    policy = make_policy(args)
+    schedule_cycles(scheduler, jobs, args.interval, monitor, args.deadline, policy=policy)
+    add_stats_job(scheduler, shared, monitor, policy, args)
+
+    try:
+        scheduler.start()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+
+
+async def run_asyncio(accounts, args):
+    # Streaming pulls in aiohttp and ccxt.async_support; threaded runs never need them
+    from utils.streaming import make_streams
+
+    scheduler = AsyncIOScheduler(job_defaults=JOB_DEFAULTS)
+    monitor = CycleMonitor()
+    monitor.listen(scheduler)
+
+    shared = init_shared(accounts, args.price_ttl)
+    init_valuation(shared)
+    exchanges = []
+    tasks = []
+    jobs = []
+    try:
+        for account in accounts:
+            exchange = init_account_async(account)
+            exchanges.append(exchange)
+            if args.stream:
+                streams = make_streams(account, exchange, make_async_fetch(account, exchange, shared))
+                tasks += [asyncio.ensure_future(stream.run()) for stream in streams]
+                # Streams reconcile on connect; this slow pass is the safety net
+                jobs.append((account.user, account.section, streams[0].reconcile))
+                print(f"Streaming {account.section} ({account.venue}) as {account.user}")
+                continue
+            jobs.append((account.user, account.section, make_async_update_job(account, exchange, shared)))
+            print(f"Scheduled {account.section} ({account.venue}) as {account.user}")
+        interval = args.reconcile if args.stream else args.interval
+        policy = make_policy(args)
+        schedule_cycles(scheduler, jobs, interval, monitor, args.deadline, is_async=True, policy=policy)
+        add_stats_job(scheduler, shared, monitor, policy, args)
+
+        scheduler.start()
+        await asyncio.Event().wait()
+    finally:
+        if scheduler.running:
+            scheduler.shutdown(wait=False)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*(exchange.close() for exchange in exchanges))
+
+
+def main():
+    args = parse_args()
+    accounts = load_accounts(CONFIG)
+    if not accounts:
+        print("No accounts configured")
+        return
+    if args.metrics_port:
+        serve(args.metrics_port)
+        print(f"Serving metrics on http://127.0.0.1:{args.metrics_port}/metrics")
+    if args.events_port:
+        serve_events(get_store().events, args.events_port)
+        print(f"Streaming events on http://127.0.0.1:{args.events_port}/events")
+    if args.api_port:
+        serve_api(store_service(get_store()), args.api_port)
+        print(f"Serving the read API on http://127.0.0.1:{args.api_port}")
+    if args.snapshot:
+        init_snapshot(args.snapshot)
+        print(f"Publishing snapshots to {args.snapshot}")
+
+    if args.asyncio or args.stream:
+        try:
+            asyncio.run(run_asyncio(accounts, args))
+        except (KeyboardInterrupt, SystemExit):
+            pass
+    else:
+        run_threaded(accounts, args)
+
+
+if __name__ == '__main__':
+    main()
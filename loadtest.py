@@ -0,0 +1,134 @@
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import Any, Callable, Dict, List
+
+from apscheduler.executors.pool import ThreadPoolExecutor
+from apscheduler.schedulers.background import BackgroundScheduler
+
+from utils.accounts import VENUES, Account, exchange_config, init_account, init_shared, make_update_job
+from utils.metrics import DB_ROWS, DB_WRITE_SECONDS
+from utils.ratelimit import get_governor
+from utils.scheduling import JOB_DEFAULTS, CycleMonitor, schedule_cycles
+from utils.simulator import Simulator, SimulatorConfig, simulated_config
+from utils.storage import get_store
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Run simulated accounts through the update path against a local exchange simulator')
+    parser.add_argument('--accounts', type=int, default=20, help='number of simulated accounts')
+    parser.add_argument('--venues', default=','.join(VENUES), help='comma-separated venues the accounts are spread over')
+    parser.add_argument('--duration', type=float, default=60, help='seconds to run')
+    parser.add_argument('--interval', type=int, default=10, help='seconds between update cycles of one account')
+    parser.add_argument('--workers', type=int, default=8, help='maximum concurrent update cycles')
+    parser.add_argument('--deadline', type=float, default=None, help='seconds after which a cycle counts as overrun')
+    parser.add_argument('--latency', default='lognormal:0.05:0.5', help='response latency: fixed:S, uniform:LOW:HIGH, exp:MEAN or lognormal:MEDIAN:SIGMA')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of requests answered with a 503')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='share of requests answered with a rate-limit error')
+    parser.add_argument('--limit-scale', type=float, default=1.0, help='fraction of the real request-weight limits the simulator enforces')
+    parser.add_argument('--assets', type=int, default=10, help='coins per account')
+    parser.add_argument('--positions', type=int, default=10, help='positions per account and contract type')
+    parser.add_argument('--churn', type=float, default=0.2, help='share of positions whose PnL changes between requests')
+    parser.add_argument('--workdir', help='directory for the database (a new temporary directory by default)')
+    parser.add_argument('--output', help='also write the report to this JSON file')
+    return parser.parse_args()
+
+
+def make_accounts(count: int, venues: List[str], url: str) -> List[Account]:
+    accounts = []
+    for i in range(count):
+        venue = venues[i % len(venues)]
+        config = simulated_config(exchange_config(venue, f"sim-key-{i}", 'sim-secret'), url)
+        accounts.append(Account(section=f"sim{i}", user=f"sim{i}", venue=venue, config=config))
+    return accounts
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Nearest-rank percentile, 0 for no values."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(q / 100 * len(ordered)), len(ordered) - 1)]
+
+
+def timed(job: Callable[[], None], durations: List[float], lock: threading.Lock) -> Callable[[], None]:
+    def cycle():
+        start = time.monotonic()
+        try:
+            job()
+        finally:
+            with lock:
+                durations.append(time.monotonic() - start)
+    return cycle
+
+
+def rows_written() -> float:
+    return sum(value for _, _, value in DB_ROWS.samples())
+
+
+def main():
+    args = parse_args()
+    output = os.path.abspath(args.output) if args.output else None
+    # The store and the legacy per-venue init_db both write trading_data.db in the working directory
+    os.chdir(args.workdir or tempfile.mkdtemp(prefix='loadtest-'))
+
+    simulator = Simulator(SimulatorConfig(
+        latency=args.latency, error_rate=args.error_rate, throttle_rate=args.throttle_rate,
+        limit_scale=args.limit_scale, assets=args.assets, positions=args.positions, churn=args.churn,
+    ))
+    url = simulator.serve()
+    accounts = make_accounts(args.accounts, args.venues.split(','), url)
+    shared = init_shared(accounts, public_config=simulated_config({'exchange_id': 'binance'}, url))
+
+    scheduler = BackgroundScheduler(executors={'default': ThreadPoolExecutor(args.workers)}, job_defaults=JOB_DEFAULTS)
+    monitor = CycleMonitor()
+    monitor.listen(scheduler)
+    durations: List[float] = []
+    lock = threading.Lock()
+    jobs = [
+        (account.user, account.section, timed(make_update_job(account, init_account(account), shared), durations, lock))
+        for account in accounts
+    ]
+    schedule_cycles(scheduler, jobs, args.interval, monitor, args.deadline)
+
+    store = get_store()
+    rows, batches, requests = rows_written(), DB_WRITE_SECONDS.count(), simulator.stats.requests
+    start = time.monotonic()
+    scheduler.start()
+    time.sleep(args.duration)
+    scheduler.shutdown(wait=True)
+    store.flush()
+    elapsed = time.monotonic() - start
+
+    cycles = monitor.summary().values()
+    report: Dict[str, Any] = {
+        'accounts': args.accounts,
+        'seconds': round(elapsed, 1),
+        'cycles': len(durations),
+        'cycles_per_second': round(len(durations) / elapsed, 2),
+        'failed': sum(stats['failures'] for stats in cycles),
+        'late': sum(stats['late'] for stats in cycles),
+        'skipped': sum(stats['skipped'] for stats in cycles),
+        'missed': sum(stats['missed'] for stats in cycles),
+        'cycle_seconds': {f"p{q}": round(percentile(durations, q), 3) for q in (50, 90, 99)},
+        'max_cycle_seconds': round(max(durations, default=0.0), 3),
+        'requests_per_second': round((simulator.stats.requests - requests) / elapsed, 1),
+        'exchange_errors': simulator.stats.errors,
+        'rate_limited': simulator.stats.throttled,
+        'rate_limit_waits': get_governor().stats()['waits'],
+        'db_batches_per_second': round((DB_WRITE_SECONDS.count() - batches) / elapsed, 1),
+        'db_rows_per_second': round((rows_written() - rows) / elapsed, 1),
+    }
+    simulator.shutdown()
+    for key, value in report.items():
+        print(f"{key}: {value}")
+    if output:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
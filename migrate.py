@@ -0,0 +1,24 @@
+import argparse
+
+from utils.migration import migrate
+from utils.storage import DB_PATH, connect
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Import the per-user tables into the normalized equity/balances/positions schema')
+    parser.add_argument('--db', default=DB_PATH, help='database file to migrate')
+    parser.add_argument('--keep', action='store_true', help='leave the per-user tables in place instead of renaming them to legacy_*')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    conn = connect(args.db)
+    users = migrate(conn, keep=args.keep)
+    conn.close()
+    if not users:
+        print("No per-user tables found")
+
+
+if __name__ == '__main__':
+    main()
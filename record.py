@@ -0,0 +1,42 @@
+import argparse
+
+import utils.binance as binance_utils
+import utils.binance_classic as binance_classic_utils
+import utils.bybit as bybit_utils
+from utils.accounts import BINANCE, BYBIT, init_account, load_accounts
+from utils.constants import CONFIG
+from utils.replay import Recording, record
+from utils.storage import get_store
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Record the raw exchange responses of one account's update cycle for replay")
+    parser.add_argument('section', help='config section of the account')
+    parser.add_argument('output', help='JSON file to write the recording to')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    account = next((a for a in load_accounts(CONFIG) if a.section == args.section), None)
+    if account is None:
+        raise SystemExit(f"No account with API keys in section {args.section}")
+
+    recording = Recording(account.venue)
+    exchange = record(init_account(account), recording)
+    # No shared caches, so prices and markets come from the recorded exchange too
+    if account.venue == BYBIT:
+        bybit_utils.update_data(exchange, account.user)
+    elif account.venue == BINANCE:
+        binance_utils.update_data(exchange, account.user)
+    else:
+        symbols = binance_classic_utils.get_valid_usdt_symbols(exchange)
+        binance_classic_utils.update_data(account.user, exchange, symbols)
+    get_store().flush()
+
+    recording.save(args.output)
+    print(f"Recorded {sum(len(calls) for calls in recording.calls.values())} responses to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+import os
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+
+pytestmark = pytest.mark.benchmark
+
+from utils.accounts import BINANCE, BINANCE_CLASSIC, BYBIT
+from utils.simulator import Simulator, SimulatorConfig
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# A fresh interpreter that sets up one account the way the daemon does and
+# exits after its first cycle is committed
+FIRST_CYCLE = """
+import sys
+from utils.accounts import Account, exchange_config, init_account, init_shared, make_update_job
+from utils.simulator import simulated_config
+from utils.storage import get_store
+
+venue, url = sys.argv[1:]
+account = Account('startup', 'startup', venue, simulated_config(exchange_config(venue, 'key', 'secret'), url))
+shared = init_shared([account], public_config=simulated_config({'exchange_id': 'binance'}, url))
+make_update_job(account, init_account(account), shared)()
+get_store().flush()
+"""
+
+
+@pytest.fixture(scope='module')
+def simulator():
+    simulator = Simulator(SimulatorConfig(latency='fixed:0.05', assets=50, positions=50, markets=2000))
+    simulator.serve()
+    yield simulator
+    simulator.shutdown()
+
+@pytest.mark.parametrize('markets', ('cold', 'cached'))
+@pytest.mark.parametrize('venue', (BYBIT, BINANCE, BINANCE_CLASSIC))
+def test_time_to_first_write(benchmark, simulator, tmp_path, venue, markets):
+    """
+    Seconds from starting a process to its first committed cycle, including
+    the interpreter and imports. 'cold' starts without .cache and downloads
+    markets first; 'cached' starts from the snapshots the previous run left.
+    """
+    env = dict(os.environ, PYTHONPATH=ROOT)
+
+    def clear_cache():
+        if markets == 'cold':
+            shutil.rmtree(tmp_path / '.cache', ignore_errors=True)
+
+    def start():
+        subprocess.run([sys.executable, '-c', FIRST_CYCLE, venue, simulator.url], cwd=tmp_path, env=env, check=True, capture_output=True)
+
+    benchmark.group = 'startup'
+    benchmark.extra_info['markets'] = markets
+    benchmark.pedantic(start, setup=clear_cache, rounds=3, warmup_rounds=1)
+    assert (tmp_path / 'trading_data.db').exists()
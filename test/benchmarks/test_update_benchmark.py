@@ -0,0 +1,49 @@
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+
+pytestmark = pytest.mark.benchmark
+
+import utils.binance as binance_utils
+import utils.binance_classic as binance_classic_utils
+import utils.bybit as bybit_utils
+import utils.storage as storage
+from utils.accounts import BINANCE, BINANCE_CLASSIC, BYBIT
+from utils.replay import SYNTHETIC, ReplayExchange
+from utils.storage import Store
+
+SIZES = (1, 10, 100, 1000, 5000)
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = Store(str(tmp_path / 'trading_data.db'))
+    monkeypatch.setattr(storage, '_store', store)
+    yield store
+    store.close()
+
+def make_update(venue, exchange):
+    if venue == BYBIT:
+        return lambda: bybit_utils.update_data(exchange, 'bench')
+    if venue == BINANCE:
+        return lambda: binance_utils.update_data(exchange, 'bench')
+    symbols = set(binance_classic_utils.get_valid_usdt_symbols(exchange))
+    return lambda: binance_classic_utils.update_data('bench', exchange, symbols)
+
+@pytest.mark.parametrize('size', SIZES)
+@pytest.mark.parametrize('venue', (BYBIT, BINANCE, BINANCE_CLASSIC))
+def test_update_data(benchmark, store, venue, size):
+    """
+    One replayed update cycle, from the ccxt responses to the committed
+    transaction. The warmup round inserts every row; the timed rounds see an
+    unchanged portfolio, like most cycles in production.
+    """
+    update = make_update(venue, ReplayExchange(SYNTHETIC[venue](size)))
+
+    def cycle():
+        update()
+        store.flush()
+
+    benchmark.group = venue
+    benchmark.extra_info['size'] = size
+    benchmark.pedantic(cycle, rounds=max(5, 1000 // size), warmup_rounds=1)
@@ -0,0 +1,45 @@
+from typing import Any, Dict, Optional
+
+import pytest
+
+from utils.schema import BALANCES, POSITIONS
+from utils.storage import Batch, Store
+
+
+def pytest_collection_modifyitems(config, items):
+    """Skip benchmarks unless they were asked for, so the default run stays fast."""
+    if 'benchmark' in (config.getoption('markexpr') or '') or config.getoption('benchmark_only', default=False):
+        return
+    skip = pytest.mark.skip(reason='benchmark; run with -m benchmark or --benchmark-only')
+    for item in items:
+        if item.get_closest_marker('benchmark'):
+            item.add_marker(skip)
+
+
+def write_batch(store: Store, ts: int, account: str = 'user', venue: str = 'binance', wallet_type: str = 'um',
+                positions: Optional[Dict[str, Any]] = None, balances: Optional[Dict[str, Any]] = None,
+                holdings: Optional[Dict[str, float]] = None, equity: Optional[float] = None, notional: Optional[float] = None):
+    """Write one batch of a wallet's rows and wait until it is committed."""
+    batch = Batch(account, venue, ts)
+    if positions is not None:
+        batch.sync(POSITIONS, wallet_type, positions)
+    if balances is not None:
+        batch.sync(BALANCES, wallet_type, balances)
+    if holdings is not None:
+        batch.hold(wallet_type, holdings)
+    values = {name: value for name, value in (('equity', equity), ('notional', notional)) if value is not None}
+    if values:
+        batch.record_equity(wallet_type, **values)
+    store.write(batch).result()
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = Store(str(tmp_path / 'trading_data.db'))
+    yield store
+    store.close()
+
+
+@pytest.fixture
+def write():
+    return write_batch
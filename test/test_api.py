@@ -0,0 +1,89 @@
+import http.client
+import json
+import threading
+import time
+
+import pytest
+
+from utils.api import serve_api, store_service
+from utils.metrics import API_REQUESTS
+
+
+@pytest.fixture
+def client(store):
+    server = serve_api(store_service(store), 0)
+    conn = http.client.HTTPConnection('127.0.0.1', server.server_address[1], timeout=5)
+
+    def get(path, etag=None):
+        conn.request('GET', path, headers={'If-None-Match': etag} if etag else {})
+        response = conn.getresponse()
+        body = response.read()
+        return response.status, response.getheader('ETag'), json.loads(body) if response.status == 200 else None
+
+    yield get
+    conn.close()
+    server.shutdown()
+
+
+def misses(endpoint):
+    return API_REQUESTS.value(endpoint=endpoint, result='miss')
+
+def test_resources(store, client, write):
+    start = int(time.time()) // 60 * 60 - 3600
+    for ts in range(start, start + 600, 60):
+        write(store, ts, account='a', positions={'BTCUSDT': (1.0, 2.0, 100.0)}, equity=float(ts - start))
+    write(store, start + 600, account='b', equity=5.0)
+
+    status, _, accounts = client('/accounts')
+    assert status == 200
+    assert [(row['account'], row['ts'], row['equity']) for row in accounts] == [('a', start + 540, 540.0), ('b', start + 600, 5.0)]
+    assert client('/accounts/a/positions')[2] == [
+        {'venue': 'binance', 'wallet_type': 'um', 'symbol': 'BTCUSDT', 'ts': start, 'contracts': 1.0, 'unrealized_pnl': 2.0, 'notional': 100.0},
+    ]
+    assert client('/accounts/a/balances')[2] == []
+    history = client(f'/accounts/a/equity?start={start}&end={start + 300}')[2]
+    assert history['resolution'] == 0 and [row['close'] for row in history['rows']] == [0.0, 60.0, 120.0, 180.0, 240.0, 300.0]
+    # Downsampled to the finest rollup that fits the requested number of points
+    history = client(f'/accounts/a/equity?start={start}&end={start + 600}&points=2')[2]
+    assert history['resolution'] == 300 and [row['close'] for row in history['rows']][-1] == 540.0
+    assert client('/exposure')[2][0]['asset'] == 'BTC'
+    assert client('/nothing')[0] == 404
+    assert client('/accounts/a/equity?start=x')[0] == 400
+    assert client('/accounts/a/equity?points=0')[0] == 400
+
+def test_cached_until_the_account_writes(store, client, write):
+    write(store, 100, account='a', positions={'BTCUSDT': (1.0, 2.0, 100.0)})
+    write(store, 100, account='b', positions={'ETHUSDT': (1.0, 2.0, 100.0)})
+    before = misses('positions')
+    _, etag, _ = client('/accounts/a/positions')
+    for _ in range(20):
+        assert client('/accounts/a/positions')[1] == etag
+    assert client('/accounts/a/positions', etag)[0] == 304
+    assert misses('positions') == before + 1
+
+    # Another account's write leaves the cache alone
+    write(store, 200, account='b', positions={'ETHUSDT': (2.0, 2.0, 200.0)})
+    assert client('/accounts/a/positions', etag)[0] == 304
+    assert misses('positions') == before + 1
+
+    # A write that changes nothing is a rebuild with the same ETag
+    write(store, 200, account='a', positions={'BTCUSDT': (1.0, 2.0, 100.0)})
+    assert client('/accounts/a/positions', etag)[0] == 304
+    assert misses('positions') == before + 2
+
+    write(store, 300, account='a', positions={'BTCUSDT': (3.0, 2.0, 300.0)})
+    status, new_etag, positions = client('/accounts/a/positions', etag)
+    assert status == 200 and new_etag != etag and positions[0]['contracts'] == 3.0
+
+def test_concurrent_misses_run_one_query(store, write):
+    write(store, 100, account='a', equity=1.0)
+    service = store_service(store)
+    built = []
+    build = service.build
+    service.build = lambda path: built.append(path) or build(path)
+    threads = [threading.Thread(target=service.get, args=('/accounts',)) for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert built == ['/accounts']
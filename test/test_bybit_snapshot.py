@@ -0,0 +1,42 @@
+from utils.bybit import POSITIONS_PAGE_SIZE, fetch_snapshot, parse_snapshot
+
+
+def position(symbol, cursor=None):
+    info = {'symbol': symbol}
+    if cursor:
+        info['nextPageCursor'] = cursor
+    return {'symbol': symbol, 'side': 'long', 'contracts': 1.0, 'notional': 10.0, 'unrealizedPnl': 0.5, 'info': info}
+
+class FakeExchange:
+    def __init__(self, total):
+        self.symbols = [f"C{i}/USDT:USDT" for i in range(total)]
+        self.calls = []
+
+    def fetch_balance(self):
+        self.calls.append('fetch_balance')
+        return {'info': {'result': {'list': [{'totalEquity': '123.4'}]}}, 'free': {'USDT': 100.0}}
+
+    def fetch_positions(self, params):
+        self.calls.append(('fetch_positions', params.get('cursor')))
+        start = int(params.get('cursor') or 0)
+        end = start + params['limit']
+        page = [position(symbol) for symbol in self.symbols[start:end]]
+        if page and end < len(self.symbols):
+            page[0] = position(page[0]['symbol'], str(end))
+        return page
+
+def test_snapshot_fetches_balance_once_and_every_page():
+    exchange = FakeExchange(2 * POSITIONS_PAGE_SIZE + 5)
+    snapshot = fetch_snapshot(exchange)
+
+    assert exchange.calls.count('fetch_balance') == 1
+    assert [call[1] for call in exchange.calls if call != 'fetch_balance'] == [None, '200', '400']
+    state = parse_snapshot(snapshot)
+    assert state.equity == 123.4
+    assert state.balances == {'USDT': 100.0}
+    assert len(state.positions) == 2 * POSITIONS_PAGE_SIZE + 5
+
+def test_single_page():
+    exchange = FakeExchange(3)
+    assert len(fetch_snapshot(exchange).positions) == 3
+    assert len(exchange.calls) == 2
@@ -0,0 +1,121 @@
+import http.client
+import json
+import threading
+
+from utils.events import Event, EventBus, serve_events
+from utils.storage import Store
+
+
+def kinds(events):
+    return [(event.seq, event.type, event.key) for event in events]
+
+def test_typed_events_from_the_diff(store, write):
+    received = []
+    store.events.subscribe(received.append)
+    write(store, 100, positions={'BTCUSDT': (1.0, 5.0, 100.0)}, balances={'USDT': (10.0, 10.0, 0.0, None)}, equity=110.0)
+    write(store, 101, positions={'BTCUSDT': (1.0, 5.0, 100.0)}, balances={'USDT': (10.0, 10.0, 0.0, None)})
+    write(store, 102, positions={'BTCUSDT': (1.0, 7.0, 102.0), 'ETHUSDT': (2.0, 0.0, 50.0)})
+    write(store, 103, positions={'BTCUSDT': (3.0, 7.0, 300.0)})
+
+    assert kinds(received) == [
+        (1, 'equity_sample', None),
+        (2, 'position_opened', 'BTCUSDT'),
+        (3, 'balance_changed', 'USDT'),
+        (4, 'position_updated', 'BTCUSDT'),
+        (5, 'position_opened', 'ETHUSDT'),
+        (6, 'position_resized', 'BTCUSDT'),
+        (7, 'position_closed', 'ETHUSDT'),
+    ]
+    assert received[0].values == {'equity': 110.0}
+    assert received[5].previous == {'contracts': 1.0, 'unrealized_pnl': 7.0, 'notional': 102.0}
+    assert received[6].values is None and received[6].previous['contracts'] == 2.0
+
+def test_resume_from_memory_or_the_table(tmp_path, write):
+    store = Store(str(tmp_path / 'trading_data.db'))
+    for ts in range(100, 110):
+        write(store, ts, equity=float(ts))
+    assert [event.seq for event in store.events.read(7)] == [8, 9, 10]
+    assert [event.seq for event in store.events.read(2, limit=3)] == [3, 4, 5]
+    assert store.events.read(10) == []
+
+    replayed = []
+    store.events.subscribe(replayed.append, since=8)
+    write(store, 110, equity=1.0)
+    assert [event.seq for event in replayed] == [9, 10, 11]
+    store.close()
+
+    # A restarted store continues the sequence and serves older events from disk
+    reopened = Store(str(tmp_path / 'trading_data.db'))
+    try:
+        assert reopened.events.last_seq == 11
+        assert [(event.seq, event.values) for event in reopened.events.read(9)] == [(10, {'equity': 109.0}), (11, {'equity': 1.0})]
+        write(reopened, 111, equity=2.0)
+        assert reopened.events.read(11)[0].seq == 12
+    finally:
+        reopened.close()
+
+def test_replay_does_not_block_publishing():
+    bus = EventBus(lambda: None)
+    bus.publish([Event(seq, 100, 'equity_sample', 'user', 'binance', 'um', None, {'equity': 1.0}) for seq in (1, 2)])
+    received = []
+
+    def callback(event):
+        received.append(event.seq)
+        if event.seq == 1:
+            # The writer publishes while a consumer is still replaying
+            publisher = threading.Thread(target=bus.publish, args=([Event(3, 101, 'equity_sample', 'user', 'binance', 'um', None, None)],))
+            publisher.start()
+            publisher.join(5)
+            assert not publisher.is_alive()
+
+    bus.subscribe(callback, since=0)
+    bus.publish([Event(4, 102, 'equity_sample', 'user', 'binance', 'um', None, None)])
+    assert received == [1, 2, 3, 4]
+
+def test_reads_from_a_full_buffer():
+    bus = EventBus(lambda: None, buffer_size=4)
+    for seq in range(1, 11):
+        bus.publish([Event(seq, 100, 'equity_sample', 'user', 'binance', 'um', None, None)])
+    assert [event.seq for event in bus.read(6)] == [7, 8, 9, 10]
+    assert [event.seq for event in bus.read(8, limit=1)] == [9]
+
+def test_sequence_survives_pruning_every_event(tmp_path, write):
+    store = Store(str(tmp_path / 'trading_data.db'))
+    for ts in range(100, 105):
+        write(store, ts, equity=float(ts))
+    store.prune().result()
+    assert store.conn.execute("SELECT count(*) FROM events").fetchone() == (0,)
+    store.close()
+
+    # A consumer holding Last-Event-ID 5 sees the next event
+    reopened = Store(str(tmp_path / 'trading_data.db'))
+    try:
+        assert reopened.events.last_seq == 5
+        write(reopened, 200, equity=1.0)
+        assert [event.seq for event in reopened.events.read(5)] == [6]
+    finally:
+        reopened.close()
+
+def test_server_sent_events(store, write):
+    write(store, 100, positions={'BTCUSDT': (1.0, 5.0, 100.0)})
+    write(store, 101, positions={'BTCUSDT': (1.0, 5.0, 100.0)}, account='other')
+    write(store, 102, equity=5.0)
+    server = serve_events(store.events, 0)
+    try:
+        conn = http.client.HTTPConnection('127.0.0.1', server.server_address[1], timeout=5)
+        conn.request('GET', '/events?account=user', headers={'Last-Event-ID': '0'})
+        response = conn.getresponse()
+        assert response.status == 200
+        assert response.getheader('Content-Type') == 'text/event-stream'
+        frames = []
+        while len(frames) < 2:
+            frame = {}
+            for line in iter(response.readline, b'\n'):
+                field, _, value = line.decode().rstrip('\n').partition(': ')
+                frame[field] = value
+            frames.append(frame)
+        assert [(frame['id'], frame['event']) for frame in frames] == [('1', 'position_opened'), ('3', 'equity_sample')]
+        assert json.loads(frames[1]['data'])['values'] == {'equity': 5.0}
+        conn.close()
+    finally:
+        server.shutdown()
@@ -0,0 +1,108 @@
+import random
+
+import pytest
+
+from utils import binance_classic, bybit
+from utils.exposure import EXPOSURE_VERSION, base_asset, exposure_asset, init_exposure, query_exposure
+from utils.schema import HOLDINGS, POSITIONS, set_meta
+from utils.storage import Batch, Store
+
+
+def exposure(store):
+    return {asset: (quantity, net, gross, positions) for asset, _, quantity, net, gross, positions in query_exposure(store.conn)}
+
+def test_base_asset():
+    assert {base_asset(symbol) for symbol in ('BTC', 'BTC/USDT:USDT', 'BTCUSDT', 'BTCUSD_PERP', 'BTCUSD_250328', 'BTC/USD:BTC')} == {'BTC'}
+    assert base_asset('1000PEPEUSDT') == base_asset('1000PEPE/USDT:USDT') == 'PEPE'
+    assert base_asset('1INCHUSDT') == '1INCH'
+    assert base_asset('USDT') == 'USDT' and base_asset('ETHFDUSD') == 'ETH'
+    assert base_asset('FDUSDUSDT') == 'FDUSD' and base_asset('TUSDUSDT') == 'TUSD'
+    # Held assets are never read as pairs, stablecoins ending in USD included
+    for asset in ('FDUSD', 'BUSD', 'TUSD', 'BFUSD', 'PYUSD', 'LUSD', 'USDT', 'BTC'):
+        assert exposure_asset(HOLDINGS, asset) == asset
+    assert exposure_asset(POSITIONS, 'BTCUSD_PERP') == 'BTC'
+
+def test_stablecoin_holdings_keep_their_asset(store, write):
+    write(store, 100, account='binance1', venue='binance', wallet_type='spot', holdings={'FDUSD': 100.0, 'BUSD': 50.0, 'PYUSD': 20.0})
+    assert exposure(store) == {'FDUSD': (100.0, 0.0, 0.0, 0), 'BUSD': (50.0, 0.0, 0.0, 0), 'PYUSD': (20.0, 0.0, 0.0, 0)}
+
+def test_net_exposure_across_venues(store, write):
+    write(store, 100, account='bybit1', venue='bybit', wallet_type='unified', positions={'BTC/USDT:USDT': (0.5, 1.0, 30000.0)})
+    write(store, 100, account='binance1', venue='binance', wallet_type='um', positions={'BTCUSDT': (-0.2, 0.0, 12000.0), 'ETHUSDT': (1.0, 0.0, 3000.0)})
+    write(store, 100, account='binance1', venue='binance', wallet_type='cm', positions={'BTCUSD_250328': (-10.0, 0.0, 1000.0)})
+    write(store, 100, account='binance2', venue='binance', wallet_type='spot', holdings={'BTC': 0.1, 'USDT': 500.0})
+    assert exposure(store) == {
+        'BTC': (0.1, 17000.0, 43000.0, 3),
+        'ETH': (0.0, 3000.0, 3000.0, 1),
+        'USDT': (500.0, 0.0, 0.0, 0),
+    }
+
+    write(store, 200, account='binance1', venue='binance', wallet_type='um', positions={'BTCUSDT': (-0.2, 0.0, 12000.0)})
+    write(store, 200, account='binance2', venue='binance', wallet_type='spot', holdings={'USDT': 300.0})
+    assert exposure(store) == {'BTC': (0.0, 17000.0, 43000.0, 3), 'USDT': (300.0, 0.0, 0.0, 0)}
+
+def test_updaters_hold_real_balances_across_venues(store):
+    batch = Batch('bybit1', 'bybit', 100)
+    bybit.write_total_equity(batch, 70000.0, {
+        'BTC': bybit.Coin('BTC', 1.0, 0.0, 60000.0),
+        'USDT': bybit.Coin('USDT', 10000.0, 0.0, 10000.0),
+    })
+    bybit.write_positions(batch, {'BTC/USDT:USDT': bybit.Position('BTC/USDT:USDT', 0.5, 0.0, 30000.0)})
+    store.write(batch).result()
+    batch = Batch('classic1', 'binance', 100)
+    binance_classic.update_total_equity_and_balance(
+        batch, {}, {'BTC': binance_classic.CmCoin('BTC', 0.0, 0.25, 60000.0)},
+        {'BTC': binance_classic.UmCoin('BTC', 0.0, 0.5, 60000.0), 'USDT': binance_classic.UmCoin('USDT', -10.0, 1000.0, 1.0)},
+        31000.0,
+    )
+    binance_classic.update_positions(
+        batch, {'BTCUSDT': binance_classic.UmPosition('BTCUSDT', -0.2, 0.0, -12000.0)},
+        {'BTCUSD_PERP': binance_classic.CmPosition('BTCUSD_PERP', -150.0, 0.0, 100.0)},
+    )
+    store.write(batch).result()
+
+    assert exposure(store) == {
+        'BTC': (pytest.approx(1.75), pytest.approx(30000.0 - 12000.0 - 15000.0), pytest.approx(57000.0), 3),
+        'USDT': (pytest.approx(10990.0), 0.0, 0.0, 0),
+    }
+    assert batch.equity['cm'] == {'equity': pytest.approx(15000.0), 'notional': 15000.0}
+
+def test_rebuilt_at_startup_only_for_another_version(tmp_path, write):
+    path = str(tmp_path / 'trading_data.db')
+    store = Store(path)
+    write(store, 100, account='a', venue='binance', wallet_type='um', positions={'BTCUSDT': (1.0, 0.0, 100.0)}, holdings={'BTC': 2.0})
+    with store.conn:
+        store.conn.execute("INSERT INTO exposure VALUES ('ETH', 1, 5.0, 0, 0, 0)")
+    store.close()
+
+    # The table is kept as is by a restart of the same version
+    store = Store(path)
+    assert exposure(store) == {'BTC': (2.0, 100.0, 100.0, 1), 'ETH': (5.0, 0.0, 0.0, 0)}
+    with store.conn:
+        set_meta(store.conn, 'exposure_version', EXPOSURE_VERSION - 1)
+    store.close()
+
+    # A row left behind by an older version is dropped by the rebuild
+    store = Store(path)
+    try:
+        assert exposure(store) == {'BTC': (2.0, 100.0, 100.0, 1)}
+    finally:
+        store.close()
+
+def test_deltas_match_a_full_recompute(tmp_path, store, write):
+    rng = random.Random(5)
+    symbols = ['BTCUSDT', 'ETH/USDT:USDT', 'SOLUSD_PERP', '1000PEPEUSDT', 'BTC/USDT:USDT']
+    wallets = [('a', 'binance', 'um'), ('b', 'bybit', 'unified'), ('c', 'binance', 'cm')]
+    for ts in range(100, 400):
+        account, venue, wallet_type = rng.choice(wallets)
+        positions = {symbol: (rng.uniform(-5, 5), 0.0, rng.uniform(0, 1000)) for symbol in rng.sample(symbols, rng.randint(0, 4))}
+        holdings = {asset: rng.uniform(0, 10) for asset in rng.sample(['BTC', 'ETH', 'USDT', 'PEPE'], 2)}
+        write(store, ts, account, venue, wallet_type, positions, holdings=holdings)
+    incremental = exposure(store)
+
+    store.conn.execute("DELETE FROM exposure")
+    init_exposure(store.conn)
+    recomputed = exposure(store)
+    assert incremental.keys() == recomputed.keys()
+    for asset, values in recomputed.items():
+        assert incremental[asset] == pytest.approx(values, abs=1e-6)
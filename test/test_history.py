@@ -0,0 +1,57 @@
+import random
+
+from utils.history import init_history, state_at
+from utils.schema import BALANCES, POSITIONS
+
+
+def versions(store):
+    return store.conn.execute("SELECT symbol, valid_from, valid_to, contracts FROM positions_history ORDER BY id").fetchall()
+
+def test_only_changes_are_recorded(store, write):
+    for ts in range(100, 160):
+        write(store, ts, positions={'BTCUSDT': (1.0, 5.0, 100.0)})
+    write(store, 200, positions={'BTCUSDT': (2.0, 5.0, 200.0), 'ETHUSDT': (-3.0, 0.0, 50.0)})
+    write(store, 300, positions={'ETHUSDT': (-3.0, 0.0, 50.0)})
+    assert versions(store) == [
+        ('BTCUSDT', 100, 200, 1.0),
+        ('BTCUSDT', 200, 300, 2.0),
+        ('ETHUSDT', 200, None, -3.0),
+    ]
+
+def test_book_at_any_timestamp(store, write):
+    write(store, 100, positions={'BTCUSDT': (1.0, 5.0, 100.0)})
+    write(store, 200, positions={'BTCUSDT': (2.0, 5.0, 200.0), 'ETHUSDT': (-3.0, 0.0, 50.0)})
+    write(store, 300, positions={'ETHUSDT': (-3.0, 0.0, 50.0)})
+    write(store, 150, account='other', positions={'SOLUSDT': (7.0, 1.0, 70.0)})
+
+    assert state_at(store.conn, POSITIONS, 'user', 99) == {}
+    assert state_at(store.conn, POSITIONS, 'user', 100) == {'um': {'BTCUSDT': (1.0, 5.0, 100.0)}}
+    assert state_at(store.conn, POSITIONS, 'user', 250) == {'um': {'BTCUSDT': (2.0, 5.0, 200.0), 'ETHUSDT': (-3.0, 0.0, 50.0)}}
+    assert state_at(store.conn, POSITIONS, 'user', 10 ** 10) == {'um': {'ETHUSDT': (-3.0, 0.0, 50.0)}}
+    assert state_at(store.conn, POSITIONS, 'other', 250, wallet_type='um') == {'um': {'SOLUSDT': (7.0, 1.0, 70.0)}}
+    assert state_at(store.conn, POSITIONS, 'nobody', 250) == {}
+
+def test_matches_replayed_snapshots_at_real_timestamps(store, write):
+    # Timestamps too large for the index's 32-bit floats to hold exactly
+    rng = random.Random(3)
+    snapshots = {}
+    book = {}
+    for ts in range(1_790_000_000, 1_790_000_000 + 3000, 7):
+        for symbol in rng.sample([f"S{i}" for i in range(20)], 3):
+            if rng.random() < 0.3:
+                book.pop(symbol, None)
+            else:
+                book[symbol] = (float(rng.randint(-5, 5)), 0.0, 1.0)
+        write(store, ts, positions=dict(book))
+        snapshots[ts] = dict(book)
+    for ts, expected in snapshots.items():
+        assert state_at(store.conn, POSITIONS, 'user', ts).get('um', {}) == expected
+        assert state_at(store.conn, POSITIONS, 'user', ts + 6).get('um', {}) == expected
+
+def test_existing_rows_are_seeded(store):
+    store.conn.execute("INSERT INTO balances VALUES ('old', 'bybit', 'unified', 'USDT', 50, 10.0, NULL, NULL, NULL)")
+    store.conn.commit()
+    init_history(store.conn)
+    init_history(store.conn)
+    assert state_at(store.conn, BALANCES, 'old', 60) == {'unified': {'USDT': (10.0, None, None, None)}}
+    assert store.conn.execute("SELECT count(*) FROM balances_history").fetchone()[0] == 1
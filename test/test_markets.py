@@ -0,0 +1,143 @@
+import asyncio
+import threading
+
+import utils.binance as binance_utils
+import utils.binance_async as binance_async_utils
+import utils.bybit as bybit_utils
+import utils.markets as markets
+from utils.accounts import BINANCE, BINANCE_CLASSIC, BYBIT, exchange_config
+from utils.markets import MARKET_ATTRIBUTES, MarketRegistry, get_contract_sizes
+from utils.simulator import Simulator, SimulatorConfig, simulated_config
+
+
+def serve():
+    simulator = Simulator(SimulatorConfig(latency='fixed:0', assets=5, positions=20))
+    simulator.serve()
+    return simulator
+
+def exchange(simulator, venue, key, init=binance_utils.init_exchange):
+    return init(simulated_config(exchange_config(venue, key, 'secret'), simulator.url))
+
+def test_instances_of_a_venue_share_one_copy_of_markets():
+    simulator = serve()
+    registry = MarketRegistry()
+    try:
+        accounts = [registry.attach(exchange(simulator, venue, f"key{i}")) for i, venue in enumerate([BINANCE, BINANCE_CLASSIC] * 3)]
+        bybit = [registry.attach(exchange(simulator, BYBIT, f"bybit{i}")) for i in range(3)]
+        for instance in accounts + bybit:
+            instance.load_markets()
+        bybit_utils.fetch_positions(bybit[2])
+        requests = simulator.stats.by_path['/fapi/v1/exchangeInfo']
+    finally:
+        simulator.shutdown()
+
+    assert requests == 1 and simulator.stats.by_path['/v5/market/instruments-info'] > 0
+    assert registry.loads == {'binance': 1, 'bybit': 1}
+    for name in MARKET_ATTRIBUTES:
+        assert all(getattr(instance, name) is getattr(accounts[0], name) for instance in accounts)
+        assert all(getattr(instance, name) is getattr(bybit[0], name) for instance in bybit)
+    assert accounts[0].markets is not bybit[0].markets
+
+def test_reload_swaps_every_instance_to_the_new_generation():
+    simulator = serve()
+    registry = MarketRegistry()
+    try:
+        first, second = (registry.attach(exchange(simulator, BINANCE, key)) for key in ('a', 'b'))
+        old = first.load_markets()
+        second.load_markets()
+        new = second.load_markets(reload=True)
+        late = registry.attach(exchange(simulator, BINANCE, 'c'))
+    finally:
+        simulator.shutdown()
+
+    assert new is not old and new.keys() == old.keys()
+    assert first.markets is second.markets is late.markets is new
+    assert first.markets_by_id is second.markets_by_id
+    assert registry.loads['binance'] == 2
+
+def test_async_instances_share_markets():
+    simulator = serve()
+    registry = MarketRegistry()
+    sync = registry.attach(exchange(simulator, BINANCE, 'sync'))
+
+    async def load():
+        instances = [registry.attach(exchange(simulator, BINANCE, f"async{i}", binance_async_utils.init_exchange)) for i in range(3)]
+        try:
+            await asyncio.gather(*(instance.load_markets() for instance in instances))
+        finally:
+            await asyncio.gather(*(instance.close() for instance in instances))
+        return instances
+
+    try:
+        instances = asyncio.run(load())
+    finally:
+        simulator.shutdown()
+    assert registry.loads['binance'] == 1
+    assert all(instance.markets is sync.markets for instance in instances)
+
+def test_restart_loads_markets_from_disk_and_refreshes_in_the_background(tmp_path):
+    simulator = serve()
+    try:
+        first = MarketRegistry(str(tmp_path))
+        markets = first.attach(exchange(simulator, BYBIT, 'a')).load_markets()
+        downloads = simulator.stats.by_path['/v5/market/instruments-info']
+
+        # A fresh cache is used as is, without asking the exchange
+        restarted = MarketRegistry(str(tmp_path))
+        cached = restarted.attach(exchange(simulator, BYBIT, 'b')).load_markets()
+        assert cached.keys() == markets.keys() and cached is not markets
+        for name in ('symbols', 'ids', 'codes'):
+            assert restarted.snapshots['bybit'][name] == first.snapshots['bybit'][name]
+        assert restarted.snapshots['bybit']['markets_by_id'].keys() == first.snapshots['bybit']['markets_by_id'].keys()
+        assert simulator.stats.by_path['/v5/market/instruments-info'] == downloads
+
+        stale = MarketRegistry(str(tmp_path), max_age=0)
+        instance = stale.attach(exchange(simulator, BYBIT, 'c'))
+        served = instance.load_markets()
+        assert served.keys() == markets.keys()
+        for thread in threading.enumerate():
+            if thread.name == 'markets-bybit':
+                thread.join()
+    finally:
+        simulator.shutdown()
+    assert simulator.stats.by_path['/v5/market/instruments-info'] == 2 * downloads
+    assert stale.loads['bybit'] == 2 and instance.markets is not served
+
+def test_lookups_are_derived_once_per_generation():
+    simulator = serve()
+    registry = MarketRegistry()
+    try:
+        first, second = (registry.attach(exchange(simulator, BINANCE_CLASSIC, key)) for key in ('a', 'b'))
+        lookups = registry.lookups('binance', first.load_markets())
+        shared = registry.lookups('binance', second.load_markets())
+        second.load_markets(reload=True)
+        reloaded = registry.lookups('binance', first.load_markets())
+    finally:
+        simulator.shutdown()
+
+    assert shared is lookups and lookups.contract_sizes and lookups.usdt_symbols
+    assert reloaded is not lookups and reloaded.markets is first.markets
+    assert reloaded.usdt_symbols == lookups.usdt_symbols
+
+
+class Exchange:
+    id = 'binance'
+
+    def __init__(self):
+        self.reloads = 0
+
+    def load_markets(self, reload=False, params={}):
+        self.reloads += reload
+        return {'BTC/USD:BTC': {'id': 'BTCUSD_PERP', 'spot': False, 'inverse': True, 'contractSize': 100, 'info': {}}}
+
+def test_unknown_contracts_reload_sparingly_and_are_skipped(monkeypatch):
+    monkeypatch.setattr(markets, '_registry', MarketRegistry())
+    exchange = Exchange()
+    res = [{'symbol': symbol, 'positionAmt': '1', 'entryPrice': '1', 'markPrice': '1', 'unRealizedProfit': '0',
+            'liquidationPrice': '0', 'leverage': '1', 'positionSide': 'BOTH', 'maxQty': '1', 'notionalValue': '1',
+            'breakEvenPrice': '1'} for symbol in ('BTCUSD_PERP', 'LUNAUSD_PERP')]
+    for _ in range(3):
+        contract_sizes = get_contract_sizes(exchange, [pos['symbol'] for pos in res])
+        assert binance_utils.parse_cm_position(res, contract_sizes).keys() == {'BTCUSD_PERP'}
+    # The delisted contract reloads the markets once, not on every cycle
+    assert exchange.reloads == 1
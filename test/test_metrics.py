@@ -0,0 +1,86 @@
+import time
+import urllib.request
+
+import ccxt
+
+from utils.metrics import DB_ROWS, EXCHANGE_REQUEST_SECONDS, STAGE_SECONDS, Counter, Histogram, Registry, current_account, instrument, serve
+from utils.prices import fetch_usdt_tickers
+from utils.schema import BALANCES
+from utils.storage import Batch, Store
+from utils.valuation import ValuationEngine, value_wallet
+
+
+def test_render_prometheus_and_openmetrics():
+    registry = Registry()
+    requests = registry.register(Counter('requests', 'Requests', ('venue',)))
+    latency = registry.register(Histogram('latency_seconds', 'Latency', ('venue',), buckets=(0.1, 1)))
+    requests.inc(venue='bybit')
+    requests.inc(2, venue='bybit')
+    latency.observe(0.5, venue='bybit')
+
+    text = registry.render()
+    assert '# TYPE requests_total counter' in text
+    assert 'requests_total{venue="bybit"} 3' in text
+    assert 'latency_seconds_bucket{venue="bybit",le="0.1"} 0' in text
+    assert 'latency_seconds_bucket{venue="bybit",le="1.0"} 1' in text
+    assert 'latency_seconds_bucket{venue="bybit",le="+Inf"} 1' in text
+    assert 'latency_seconds_count{venue="bybit"} 1' in text
+
+    openmetrics = registry.render(openmetrics=True)
+    assert '# TYPE requests counter' in openmetrics
+    assert openmetrics.endswith('# EOF\n')
+
+def test_exchange_calls_are_timed_per_endpoint():
+    exchange = ccxt.binance({'apiKey': 'key', 'secret': 'secret'})
+    exchange.fetch = lambda url, method='GET', headers=None, body=None: []
+    instrument(exchange, 'metrics-test', 'binance')
+    exchange.papi_get_balance()
+    assert EXCHANGE_REQUEST_SECONDS.count(account='metrics-test', venue='binance', endpoint='GET papi/balance') == 1
+
+def test_value_stage_times_valuation_not_ticker_requests():
+    exchange = ccxt.binance()
+    exchange.fetch_tickers = lambda symbols: {'BTC/USDT': {'last': 100.0}}
+    token = current_account.set('stage-test')
+    try:
+        tickers = fetch_usdt_tickers(exchange, ['BTC/USDT'])
+        assert STAGE_SECONDS.count(account='stage-test', stage='value') == 0
+        value_wallet(Batch('stage-test', 'binance'), 'spot', {'BTC': 1.0}, prices={'BTC': tickers['BTC/USDT']['last']},
+                     engine=ValuationEngine())
+        assert STAGE_SECONDS.count(account='stage-test', stage='value') == 1
+    finally:
+        current_account.reset(token)
+
+def test_enqueue_stage_excludes_the_cycle_body(tmp_path):
+    store = Store(str(tmp_path / 'trading_data.db'))
+    token = current_account.set('enqueue-test')
+    try:
+        with store.cycle('enqueue-test', 'binance'):
+            time.sleep(0.2)
+        assert STAGE_SECONDS.count(account='enqueue-test', stage='enqueue') == 1
+        assert STAGE_SECONDS.sum(account='enqueue-test', stage='enqueue') < 0.2
+    finally:
+        current_account.reset(token)
+        store.close()
+
+def test_store_counts_rows_by_operation(tmp_path):
+    store = Store(str(tmp_path / 'trading_data.db'))
+    before = {op: DB_ROWS.value(table='balances', op=op) for op in ('inserted', 'replaced', 'deleted')}
+    try:
+        for balances in ({'BTC': 1.0, 'ETH': 2.0}, {'BTC': 1.5}):
+            batch = Batch('user', 'binance')
+            batch.sync(BALANCES, 'spot', {asset: (balance, None, None, None) for asset, balance in balances.items()})
+            store.write(batch).result()
+    finally:
+        store.close()
+    after = {op: DB_ROWS.value(table='balances', op=op) - before[op] for op in before}
+    assert after == {'inserted': 2, 'replaced': 1, 'deleted': 1}
+
+def test_metrics_endpoint():
+    server = serve(port=0)
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}/metrics"
+        with urllib.request.urlopen(url) as response:
+            assert response.headers['Content-Type'].startswith('text/plain; version=0.0.4')
+            assert b'# TYPE exchange_request_seconds histogram' in response.read()
+    finally:
+        server.shutdown()
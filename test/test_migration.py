@@ -0,0 +1,88 @@
+import sqlite3
+
+import pytest
+
+from utils.migration import find_legacy_users, migrate
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(':memory:')
+    # Tables as created by the per-user init_db of each updater
+    conn.executescript('''
+        CREATE TABLE bybit1_total_equity (timestamp INTEGER, equity REAL);
+        CREATE TABLE bybit1_coin_balance (coin TEXT PRIMARY KEY, balance REAL);
+        CREATE TABLE bybit1_positions (symbol TEXT PRIMARY KEY, contracts REAL, unrealized_pnl REAL, notional REAL);
+        CREATE TABLE bybit1_total_notional (timestamp INTEGER, notional REAL);
+        INSERT INTO bybit1_total_equity VALUES (100, 1000.0), (160, 1010.0);
+        INSERT INTO bybit1_total_notional VALUES (100, 500.0), (161, 510.0);
+        INSERT INTO bybit1_coin_balance VALUES ('USDT', 900.0);
+        INSERT INTO bybit1_positions VALUES ('BTC/USDT:USDT', -0.01, 1.5, 500.0);
+
+        CREATE TABLE binance1_total_equity (timestamp INTEGER, equity REAL);
+        CREATE TABLE binance1_coin_balance (asset TEXT PRIMARY KEY, total_balance REAL, borrowed REAL ,um_balance REAL, cm_balance REAL);
+        CREATE TABLE binance1_cm_positions (symbol TEXT PRIMARY KEY, contracts REAL, unrealized_pnl REAL, notional REAL);
+        CREATE TABLE binance1_um_positions (symbol TEXT PRIMARY KEY, contracts REAL, unrealized_pnl REAL, notional REAL);
+        INSERT INTO binance1_total_equity VALUES (100, 2000.0);
+        INSERT INTO binance1_coin_balance VALUES ('BTC', 1.0, 0.0, 0.0, 1.0);
+        INSERT INTO binance1_cm_positions VALUES ('BTCUSD_PERP', -10, 0.0, 1000.0);
+
+        CREATE TABLE strat_total_equity (timestamp INTEGER, spot_equity REAL, um_equity REAL, cm_equity REAL);
+        CREATE TABLE strat_coin_balance (asset TEXT PRIMARY KEY, total_balance REAL);
+        CREATE TABLE strat_cm_coin_balance (asset TEXT PRIMARY KEY, wallet_balance REAL, unrealized_profit REAL, total_balance REAL);
+        CREATE TABLE strat_um_coin_balance (asset TEXT PRIMARY KEY, wallet_balance REAL, unrealized_profit REAL, total_balance REAL);
+        CREATE TABLE strat_cm_positions (symbol TEXT PRIMARY KEY, contracts REAL, unrealized_pnl REAL);
+        CREATE TABLE strat_um_positions (symbol TEXT PRIMARY KEY, contracts REAL, unrealized_pnl REAL);
+        INSERT INTO strat_total_equity VALUES (100, 10.0, 20.0, 30.0);
+        INSERT INTO strat_um_coin_balance VALUES ('USDT', 20.0, 1.0, 21.0);
+        INSERT INTO strat_um_positions VALUES ('BTCUSDT', 0.5, 1.0);
+    ''')
+    yield conn
+    conn.close()
+
+def test_find_legacy_users(conn):
+    assert find_legacy_users(conn) == {'bybit1': 'bybit', 'binance1': 'binance', 'strat': 'binance_classic'}
+
+def test_migrate_imports_and_renames(conn):
+    migrate(conn)
+
+    equity = conn.execute("SELECT account, wallet_type, ts, equity, notional FROM equity ORDER BY account, wallet_type, ts").fetchall()
+    assert equity == [
+        ('binance1', 'portfolio', 100, 2000.0, None),
+        ('bybit1', 'unified', 100, 1000.0, 500.0),
+        ('bybit1', 'unified', 160, 1010.0, None),
+        ('bybit1', 'unified', 161, None, 510.0),
+        ('strat', 'cm', 100, 30.0, None),
+        ('strat', 'spot', 100, 10.0, None),
+        ('strat', 'um', 100, 20.0, None),
+    ]
+    assert conn.execute("SELECT account, wallet_type, asset, balance FROM balances ORDER BY account, wallet_type").fetchall() == [
+        ('binance1', 'cm', 'BTC', 1.0),
+        ('binance1', 'portfolio', 'BTC', 1.0),
+        ('bybit1', 'unified', 'USDT', 900.0),
+        ('strat', 'um', 'USDT', 21.0),
+    ]
+    assert conn.execute("SELECT count(*) FROM positions").fetchone() == (3,)
+
+    assert find_legacy_users(conn) == {}
+    migrate(conn)
+    assert conn.execute("SELECT count(*) FROM equity").fetchone() == (7,)
+
+def test_migrate_keeps_rollups_of_pruned_samples(conn):
+    migrate(conn)
+    # Buckets whose raw samples were pruned long ago, and a live account's
+    conn.execute("INSERT INTO equity_rollup VALUES ('old', 'bybit', 'unified', 86400, 0, 1, 2, 0.5, 1.5, NULL, NULL, NULL, NULL)")
+    conn.execute("INSERT INTO equity VALUES ('live', 'bybit', 'unified', 100, 50.0, NULL)")
+    conn.executescript('''
+        CREATE TABLE late_total_equity (timestamp INTEGER, equity REAL);
+        CREATE TABLE late_coin_balance (coin TEXT PRIMARY KEY, balance REAL);
+        CREATE TABLE late_positions (symbol TEXT PRIMARY KEY, contracts REAL, unrealized_pnl REAL, notional REAL);
+        CREATE TABLE late_total_notional (timestamp INTEGER, notional REAL);
+        INSERT INTO late_total_equity VALUES (400, 7.0), (500, 9.0);
+    ''')
+    assert migrate(conn) == {'late': 'bybit'}
+
+    rollups = {account: (open, close) for account, open, close in conn.execute(
+        "SELECT account, open, close FROM equity_rollup WHERE resolution = 86400 AND wallet_type = 'unified'")}
+    # Only the imported account is backfilled; the rest keep their buckets
+    assert rollups == {'bybit1': (1000.0, 1010.0), 'late': (7.0, 9.0), 'old': (1.0, 1.5)}
@@ -0,0 +1,96 @@
+import re
+
+import ccxt
+import orjson
+
+from utils import binance, binance_classic
+from utils.binance import fetch_um_position
+from utils.binance_classic import query_spot_account_info
+from utils.markets import usdt_spot_symbols
+from utils.parsing import compact_futures_account, fast_json, is_zero, nonzero
+from utils.replay import ReplayExchange, Recording, synthetic_classic, synthetic_markets, synthetic_portfolio_margin
+
+NUMBER = re.compile(r'-?\d+(\.\d+)?([eE]-?\d+)?')
+# Recorded methods that request FAST_JSON_PATHS
+FAST_METHODS = (
+    'private_get_account', 'fapiPrivateV3GetAccount', 'dapiprivate_get_account',
+    'papi_get_balance', 'papi_get_um_positionrisk', 'papi_get_cm_positionrisk',
+)
+
+
+def as_numbers(value):
+    """A payload as orjson decodes it when the amounts are sent as JSON numbers."""
+    if isinstance(value, dict):
+        return {key: as_numbers(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [as_numbers(item) for item in value]
+    if isinstance(value, str) and NUMBER.fullmatch(value):
+        return orjson.loads(value)
+    return value
+
+def with_numbers(recording):
+    numeric = Recording(recording.venue)
+    for method, responses in recording.calls.items():
+        for response in responses:
+            numeric.add(method, as_numbers(response) if method in FAST_METHODS else response)
+    return numeric
+
+
+def test_is_zero():
+    assert all(is_zero(value) for value in ('0', '0.00000000', '-0.0', '.000', '', 0, 0.0, None))
+    assert not any(is_zero(value) for value in ('0.00000001', '-2.622', '10', '1e-8', 3, -0.5))
+
+def test_zero_rows_are_dropped_before_parsing():
+    rows = [
+        {'asset': 'BTC', 'free': '0.00000000', 'locked': '0.00000000'},
+        {'asset': 'ETH', 'free': '0.00000000', 'locked': '1.5'},
+        {'asset': 'USDT', 'free': '12.0', 'locked': '0'},
+    ]
+    assert [row['asset'] for row in nonzero(rows, 'free', 'locked')] == ['ETH', 'USDT']
+
+    res = {'assets': [{'asset': 'BNB', 'walletBalance': '0.0'}], 'positions': [{'symbol': 'BTCUSDT', 'positionAmt': '-2.622'}], 'totalWalletBalance': '1'}
+    compact = compact_futures_account(res)
+    assert compact['assets'] == [] and compact['positions'] == res['positions']
+    assert compact['totalWalletBalance'] == '1' and len(res['assets']) == 1
+
+def test_fetchers_only_build_records_for_non_zero_rows():
+    spot = {'balances': [{'asset': f"C{i}", 'free': '0.00000000', 'locked': '0.00000000'} for i in range(1000)]}
+    spot['balances'].append({'asset': 'USDT', 'free': '5.0', 'locked': '0'})
+    flat = {'symbol': 'ETHUSDT', 'positionAmt': '0.000', 'entryPrice': '0', 'markPrice': '0', 'unRealizedProfit': '0',
+            'liquidationPrice': '0', 'leverage': '20', 'positionSide': 'BOTH', 'maxNotionalValue': '0', 'notional': '0',
+            'breakEvenPrice': '0'}
+    recording = Recording('binance')
+    recording.add('private_get_account', spot)
+    recording.add('papi_get_um_positionrisk', [flat, dict(flat, symbol='BTCUSDT', positionAmt='0.5', notional='30000')])
+    exchange = ReplayExchange(recording)
+
+    assert list(query_spot_account_info(exchange, set())) == ['USDT']
+    assert list(fetch_um_position(exchange)) == ['BTCUSDT']
+
+def test_fast_json_decodes_account_responses_only():
+    exchange = fast_json(ccxt.binance())
+    body = '{"asset": "BTC", "free": "0.1", "updateTime": 1617939110373, "rate": 0.1}'
+
+    def decode(url):
+        return exchange.parse_json(exchange.on_rest_response(200, 'OK', url, 'GET', {}, body, {}, None))
+
+    assert decode('https://papi.binance.com/papi/v1/balance') == orjson.loads(body)
+    # ccxt's decoder keeps numbers as strings for the responses it parses itself
+    assert decode('https://api.binance.com/api/v3/ticker/24hr')['rate'] == '0.1'
+    assert exchange.parse_json('not json') is None
+
+def test_account_parsers_accept_numbers():
+    size = 20
+    symbols = usdt_spot_symbols(synthetic_markets(size))
+
+    def classic(recording):
+        exchange = ReplayExchange(recording)
+        return (binance_classic.query_spot_account_info(exchange, symbols), binance_classic.query_um_account_info(exchange, symbols),
+                binance_classic.query_cm_account_info(exchange, symbols))
+
+    def portfolio_margin(recording):
+        exchange = ReplayExchange(recording)
+        return binance.fetch_account_balance(exchange), binance.fetch_cm_position(exchange), binance.fetch_um_position(exchange)
+
+    for fetch, recording in ((classic, synthetic_classic(size)), (portfolio_margin, synthetic_portfolio_margin(size))):
+        assert fetch(with_numbers(recording)) == fetch(recording)
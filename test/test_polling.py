@@ -0,0 +1,43 @@
+from utils.polling import AdaptivePolicy, allocate
+from utils.schema import POSITIONS
+from utils.storage import Batch
+
+
+def batch(account, equity, positions):
+    batch = Batch(account, 'bybit')
+    batch.record_equity('unified', equity=equity)
+    batch.sync(POSITIONS, 'unified', {f"P{i}": (1.0, 0.0, 10.0) for i in range(positions)})
+    return batch
+
+def test_allocate_keeps_total_rate_within_bounds():
+    intervals = allocate({'a': 10.0, 'b': 1.0, 'c': 0.1, 'd': 0.1}, budget=4 / 60, min_interval=5, max_interval=300)
+    assert all(5 <= interval <= 300 for interval in intervals.values())
+    assert abs(sum(1 / interval for interval in intervals.values()) - 4 / 60) < 1e-9
+    assert intervals['a'] < intervals['b'] < intervals['c'] == intervals['d']
+
+def test_allocate_pins_to_bounds():
+    # b is pinned to the max interval and its unused share goes to a
+    intervals = allocate({'a': 100.0, 'b': 0.001}, budget=2 / 60, min_interval=20, max_interval=120)
+    assert intervals == {'a': 40.0, 'b': 120.0}
+    # A budget the bounds cannot use is capped at the min interval
+    assert allocate({'a': 1.0, 'b': 1.0}, budget=1.0, min_interval=20, max_interval=120) == {'a': 20.0, 'b': 20.0}
+
+def test_policy_favours_moving_accounts():
+    policy = AdaptivePolicy(base=60)
+    for account in ('active', 'open', 'idle'):
+        policy.add(account)
+    for equity in (1000, 1010, 995, 1020):
+        policy.observe(batch('active', equity, positions=3))
+        policy.observe(batch('open', 1000, positions=1))
+        policy.observe(batch('idle', 500, positions=0))
+
+    intervals = policy.intervals()
+    assert intervals['active'] < intervals['open'] < intervals['idle']
+    assert intervals['active'] >= 5 and intervals['idle'] <= 300
+    assert abs(sum(1 / policy.interval(account) for account in policy.accounts) - 3 / 60) < 1e-6
+
+def test_unknown_accounts_are_ignored():
+    policy = AdaptivePolicy(base=60)
+    policy.add('a')
+    policy.observe(batch('b', 1.0, positions=1))
+    assert policy.intervals() == {'a': 60.0}
@@ -0,0 +1,94 @@
+import asyncio
+
+import ccxt
+import ccxt.async_support
+import pytest
+
+from utils.ratelimit import Bucket, Limit, RateGovernor, install
+
+
+def binance(used_weight='0', error=None):
+    exchange = ccxt.binance({'apiKey': 'key', 'secret': 'secret', 'enableRateLimit': False})
+    calls = []
+
+    def fetch(url, method='GET', headers=None, body=None):
+        calls.append(url)
+        # As ccxt does: hand the response to on_rest_response, then keep its headers
+        headers = {'X-MBX-USED-WEIGHT-1M': used_weight, 'Retry-After': '7'}
+        exchange.on_rest_response(200, 'OK', url, method, headers, '[]', headers, body)
+        exchange.last_response_headers = headers
+        if error:
+            raise error
+        return []
+
+    exchange.fetch = fetch
+    return exchange, calls
+
+def test_bucket_waits_for_next_window():
+    bucket = Bucket(Limit(100, 60))
+    assert bucket.reserve(50, now=120.0) == 0
+    assert bucket.reserve(50, now=130.0) == 50.0  # 90 is the budget after headroom
+    assert bucket.reserve(50, now=180.0) == 0
+    assert bucket.used == 50
+
+def test_requests_reserve_endpoint_weight():
+    governor = RateGovernor()
+    exchange, calls = binance()
+    install(exchange, governor, ip='egress-1')
+    exchange.papi_get_balance()
+    exchange.fapiPrivateV3GetAccount()
+    exchange.dapiprivate_get_account()
+
+    assert len(calls) == 3
+    used = governor.stats()['used']
+    assert used == {'binance:papi@egress-1': 20, 'binance:fapi@egress-1': 5, 'binance:dapi@egress-1': 5}
+
+def test_used_weight_header_wins_when_higher():
+    governor = RateGovernor()
+    exchange, _ = binance(used_weight='4000')
+    install(exchange, governor)
+    exchange.papi_get_balance()
+    assert governor.stats()['used'] == {'binance:papi@default': 4000}
+    # A second account on the same IP now sees the shared usage
+    delay, _ = governor.reserve('binance:papi', 'default', 2000)
+    assert delay > 0
+
+def test_rate_limit_error_blocks_bucket():
+    governor = RateGovernor()
+    exchange, _ = binance(error=ccxt.DDoSProtection('418'))
+    install(exchange, governor)
+    with pytest.raises(ccxt.DDoSProtection):
+        exchange.papi_get_balance()
+    delay, _ = governor.reserve('binance:papi', 'default', 1)
+    assert 6 < delay <= 7
+
+def test_concurrent_requests_observe_their_own_response():
+    governor = RateGovernor()
+    exchange = ccxt.async_support.binance({'apiKey': 'key', 'secret': 'secret', 'enableRateLimit': False})
+
+    async def fetch(url, method='GET', headers=None, body=None):
+        if 'balance' in url:
+            response = {'X-MBX-USED-WEIGHT-1M': '100', 'Retry-After': '7'}
+            exchange.on_rest_response(418, "I'm a teapot", url, method, response, '', headers, body)
+            exchange.last_response_headers = response
+            # Another request completes before this one raises
+            await asyncio.sleep(0.02)
+            raise ccxt.DDoSProtection('418')
+        await asyncio.sleep(0.01)
+        response = {'X-MBX-USED-WEIGHT-1M': '50'}
+        exchange.on_rest_response(200, 'OK', url, method, response, '[]', headers, body)
+        exchange.last_response_headers = response
+        return []
+
+    exchange.fetch = fetch
+    install(exchange, governor)
+
+    async def run():
+        return await asyncio.gather(exchange.papi_get_balance(), exchange.papi_get_um_positionrisk(), return_exceptions=True)
+
+    error, positions = asyncio.run(run())
+    assert isinstance(error, ccxt.DDoSProtection) and positions == []
+    assert governor.stats()['used'] == {'binance:papi@default': 100}
+    # The pause follows the Retry-After of the rate-limited response, not the latest one
+    delay, _ = governor.reserve('binance:papi', 'default', 1)
+    assert 6 < delay <= 7
@@ -0,0 +1,66 @@
+import asyncio
+
+import pytest
+
+import utils.binance as binance_utils
+import utils.binance_classic as binance_classic_utils
+import utils.bybit as bybit_utils
+import utils.bybit_async as bybit_async_utils
+import utils.storage as storage
+from utils.accounts import BYBIT
+from utils.replay import (
+    Recording, ReplayExchange, load_recording, record, sample_recording, synthetic_bybit, synthetic_classic,
+    synthetic_portfolio_margin,
+)
+from utils.storage import Store
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = Store(str(tmp_path / 'trading_data.db'))
+    monkeypatch.setattr(storage, '_store', store)
+    yield store
+    store.close()
+
+def rows(store, table):
+    return store.conn.execute(f"SELECT wallet_type, COUNT(*) FROM {table} GROUP BY wallet_type ORDER BY wallet_type").fetchall()
+
+def test_docstring_samples_replay_through_classic_updater(store):
+    exchange = ReplayExchange(sample_recording())
+    binance_classic_utils.update_data('classic', exchange, binance_classic_utils.get_valid_usdt_symbols(exchange))
+    store.flush()
+
+    equity = dict(store.conn.execute("SELECT wallet_type, equity FROM equity").fetchall())
+    assert equity['um'] == pytest.approx(199889.43675008 + 58.91394793)
+    assert equity['spot'] == 0
+    positions = store.conn.execute("SELECT wallet_type, symbol, contracts FROM positions").fetchall()
+    assert positions == [('um', 'BTCUSDT', -2.622)]
+
+def test_synthetic_portfolios_have_the_requested_size(store):
+    size = 450
+    bybit_utils.update_data(ReplayExchange(synthetic_bybit(size)), 'bybit')
+    binance_utils.update_data(ReplayExchange(synthetic_portfolio_margin(size)), 'pm')
+    classic = ReplayExchange(synthetic_classic(size))
+    binance_classic_utils.update_data('classic', classic, binance_classic_utils.get_valid_usdt_symbols(classic))
+    store.flush()
+
+    assert rows(store, 'positions') == [('cm', 2 * size), ('um', 2 * size), ('unified', size)]
+    assert dict(rows(store, 'balances'))['unified'] == size
+
+def test_replay_restarts_after_the_recorded_cycle():
+    exchange = ReplayExchange(synthetic_bybit(450))
+    first = bybit_utils.fetch_snapshot(exchange)
+    second = bybit_utils.fetch_snapshot(exchange)
+    assert exchange.calls['fetch_positions'] == 6
+    assert first == second
+
+def test_recording_round_trip(tmp_path, store):
+    # A replay stands in for the live exchange being recorded
+    recording = Recording(BYBIT)
+    bybit_utils.update_data(record(ReplayExchange(synthetic_bybit(3)), recording), 'bybit')
+    path = str(tmp_path / 'bybit.json')
+    recording.save(path)
+
+    replayed = ReplayExchange(load_recording(path), is_async=True)
+    asyncio.run(bybit_async_utils.update_data(replayed, 'bybit'))
+    assert replayed.calls == {'fetch_balance': 1, 'fetch_positions': 1}
@@ -0,0 +1,57 @@
+import sqlite3
+
+from utils.rollup import DAY, backfill_rollups, init_rollup, pick_resolution, prune, query_equity, update_rollups
+from utils.schema import init_schema
+
+NOW = 100 * DAY
+
+
+def make_conn():
+    conn = sqlite3.connect(':memory:')
+    init_schema(conn)
+    init_rollup(conn)
+    return conn
+
+def test_rollup_tracks_open_high_low_close():
+    conn = make_conn()
+    update_rollups(conn, [
+        ('user', 'bybit', 'unified', 0, 10.0, None),
+        ('user', 'bybit', 'unified', 60, 14.0, 5.0),
+        ('user', 'bybit', 'unified', 120, 8.0, None),
+        ('user', 'bybit', 'unified', 180, 12.0, 3.0),
+    ])
+    row = conn.execute(
+        "SELECT open, high, low, close, notional_open, notional_high, notional_close FROM equity_rollup WHERE resolution = 300"
+    ).fetchone()
+    assert row == (10.0, 14.0, 8.0, 12.0, 5.0, 5.0, 3.0)
+
+def test_backfill_matches_incremental():
+    conn = make_conn()
+    samples = [('user', 'binance', 'spot', ts, float(ts % 7), None) for ts in range(0, 7200, 60)]
+    conn.executemany("INSERT INTO equity VALUES (?, ?, ?, ?, ?, ?)", samples)
+    update_rollups(conn, samples)
+    incremental = conn.execute("SELECT * FROM equity_rollup ORDER BY 1, 2, 3, 4, 5").fetchall()
+
+    conn.execute("DELETE FROM equity_rollup")
+    backfill_rollups(conn)
+    assert conn.execute("SELECT * FROM equity_rollup ORDER BY 1, 2, 3, 4, 5").fetchall() == incremental
+
+def test_pick_resolution():
+    assert pick_resolution(NOW - 3600, NOW, now=NOW) == 0
+    assert pick_resolution(NOW - 3 * DAY, NOW, now=NOW) == 300
+    # Raw samples for the window are already pruned
+    assert pick_resolution(NOW - 10 * DAY, NOW - 10 * DAY + 3600, now=NOW) == 300
+    assert pick_resolution(NOW - 30 * DAY, NOW, now=NOW) == 3600
+    assert pick_resolution(0, NOW, now=NOW) == DAY
+
+def test_prune_keeps_rollups():
+    conn = make_conn()
+    samples = [('user', 'bybit', 'unified', ts, 1.0, None) for ts in (NOW - 8 * DAY, NOW - DAY)]
+    conn.executemany("INSERT INTO equity VALUES (?, ?, ?, ?, ?, ?)", samples)
+    update_rollups(conn, samples)
+
+    prune(conn, now=NOW)
+    assert conn.execute("SELECT ts FROM equity").fetchall() == [(NOW - DAY,)]
+    history = query_equity(conn, 'user', NOW - 9 * DAY, NOW, now=NOW)
+    assert history['resolution'] == 3600
+    assert [row[1] for row in history['rows']] == [NOW - 8 * DAY, NOW - DAY]
@@ -0,0 +1,64 @@
+import asyncio
+from collections import deque
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from apscheduler.events import EVENT_JOB_MAX_INSTANCES, EVENT_JOB_SUBMITTED, JobEvent, JobSubmissionEvent
+from apscheduler.schedulers.background import BackgroundScheduler
+
+from utils.polling import AdaptivePolicy
+from utils.scheduling import CycleMonitor, schedule_cycles, stagger_offsets
+
+
+def test_cycles_are_spread_over_the_interval():
+    assert stagger_offsets(4, 60) == [0, 15, 30, 45]
+
+    scheduler = BackgroundScheduler()
+    scheduler.start(paused=True)
+    try:
+        start = datetime.now(timezone.utc) + timedelta(hours=1)
+        jobs = [(f"user{i}", f"section{i}", lambda: None) for i in range(4)]
+        schedule_cycles(scheduler, jobs, 60, CycleMonitor(), start=start)
+        for i, job in enumerate(sorted(scheduler.get_jobs(), key=lambda job: job.id)):
+            offset = (job.next_run_time - start).total_seconds()
+            assert 15 * i <= offset <= 15 * i + 3.75
+            assert job.max_instances == 1 and job.coalesce
+    finally:
+        scheduler.shutdown(wait=False)
+
+def test_monitor_records_late_and_skipped_cycles():
+    monitor = CycleMonitor(late_after=5)
+    now = datetime.now(timezone.utc)
+    monitor.on_event(JobSubmissionEvent(EVENT_JOB_SUBMITTED, 'user1', 'default', [now - timedelta(seconds=1)]))
+    monitor.on_event(JobSubmissionEvent(EVENT_JOB_SUBMITTED, 'user1', 'default', [now - timedelta(seconds=12)]))
+    monitor.on_event(JobEvent(EVENT_JOB_MAX_INSTANCES, 'user1', 'default'))
+
+    stats = monitor.summary()['user1']
+    assert stats['late'] == 1 and stats['skipped'] == 1
+    assert stats['max_lag'] >= 12
+
+def test_async_cycle_is_cancelled_at_deadline():
+    monitor = CycleMonitor()
+
+    async def slow():
+        await asyncio.sleep(10)
+
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(monitor.wrap_async('user1', slow, 0.05)())
+    stats = monitor.summary()['user1']
+    assert stats == {**stats, 'runs': 1, 'failures': 1, 'overruns': 1}
+
+def test_adaptive_cycle_reschedules_from_policy():
+    scheduler = BackgroundScheduler()
+    scheduler.start(paused=True)
+    policy = AdaptivePolicy(base=60, min_interval=5, max_interval=300)
+    try:
+        schedule_cycles(scheduler, [('idle', 'idle', lambda: None)], 60, CycleMonitor(), policy=policy)
+        policy.positions['idle'] = 0
+        policy.equity['idle'] = deque([100.0, 100.0])
+        scheduler.get_job('idle').func()
+        delay = (scheduler.get_job('idle').next_run_time - datetime.now(timezone.utc)).total_seconds()
+        # A lone account keeps the whole budget, so it stays at the base interval
+        assert 55 < delay <= 60
+    finally:
+        scheduler.shutdown(wait=False)
@@ -0,0 +1,85 @@
+import random
+
+import ccxt
+import pytest
+
+import utils.binance as binance_utils
+import utils.binance_classic as binance_classic_utils
+import utils.bybit as bybit_utils
+import utils.storage as storage
+from utils.accounts import BINANCE, BINANCE_CLASSIC, BYBIT, exchange_config
+from utils.simulator import Simulator, SimulatorConfig, parse_latency, simulated_config
+from utils.storage import Store
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = Store(str(tmp_path / 'trading_data.db'))
+    monkeypatch.setattr(storage, '_store', store)
+    yield store
+    store.close()
+
+def serve(**config):
+    simulator = Simulator(SimulatorConfig(latency='fixed:0', **config))
+    simulator.serve()
+    return simulator
+
+def exchange(simulator, venue, key='key'):
+    return binance_utils.init_exchange(simulated_config(exchange_config(venue, key, 'secret'), simulator.url))
+
+def test_updaters_run_against_the_simulator(store):
+    simulator = serve(assets=5, positions=250)
+    try:
+        bybit_utils.update_data(exchange(simulator, BYBIT, 'a'), 'bybit')
+        binance_utils.update_data(exchange(simulator, BINANCE, 'b'), 'pm')
+        classic = exchange(simulator, BINANCE_CLASSIC, 'c')
+        binance_classic_utils.update_data('classic', classic, binance_classic_utils.get_valid_usdt_symbols(classic))
+        store.flush()
+    finally:
+        simulator.shutdown()
+
+    positions = store.conn.execute("SELECT account, wallet_type, COUNT(*) FROM positions GROUP BY 1, 2").fetchall()
+    assert sorted(positions) == [
+        ('bybit', 'unified', 250), ('classic', 'cm', 250), ('classic', 'um', 250), ('pm', 'cm', 250), ('pm', 'um', 250),
+    ]
+    assert simulator.stats.by_path['/v5/position/list'] == 2
+    assert simulator.stats.errors == simulator.stats.throttled == 0
+
+def test_request_weight_over_the_limit_is_rejected():
+    # 1% of 6000 leaves room for three papi balance calls of weight 20
+    simulator = serve(limit_scale=0.01)
+    try:
+        pm = exchange(simulator, BINANCE)
+        for _ in range(3):
+            pm.papi_get_balance()
+        assert pm.last_response_headers['x-mbx-used-weight-1m'] == '60'
+        with pytest.raises(ccxt.DDoSProtection):
+            pm.papi_get_balance()
+        assert int(pm.last_response_headers['Retry-After']) >= 1
+    finally:
+        simulator.shutdown()
+
+def test_errors_and_throttling_map_to_ccxt_exceptions():
+    simulator = serve(error_rate=1.0)
+    try:
+        with pytest.raises(ccxt.ExchangeNotAvailable):
+            exchange(simulator, BYBIT).private_get_v5_account_wallet_balance({'accountType': 'UNIFIED'})
+    finally:
+        simulator.shutdown()
+
+    simulator = serve(throttle_rate=1.0)
+    try:
+        with pytest.raises(ccxt.RateLimitExceeded):
+            exchange(simulator, BYBIT).private_get_v5_account_wallet_balance({'accountType': 'UNIFIED'})
+    finally:
+        simulator.shutdown()
+    assert simulator.stats.throttled == 1
+
+def test_latency_distributions():
+    rng = random.Random(1)
+    assert parse_latency('fixed:0.2')(rng) == 0.2
+    assert all(0.1 <= parse_latency('uniform:0.1:0.3')(rng) <= 0.3 for _ in range(100))
+    samples = sorted(parse_latency('lognormal:0.05:0.5')(rng) for _ in range(1001))
+    assert samples[500] == pytest.approx(0.05, rel=0.2)
+    with pytest.raises(ValueError):
+        parse_latency('pareto:1')
@@ -0,0 +1,131 @@
+import math
+import multiprocessing
+
+import pytest
+
+from utils.binance import Coin, UmPosition, fetch_total_equity_2, write_positions, write_total_equity_and_balance
+from utils.binance_classic import CmPosition, SpotCoin, UmPosition as ClassicUmPosition
+from utils.binance_classic import fetch_spot_equity, update_positions, update_total_equity_and_balance
+from utils.schema import BALANCES
+from utils.snapshot import SnapshotReader, SnapshotWriter
+from utils.storage import Batch, Store
+
+
+def pm_coin(asset, total, borrowed, um_pnl, cm_pnl, price):
+    return Coin(asset, total, 0.0, borrowed, 0.0, 0.0, 0.0, 0.0, um_pnl, 0.0, cm_pnl, price)
+
+def um_position(symbol, amount, pnl, notional):
+    return UmPosition(symbol, amount, 0.0, 0.0, pnl, 0.0, 10.0, 'BOTH', 0.0, notional, 0.0)
+
+PM = {'BTC': pm_coin('BTC', 1.0, 0.2, 0.01, -0.02, 60000.0), 'USDT': pm_coin('USDT', 5000.0, 100.0, 10.0, 0.0, 1)}
+SPOT = {'BTC': SpotCoin('BTC', 0.5, 0.1, 60000.0), 'USDT': SpotCoin('USDT', 1000.0, 0.0, 1)}
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'snapshot')
+
+def pm_batch(ts, positions):
+    batch = Batch('pm', 'binance', ts)
+    write_total_equity_and_balance(batch, PM)
+    write_positions(batch, {}, positions)
+    return batch
+
+def classic_batch(ts, um_positions, cm_positions):
+    batch = Batch('classic', 'binance', ts)
+    update_total_equity_and_balance(batch, SPOT, {}, {}, 123.0)
+    update_positions(batch, um_positions, cm_positions)
+    return batch
+
+def test_latest_state_of_every_wallet(path):
+    writer = SnapshotWriter(path, wallets=8, balances=16, positions=16)
+    reader = SnapshotReader(path)
+    writer.observe(pm_batch(100, {'BTCUSDT': um_position('BTCUSDT', 0.5, 3.0, 30000.0)}))
+    writer.observe(classic_batch(100, {'ETHUSDT': ClassicUmPosition('ETHUSDT', -2.0, 1.0, 6000.0)},
+                                 {'BTCUSD_PERP': CmPosition('BTCUSD_PERP', 3.0, -0.1, 100.0)}))
+    writer.observe(pm_batch(160, {}))
+
+    snapshot = reader.read()
+    assert snapshot.sequence == reader.sequence and not snapshot.truncated
+    assert snapshot.wallet('pm', 'binance', 'portfolio') == (pytest.approx(fetch_total_equity_2(PM)), 0.0)
+    assert snapshot.wallet('classic', 'binance', 'um') == (123.0, 6000.0)
+    assert all(math.isnan(value) for value in snapshot.wallet('nobody', 'bybit', 'unified'))
+    pm = snapshot.of('pm')
+    assert len(pm.positions) == 0
+    portfolio = pm.balances[pm.balances['wallet_type'] == b'portfolio']
+    assert sorted(portfolio['asset']) == [b'BTC', b'USDT']
+    # Unchanged rows keep the time they last changed
+    assert set(portfolio['ts']) == {100}
+    positions = snapshot.of('classic').positions
+    assert {(p['symbol'], p['contracts']) for p in positions} == {(b'ETHUSDT', -2.0), (b'BTCUSD_PERP', 3.0)}
+    assert positions[positions['symbol'] == b'BTCUSD_PERP']['notional'][0] == 300.0
+    reader.close()
+    writer.close()
+
+def test_follows_the_store_and_survives_restarts(tmp_path, path):
+    store = Store(str(tmp_path / 'trading_data.db'))
+    store.write(pm_batch(100, {'BTCUSDT': um_position('BTCUSDT', 0.5, 3.0, 30000.0)})).result()
+    writer = SnapshotWriter(path)
+    writer.seed(store.conn)
+    store.subscribe(writer.observe)
+    reader = SnapshotReader(path)
+    seeded = reader.read()
+    assert seeded.positions['symbol'].tolist() == [b'BTCUSDT']
+    assert seeded.wallet('pm', 'binance', 'portfolio')[0] == pytest.approx(fetch_total_equity_2(PM))
+
+    store.write(pm_batch(200, {})).result()
+    assert reader.sequence > seeded.sequence and len(reader.read().positions) == 0
+    store.close()
+    writer.close()
+
+    # A new writer with the same layout keeps the file, so the open reader follows it
+    writer = SnapshotWriter(path)
+    writer.observe(classic_batch(300, {}, {}))
+    assert reader.read().wallet('classic', 'binance', 'spot')[0] == pytest.approx(fetch_spot_equity(SPOT))
+    writer.close()
+    reader.close()
+
+def test_truncates_past_capacity(path):
+    writer = SnapshotWriter(path, wallets=8, balances=1, positions=16)
+    writer.observe(pm_batch(100, {}))
+    snapshot = SnapshotReader(path).read()
+    assert snapshot.truncated and len(snapshot.balances) == 1
+
+def test_stuck_writer_is_reported(path):
+    writer = SnapshotWriter(path)
+    writer.publish()
+    writer._mm[16] |= 1
+    with pytest.raises(TimeoutError):
+        SnapshotReader(path).read(timeout=0.05)
+    writer.close()
+
+def consistent_reads(path, reads, results):
+    reader = SnapshotReader(path)
+    for _ in range(reads):
+        snapshot = reader.read()
+        # Every publish writes one value to every row; a torn read would mix two
+        values = set(snapshot.balances['balance']) | set(snapshot.wallets['equity'])
+        if len(values) > 1:
+            results.put(f"torn read at {snapshot.sequence}: {values}")
+            return
+    results.put(None)
+
+def test_readers_in_other_processes_never_see_torn_writes(path):
+    writer = SnapshotWriter(path, wallets=64, balances=4096, positions=16)
+    writer.publish()
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    readers = [context.Process(target=consistent_reads, args=(path, 2000, results)) for _ in range(2)]
+    for reader in readers:
+        reader.start()
+    for i in range(1, 100000):
+        if all(not reader.is_alive() for reader in readers):
+            break
+        batch = Batch('user', 'binance', i)
+        for w in range(32):
+            batch.record_equity(f"w{w}", equity=float(i))
+            batch.sync(BALANCES, f"w{w}", {f"A{a}": (float(i), None, None, None) for a in range(100)})
+        writer.observe(batch)
+    assert [results.get(timeout=60) for _ in readers] == [None, None]
+    for reader in readers:
+        reader.join()
+    writer.close()
@@ -0,0 +1,22 @@
+from utils.rollup import RESOLUTIONS
+
+
+def test_sync_writes_only_changed_rows(store, write):
+    write(store, 1, wallet_type='spot', balances={'BTC': (1.0, None, None, None), 'ETH': (2.0, None, None, None)}, equity=1.0)
+    changes = store.conn.total_changes
+
+    write(store, 2, wallet_type='spot', balances={'BTC': (1.0, None, None, None), 'ETH': (2.0, None, None, None)}, equity=1.0)
+    assert store.conn.total_changes - changes == 1 + len(RESOLUTIONS) + 1  # the equity sample, its rollups and its event only
+
+    write(store, 3, wallet_type='spot', balances={'BTC': (1.5, None, None, None)}, equity=1.0)
+    rows = store.conn.execute("SELECT asset, ts, balance FROM balances").fetchall()
+    assert rows == [('BTC', 3, 1.5)]
+
+def test_sync_is_scoped_to_wallet(store, write):
+    store.conn.execute("INSERT INTO balances VALUES ('user', 'binance', 'spot', 'SOL', 0, 3.0, NULL, NULL, NULL)")
+    store.conn.execute("INSERT INTO balances VALUES ('user', 'binance', 'um', 'USDT', 0, 5.0, NULL, NULL, NULL)")
+    store.conn.commit()
+
+    write(store, 1, wallet_type='spot', balances={'BTC': (1.0, None, None, None)}, equity=1.0)
+    rows = store.conn.execute("SELECT wallet_type, asset, balance FROM balances ORDER BY wallet_type").fetchall()
+    assert rows == [('spot', 'BTC', 1.0), ('um', 'USDT', 5.0)]
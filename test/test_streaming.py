@@ -0,0 +1,194 @@
+import asyncio
+import json
+import time
+
+from aiohttp import web
+
+from utils.accounts import Account
+from utils.binance import Coin as PmCoin, UmPosition as PmUmPosition
+from utils.binance_classic import SpotCoin, UmCoin, UmPosition as ClassicUmPosition
+from utils.streaming import BinanceUserStream, BybitStream, ClassicState, ListenKeyEndpoint, PortfolioMarginState
+
+ACCOUNT = Account('bybit', 'bybit1', 'bybit', {})
+
+
+def balance(equity, usdt):
+    return {'info': {'result': {'list': [{'accountType': 'UNIFIED', 'totalEquity': str(equity)}]}}, 'free': {'USDT': usdt}}
+
+def position(symbol, contracts, side='long'):
+    return {'symbol': symbol, 'side': side, 'contracts': contracts, 'notional': contracts * 10, 'unrealizedPnl': 0.0, 'info': {}}
+
+class FakeBybit:
+    apiKey = 'key'
+    secret = 'secret'
+
+    async def fetch_balance(self):
+        return balance(100, 100.0)
+
+    async def fetch_positions(self, params):
+        return [position('BTC/USDT:USDT', 1.0)]
+
+    def parse_balance(self, response):
+        entry = response['result']['list'][0]
+        return balance(entry['totalEquity'], float(entry['coin'][0]['availableToWithdraw']))
+
+    def parse_position(self, raw):
+        return position(raw['symbol'], float(raw['size']), 'long' if raw['side'] == 'Buy' else 'short')
+
+async def serve(handler):
+    app = web.Application()
+    app.router.add_get('/ws', handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}/ws"
+
+async def wait_for(condition, timeout=5):
+    for _ in range(int(timeout / 0.01)):
+        if condition():
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError('condition not met')
+
+def test_bybit_stream_applies_deltas():
+    received = []
+    persisted = []
+
+    async def handler(request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        received.append(json.loads((await ws.receive()).data))
+        await ws.send_json({'op': 'auth', 'success': True})
+        received.append(json.loads((await ws.receive()).data))
+        await ws.send_json({'topic': 'position', 'data': [{'symbol': 'ETH/USDT:USDT', 'size': '2', 'side': 'Sell'}]})
+        await ws.send_json({'topic': 'position', 'data': [{'symbol': 'BTC/USDT:USDT', 'size': '0', 'side': ''}]})
+        await ws.send_json({'topic': 'wallet', 'data': [
+            {'accountType': 'UNIFIED', 'totalEquity': '150', 'coin': [{'coin': 'USDT', 'availableToWithdraw': '150'}]},
+        ]})
+        async for _ in ws:
+            pass
+        return ws
+
+    async def main():
+        runner, url = await serve(handler)
+        stream = BybitStream(ACCOUNT, FakeBybit(), url=url, persist=lambda user, state: persisted.append(state), debounce=0.05)
+        task = asyncio.ensure_future(stream.run())
+        try:
+            await wait_for(lambda: len(persisted) >= 2)
+        finally:
+            task.cancel()
+            await runner.cleanup()
+
+    asyncio.run(main())
+    assert received[0]['op'] == 'auth' and received[1] == {'op': 'subscribe', 'args': ['wallet', 'position']}
+    # The REST snapshot on connect, then one write for the three coalesced messages
+    assert list(persisted[0].positions) == ['BTC/USDT:USDT']
+    assert persisted[1].equity == 150.0
+    assert persisted[1].balances == {'USDT': 150.0}
+    assert {symbol: p.contracts for symbol, p in persisted[1].positions.items()} == {'ETH/USDT:USDT': -2.0}
+
+def classic_snapshot():
+    coins = {'BTC': SpotCoin('BTC', 1.0, 0.0, 60000.0)}
+    um_info = {
+        'total_wallet_balance': 1000.0, 'total_unrealized_profit': 5.0,
+        'position': {'BTCUSDT': ClassicUmPosition('BTCUSDT', 0.1, 5.0, 6005.0)},
+        'coins': {'USDT': UmCoin('USDT', 5.0, 1000.0, 1)},
+    }
+    return coins, um_info, {'position': {}, 'coins': {}}
+
+def test_binance_stream_applies_events_and_reconnects():
+    connections = []
+    fetches = []
+    written = []
+
+    async def handler(request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        connections.append(request.path)
+        await ws.send_json({'e': 'ORDER_TRADE_UPDATE'})
+        await ws.send_json({'e': 'ACCOUNT_UPDATE', 'a': {
+            'B': [{'a': 'USDT', 'wb': '1010', 'cw': '1010'}],
+            'P': [{'s': 'BTCUSDT', 'pa': '0.2', 'ep': '60000', 'up': '2', 'ps': 'BOTH'}],
+        }})
+        if len(connections) == 1:
+            await ws.send_json({'e': 'listenKeyExpired'})
+        async for _ in ws:
+            pass
+        return ws
+
+    class FakeBinance:
+        async def papiPostListenKey(self):
+            return {'listenKey': 'abc'}
+
+    async def fetch():
+        fetches.append(1)
+        return classic_snapshot()
+
+    def write(user, coins, um_info, cm_info):
+        written.append((um_info['total_wallet_balance'], um_info['total_unrealized_profit'], dict(um_info['position'])))
+
+    async def main():
+        runner, url = await serve(handler)
+        endpoint = ListenKeyEndpoint('um', 'papiPostListenKey', 'papiPutListenKey', url + '?listenKey=')
+        state = ClassicState(ACCOUNT, fetch, write, debounce=0.05)
+        stream = BinanceUserStream(ACCOUNT, FakeBinance(), endpoint, state, reconnect_delay=0.01)
+        task = asyncio.ensure_future(stream.run())
+        try:
+            await wait_for(lambda: len(connections) >= 2 and len(written) >= 3)
+        finally:
+            task.cancel()
+            await runner.cleanup()
+
+    asyncio.run(main())
+    assert connections[:2] == ['/ws', '/ws']
+    # One REST fetch per connection; the event itself is applied in memory
+    assert len(fetches) == 2
+    assert written[0][:2] == (1000.0, 5.0)
+    total_wallet_balance, total_unrealized_profit, positions = written[-1]
+    assert (total_wallet_balance, total_unrealized_profit) == (1010.0, 2.0)
+    assert positions['BTCUSDT'].position_amt == 0.2 and positions['BTCUSDT'].notional == 12002.0
+
+def test_events_that_need_rest_refresh_at_most_once_per_interval():
+    fetches = []
+
+    async def fetch():
+        fetches.append(time.monotonic())
+        return classic_snapshot()
+
+    async def main():
+        state = ClassicState(ACCOUNT, fetch, lambda *args: None, refresh_interval=0.3)
+        await state.reconcile()
+        # A position the snapshot does not have needs its notional from REST
+        new_position = {'e': 'ACCOUNT_UPDATE', 'a': {'P': [{'s': 'ETHUSDT', 'pa': '1', 'ep': '3000', 'up': '0'}]}}
+        for _ in range(5):
+            state.handle('um', new_position)
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.5)
+        # balanceUpdate is followed by the outboundAccountPosition carrying the new balance
+        state.handle('spot', {'e': 'balanceUpdate', 'a': 'BTC', 'd': '1'})
+        await asyncio.sleep(0.05)
+
+    asyncio.run(main())
+    assert len(fetches) == 3
+    assert fetches[2] - fetches[1] >= 0.29
+
+def test_portfolio_margin_state_moves_realized_profit_into_the_wallet():
+    coins = {
+        'USDT': PmCoin('USDT', 1100.0, 100.0, 0.0, 100.0, 0.0, 0.0, 1000.0, 50.0, 0.0, 0.0, 1),
+        'BTC': PmCoin('BTC', 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 60000.0),
+    }
+    um_positions = {'BTCUSDT': PmUmPosition('BTCUSDT', 0.1, 59500.0, 60000.0, 50.0, 0.0, 10.0, 'BOTH', 0.0, 6000.0, 0.0)}
+    state = PortfolioMarginState(ACCOUNT, None, None)
+    state.snapshot = (coins, {}, um_positions)
+    assert state.apply('portfolio margin', {'e': 'ACCOUNT_UPDATE', 'fs': 'UM', 'a': {
+        'B': [{'a': 'USDT', 'wb': '1050'}],
+        'P': [{'s': 'BTCUSDT', 'pa': '0', 'ep': '0', 'up': '0'}],
+    }})
+    assert state.apply('portfolio margin', {'e': 'outboundAccountPosition', 'B': [{'a': 'USDT', 'f': '90', 'l': '5'}]})
+    usdt = coins['USDT']
+    assert (usdt.um_wallet_balance, usdt.um_unrealized_pnl, usdt.cross_margin_asset) == (1050.0, 0.0, 95.0)
+    assert usdt.total_wallet_balance == 1145.0 and not um_positions
+    # A balance in an asset the snapshot has no price for needs REST
+    assert not state.apply('portfolio margin', {'e': 'outboundAccountPosition', 'B': [{'a': 'ETH', 'f': '1', 'l': '0'}]})
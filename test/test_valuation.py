@@ -0,0 +1,72 @@
+import time
+
+import pytest
+
+from utils.binance import Coin, fetch_total_equity_2, write_total_equity_and_balance
+from utils.binance_classic import CmCoin, SpotCoin, UmCoin, fetch_cm_equity, fetch_spot_equity, update_total_equity_and_balance
+from utils.schema import POSITIONS
+from utils.storage import Batch
+from utils.valuation import ValuationEngine, get_engine, value_notional
+
+
+def pm_coin(asset, total, borrowed, um_pnl, cm_pnl, price):
+    return Coin(asset, total, 0.0, borrowed, 0.0, 0.0, 0.0, 0.0, um_pnl, 0.0, cm_pnl, price)
+
+SPOT = {'BTC': SpotCoin('BTC', 0.5, 0.1, 60000.0), 'USDT': SpotCoin('USDT', 1000.0, 0.0, 1)}
+CM = {'ETH': CmCoin('ETH', -0.2, 3.0, 3000.0)}
+UM = {'USDT': UmCoin('USDT', 3.0, 120.0, 1)}
+PM = {'BTC': pm_coin('BTC', 1.0, 0.2, 0.01, -0.02, 60000.0), 'USDT': pm_coin('USDT', 5000.0, 100.0, 10.0, 0.0, 1)}
+
+def test_persisted_equity_is_the_engines_valuation():
+    classic = Batch('valued-classic', 'binance')
+    update_total_equity_and_balance(classic, SPOT, CM, UM, 123.0)
+    pm = Batch('valued-pm', 'binance')
+    write_total_equity_and_balance(pm, PM)
+
+    # The samples written to the database match the per-account loops
+    assert classic.equity['spot']['equity'] == pytest.approx(fetch_spot_equity(SPOT))
+    assert classic.equity['cm']['equity'] == pytest.approx(fetch_cm_equity(CM))
+    assert classic.equity['um']['equity'] == 123.0
+    assert pm.equity['portfolio']['equity'] == pytest.approx(fetch_total_equity_2(PM))
+
+    valuation = get_engine().value()
+    assert valuation.wallet('valued-classic', 'binance', 'spot')[0] == pytest.approx(fetch_spot_equity(SPOT))
+    equity, borrowed, _ = valuation.wallet('valued-pm', 'binance', 'portfolio')
+    assert equity == pytest.approx(fetch_total_equity_2(PM))
+    assert borrowed == pytest.approx(0.2 * 60000 + 100)
+    assert valuation.by_account()['valued-classic'][0] == pytest.approx(fetch_spot_equity(SPOT) + fetch_cm_equity(CM) + 123.0)
+
+def test_reprices_without_new_holdings():
+    engine = ValuationEngine()
+    engine.hold(('a', 'binance', 'spot'), {'BTC': 2.0, 'USDT': 10.0})
+    engine.hold(('b', 'bybit', 'unified'), {'USDT': 50.0}, notional=400.0)
+    engine.set_tickers({'BTC/USDT': {'last': 100.0}, 'ETH/BTC': {'last': 0.05}})
+    assert engine.value().total() == pytest.approx((260.0, 0.0, 400.0))
+
+    engine.set_prices({'BTC': 150.0})
+    assert engine.value().wallet('a', 'binance', 'spot')[0] == pytest.approx(310.0)
+    # Unknown assets are valued at 0 until a price arrives
+    engine.hold(('a', 'binance', 'spot'), {'DOGE': 1000.0})
+    assert engine.value().wallet('a', 'binance', 'spot')[0] == 0
+
+def test_values_hundreds_of_accounts_in_one_pass():
+    engine = ValuationEngine()
+    assets = [f"A{i}" for i in range(300)]
+    for account in range(500):
+        engine.hold((f"acct{account}", 'binance', 'spot'), {asset: 1.0 for asset in assets[account % 50:account % 50 + 40]})
+    engine.set_prices({asset: float(i) for i, asset in enumerate(assets)})
+    assert len(engine.value().wallets) == 500
+
+    start = time.perf_counter()
+    for _ in range(100):
+        engine.value()
+    assert (time.perf_counter() - start) / 100 < 0.005
+
+def test_gross_notional_of_synced_positions():
+    engine = ValuationEngine()
+    batch = Batch('pm', 'binance')
+    batch.sync(POSITIONS, 'um', {'BTCUSDT': (-1.0, 0.0, 100.0)})
+    batch.sync(POSITIONS, 'cm', {'BTCUSD_PERP': (2.0, 0.0, None), 'ETHUSD_PERP': (-1.0, 0.0, -50.0)})
+    assert value_notional(batch, 'portfolio', 'um', 'cm', engine=engine) == 150.0
+    assert batch.equity == {'portfolio': {'notional': 150.0}}
+    assert engine.value().wallet('pm', 'binance', 'portfolio') == (0.0, 0.0, 150.0)
@@ -1,7 +1,10 @@
+from datetime import datetime
+
 from apscheduler.schedulers.blocking import BlockingScheduler
 
 from utils.bybit import init_exchange, init_db, update_data
 from utils.constants import CONFIG
+from utils.markets import get_registry
 
 BYBIT_API_KEY_2 = CONFIG['bybit2']['API_KEY']
 BYBIT_SECRET_2 = CONFIG['bybit2']['SECRET']
@@ -17,11 +20,11 @@ config = {
 USER = 'bybit2'
 
 if __name__ == '__main__':
-    bybit = init_exchange(config)
+    bybit = get_registry().attach(init_exchange(config))
     init_db(USER)
 
     scheduler = BlockingScheduler()
-    scheduler.add_job(update_data, 'interval', seconds=60, args=[bybit, USER])
+    scheduler.add_job(update_data, 'interval', seconds=60, args=[bybit, USER], next_run_time=datetime.now())
 
     try:
         scheduler.start()
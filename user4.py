@@ -1,7 +1,10 @@
+from datetime import datetime
+
 from apscheduler.schedulers.blocking import BlockingScheduler
 
 from utils.binance import init_exchange, init_db, update_data
 from utils.constants import CONFIG
+from utils.markets import get_registry
 
 BINANCE_UNI_API_KEY_2 = CONFIG['binance_uni2']['API_KEY']
 BINANCE_UNI_SECRET_2 = CONFIG['binance_uni2']['SECRET']
@@ -20,11 +23,11 @@ config = {
 USER = 'binance2'
 
 if __name__ == '__main__':
-    binance = init_exchange(config)
+    binance = get_registry().attach(init_exchange(config))
     init_db(USER)
 
     scheduler = BlockingScheduler()
-    scheduler.add_job(update_data, 'interval', seconds=60, args=[binance, USER])
+    scheduler.add_job(update_data, 'interval', seconds=60, args=[binance, USER], next_run_time=datetime.now())
 
     try:
         scheduler.start()
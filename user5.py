@@ -1,7 +1,10 @@
+from datetime import datetime
+
 from apscheduler.schedulers.blocking import BlockingScheduler
 
 from utils.binance import init_exchange, init_db, update_data
 from utils.constants import CONFIG
+from utils.markets import get_registry
 
 BINANCE_VIP = CONFIG['binance_vip']['API_KEY']
 BINANCE_VIP_SECRET = CONFIG['binance_vip']['SECRET']
@@ -20,11 +23,11 @@ config = {
 USER = 'binance3'
 
 if __name__ == '__main__':
-    binance = init_exchange(config)
+    binance = get_registry().attach(init_exchange(config))
     init_db(USER)
 
     scheduler = BlockingScheduler()
-    scheduler.add_job(update_data, 'interval', seconds= 60, args=[binance, USER])
+    scheduler.add_job(update_data, 'interval', seconds= 60, args=[binance, USER], next_run_time=datetime.now())
 
     try:
         scheduler.start()
@@ -0,0 +1,182 @@
+import importlib
+from configparser import ConfigParser
+from dataclasses import dataclass, field
+from functools import partial
+from types import ModuleType
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Dict, List, Optional
+
+import ccxt
+
+from utils.markets import get_registry
+from utils.metrics import instrument
+from utils.parsing import fast_json
+from utils.prices import DEFAULT_TTL, PriceCache
+from utils.ratelimit import get_governor, install
+
+if TYPE_CHECKING:
+    import ccxt.async_support as ccxt_async
+
+BYBIT = 'bybit'
+BINANCE = 'binance'
+BINANCE_CLASSIC = 'binance_classic'
+
+VENUES = (BYBIT, BINANCE, BINANCE_CLASSIC)
+
+# Updater module of each venue. They are imported on first use, so a process
+# only loads the venues it runs, and ccxt.async_support (with aiohttp) only
+# in asyncio mode.
+UPDATERS = {BYBIT: 'utils.bybit', BINANCE: 'utils.binance', BINANCE_CLASSIC: 'utils.binance_classic'}
+ASYNC_UPDATERS = {BYBIT: 'utils.bybit_async', BINANCE: 'utils.binance_async', BINANCE_CLASSIC: 'utils.binance_classic_async'}
+
+# Table prefixes used by the original one-process-per-user scripts, so the
+# daemon keeps writing to the same tables for these sections.
+LEGACY_USERS = {
+    'bybit': 'bybit1',
+    'bybit2': 'bybit2',
+    'bybit3': 'bybit3',
+    'binance_uni': 'binance1',
+    'binance_uni2': 'binance2',
+    'binance_vip': 'binance3',
+}
+
+
+@dataclass
+class Account:
+    section: str
+    user: str
+    venue: str
+    config: Dict[str, Any] = field(repr=False)
+    # Accounts behind the same egress IP share one request-weight budget
+    ip: str = 'default'
+
+
+def infer_venue(section: str) -> Optional[str]:
+    if section.startswith('bybit'):
+        return BYBIT
+    if section.startswith('binance_uni') or section.startswith('binance_vip'):
+        return BINANCE
+    if section.startswith('binance'):
+        return BINANCE_CLASSIC
+    return None
+
+
+def exchange_config(venue: str, api_key: str, secret: str) -> Dict[str, Any]:
+    config = {
+        'exchange_id': 'bybit' if venue == BYBIT else 'binance',
+        'sandbox': False,
+        'apiKey': api_key,
+        'secret': secret,
+        'enableRateLimit': False,
+    }
+    if venue == BINANCE:
+        config['options'] = {'portfolioMargin': True}
+    return config
+
+
+def load_accounts(config: ConfigParser) -> List[Account]:
+    """
+    Build an Account for every section of the config that has API keys.
+
+    A section may set VENUE (bybit, binance, binance_classic) and USER (table
+    prefix) explicitly; otherwise both are derived from the section name.
+    IP names the egress IP the account's requests leave from.
+    """
+    accounts = []
+    for section in config.sections():
+        options = config[section]
+        if not options.get('API_KEY') or not options.get('SECRET'):
+            continue
+        venue = options.get('VENUE') or infer_venue(section)
+        if venue not in VENUES:
+            print(f"Skipping section {section}: unsupported venue {venue}")
+            continue
+        user = options.get('USER') or LEGACY_USERS.get(section, section)
+        accounts.append(Account(
+            section=section,
+            user=user,
+            venue=venue,
+            config=exchange_config(venue, options['API_KEY'], options['SECRET']),
+            ip=options.get('IP') or 'default',
+        ))
+    return accounts
+
+
+def updater(venue: str, is_async: bool = False) -> ModuleType:
+    return importlib.import_module((ASYNC_UPDATERS if is_async else UPDATERS)[venue])
+
+
+def init_account(account: Account) -> ccxt.Exchange:
+    module = updater(account.venue)
+    exchange = module.init_exchange(account.config)
+    module.init_db(account.user)
+    get_registry().attach(exchange)
+    return install(instrument(fast_json(exchange), account.user, account.venue), get_governor(), account.ip)
+
+
+def init_shared(accounts: List[Account], price_ttl: float = DEFAULT_TTL, public_config: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Create the process-wide state shared by every account's update job.
+
+    `public_config` is merged into the config of the unauthenticated Binance
+    exchange behind the price cache.
+    """
+    shared = {}
+    if any(account.venue in (BINANCE, BINANCE_CLASSIC) for account in accounts):
+        public = ccxt.binance({'enableRateLimit': False, **(public_config or {})})
+        public = install(instrument(fast_json(get_registry().attach(public)), 'public', BINANCE), get_governor())
+        price_cache = PriceCache(public, ttl=price_ttl)
+        price_cache.start()
+        shared['price_cache'] = price_cache
+    return shared
+
+
+def make_update_job(account: Account, exchange: ccxt.Exchange, shared: Dict[str, Any]) -> Callable[[], None]:
+    """
+    Return a zero-argument callable running one update cycle for the account.
+
+    `shared` holds the process-wide state from init_shared that is reused by
+    every account, such as the Binance price cache. Markets are shared
+    through the registry every exchange is attached to.
+    """
+    module = updater(account.venue)
+    if account.venue == BYBIT:
+        return partial(module.update_data, exchange, account.user)
+    if account.venue == BINANCE:
+        return partial(module.update_data, exchange, account.user, shared['price_cache'])
+
+    def update_classic():
+        module.update_data(account.user, exchange, module.get_valid_usdt_symbols(exchange), shared['price_cache'])
+    return update_classic
+
+
+def init_account_async(account: Account) -> 'ccxt_async.Exchange':
+    exchange = updater(account.venue, is_async=True).init_exchange(account.config)
+    updater(account.venue).init_db(account.user)
+    get_registry().attach(exchange)
+    return install(instrument(fast_json(exchange), account.user, account.venue), get_governor(), account.ip)
+
+
+def make_async_update_job(account: Account, exchange: 'ccxt_async.Exchange', shared: Dict[str, Any]) -> Callable[[], Awaitable[None]]:
+    """Coroutine counterpart of make_update_job for exchanges from ccxt.async_support."""
+    module = updater(account.venue, is_async=True)
+    if account.venue == BYBIT:
+        return partial(module.update_data, exchange, account.user)
+    if account.venue == BINANCE:
+        return partial(module.update_data, exchange, account.user, shared['price_cache'])
+
+    async def update_classic():
+        await module.update_data(account.user, exchange, await module.get_valid_usdt_symbols(exchange), shared['price_cache'])
+    return update_classic
+
+
+def make_async_fetch(account: Account, exchange: 'ccxt_async.Exchange', shared: Dict[str, Any]) -> Callable[[], Awaitable[Any]]:
+    """Coroutine fetching the account's REST state without writing it, for streams that keep the state in memory."""
+    module = updater(account.venue, is_async=True)
+    if account.venue == BYBIT:
+        return partial(module.fetch_snapshot, exchange)
+    if account.venue == BINANCE:
+        return partial(module.fetch_data, exchange, shared['price_cache'])
+
+    async def fetch_classic():
+        return await module.fetch_data(exchange, await module.get_valid_usdt_symbols(exchange), shared['price_cache'])
+    return fetch_classic
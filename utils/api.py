@@ -0,0 +1,196 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+from utils.exposure import query_exposure
+from utils.metrics import API_REQUESTS
+from utils.rollup import DAY, MAX_POINTS, query_equity
+from utils.schema import BALANCES, POSITIONS, Table
+from utils.storage import Store, connect_readonly
+
+API_PORT = 9111
+CACHE_ENTRIES = 1024
+# Dashboards draw at most a few thousand points per series
+POINTS_LIMIT = 5000
+
+Response = Tuple[str, bytes]
+
+
+class NotFound(Exception):
+    pass
+
+
+class BadRequest(Exception):
+    pass
+
+
+def records(columns: Tuple[str, ...], rows: List[Tuple[Any, ...]]) -> List[Dict[str, Any]]:
+    return [dict(zip(columns, row)) for row in rows]
+
+
+def query_latest_equity(conn: sqlite3.Connection) -> List[Tuple[Any, ...]]:
+    """(account, venue, wallet_type, ts, equity, notional) of the latest sample of every wallet."""
+    return conn.execute(
+        """SELECT account, venue, wallet_type, max(ts), equity, notional FROM equity
+           GROUP BY account, venue, wallet_type ORDER BY account, venue, wallet_type"""
+    ).fetchall()
+
+
+def query_current(conn: sqlite3.Connection, table: Table, account: str) -> List[Tuple[Any, ...]]:
+    columns = ('venue', 'wallet_type', table.key, 'ts') + table.columns
+    return conn.execute(
+        f"SELECT {', '.join(columns)} FROM {table.name} WHERE account = ? ORDER BY venue, wallet_type, {table.key}",
+        (account,),
+    ).fetchall()
+
+
+def scope(path: str) -> Optional[str]:
+    """The account a request path reads, or None for firm-wide resources."""
+    parts = urlparse(path).path.strip('/').split('/')
+    return parts[1] if len(parts) == 3 and parts[0] == 'accounts' else None
+
+
+def integer(query: Dict[str, List[str]], name: str, default: Optional[int]) -> Optional[int]:
+    if name not in query:
+        return default
+    try:
+        return int(query[name][0])
+    except ValueError:
+        raise BadRequest(f"{name} must be an integer")
+
+
+class ReadService:
+    """JSON read model for dashboards, cached per request until the write sequence it depends on moves."""
+
+    def __init__(self, connect: Callable[[], sqlite3.Connection], version: Callable[[Optional[str]], int],
+                 entries: int = CACHE_ENTRIES):
+        self.connect = connect
+        self.version = version
+        self.entries = entries
+        self._cache: "OrderedDict[str, Tuple[int, str, str, bytes]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._local = threading.local()
+
+    def get(self, path: str) -> Tuple[str, str, bytes, bool]:
+        """Return (endpoint, etag, body, cached) for a request path, from the cache when nothing was written since."""
+        account = scope(path)
+        entry = self._lookup(path, self.version(account))
+        if entry:
+            return entry + (True,)
+        with self._build_lock:
+            # Another request may have built it while this one waited
+            version = self.version(account)
+            entry = self._lookup(path, version)
+            if entry:
+                return entry + (True,)
+            endpoint, body = self.build(path)
+            etag = f'"{hashlib.blake2b(body, digest_size=8).hexdigest()}"'
+            with self._lock:
+                self._cache[path] = (version, endpoint, etag, body)
+                while len(self._cache) > self.entries:
+                    self._cache.popitem(last=False)
+        return endpoint, etag, body, False
+
+    def _lookup(self, path: str, version: int) -> Optional[Tuple[str, str, bytes]]:
+        with self._lock:
+            entry = self._cache.get(path)
+            if entry is None or entry[0] != version:
+                return None
+            self._cache.move_to_end(path)
+            return entry[1:]
+
+    def build(self, path: str) -> Response:
+        url = urlparse(path)
+        query = parse_qs(url.query)
+        parts = [part for part in url.path.split('/') if part]
+        conn = self._conn()
+        if parts == ['accounts']:
+            data: Any = records(('account', 'venue', 'wallet_type', 'ts', 'equity', 'notional'), query_latest_equity(conn))
+            return 'accounts', self.encode(data)
+        if parts == ['exposure']:
+            data = records(('asset', 'ts', 'quantity', 'net_notional', 'gross_notional', 'positions'), query_exposure(conn))
+            return 'exposure', self.encode(data)
+        if len(parts) == 3 and parts[0] == 'accounts':
+            account, resource = parts[1], parts[2]
+            for table in (BALANCES, POSITIONS):
+                if resource == table.name:
+                    columns = ('venue', 'wallet_type', table.key, 'ts') + table.columns
+                    return table.name, self.encode(records(columns, query_current(conn, table, account)))
+            if resource == 'equity':
+                return 'equity', self.encode(self.equity(conn, account, query))
+        raise NotFound(url.path)
+
+    def equity(self, conn: sqlite3.Connection, account: str, query: Dict[str, List[str]]) -> Dict[str, Any]:
+        end = integer(query, 'end', None) or int(time.time())
+        start = integer(query, 'start', None) or end - DAY
+        points = integer(query, 'points', MAX_POINTS)
+        if start > end or not 0 < points <= POINTS_LIMIT:
+            raise BadRequest(f"need start <= end and 0 < points <= {POINTS_LIMIT}")
+        history = query_equity(conn, account, start, end, query.get('wallet_type', [None])[0], max_points=points)
+        return {
+            'resolution': history['resolution'],
+            'rows': records(('wallet_type', 'ts', 'open', 'high', 'low', 'close', 'notional'), history['rows']),
+        }
+
+    def encode(self, data: Any) -> bytes:
+        return json.dumps(data, separators=(',', ':')).encode()
+
+    def _conn(self) -> sqlite3.Connection:
+        # sqlite3 connections are not shared between the server's threads
+        if getattr(self._local, 'conn', None) is None:
+            self._local.conn = self.connect()
+        return self._local.conn
+
+
+def store_service(store: Store) -> ReadService:
+    """A read service over the store's database, invalidated by its writes."""
+    def version(account: Optional[str]) -> int:
+        return store.sequence if account is None else store.account_sequence.get(account, 0)
+    return ReadService(lambda: connect_readonly(store.path), version)
+
+
+class APIHandler(BaseHTTPRequestHandler):
+    service: ReadService
+
+    def do_GET(self):
+        try:
+            endpoint, etag, body, cached = self.service.get(self.path)
+        except NotFound:
+            self.send_error(404)
+            return
+        except BadRequest as e:
+            self.send_error(400, str(e))
+            return
+        not_modified = etag in self.headers.get('If-None-Match', '')
+        API_REQUESTS.inc(endpoint=endpoint, result='miss' if not cached else 'not_modified' if not_modified else 'hit')
+        if not_modified:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        # Clients keep the body but must revalidate it, which is a cache lookup here
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_api(service: ReadService, port: int = API_PORT, host: str = '127.0.0.1') -> ThreadingHTTPServer:
+    """Expose the read service on a background thread."""
+    handler = type('ServiceAPIHandler', (APIHandler,), {'service': service})
+    server = ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, name='api', daemon=True).start()
+    return server
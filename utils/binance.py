@@ -2,13 +2,26 @@ import time
 
 from pprint import pprint
 from dataclasses import dataclass
-from typing import Any, Dict
+from typing import Any, Dict, List, Optional
 
 import ccxt
 import sqlite3
 
+from utils.markets import get_contract_sizes
+from utils.metrics import timed
+from utils.parsing import compact_portfolio_balance, compact_positions
+from utils.prices import PriceCache, fetch_usdt_tickers
+from utils.schema import BALANCES, POSITIONS, init_schema
+from utils.storage import Batch, get_store
+from utils.valuation import value_notional, value_wallet
 
-@dataclass
+VENUE = 'binance'
+PORTFOLIO = 'portfolio'
+UM = 'um'
+CM = 'cm'
+
+
+@dataclass(slots=True)
 class Coin:
     asset: str
     total_wallet_balance: float
@@ -23,7 +36,7 @@ class Coin:
     cm_unrealized_pnl: float
     price_in_usdt: float
 
-@dataclass
+@dataclass(slots=True)
 class CmPosition:
     symbol: str
     position_amt: float
@@ -38,7 +51,7 @@ class CmPosition:
     break_even_price: float
     contract_size: float
 
-@dataclass
+@dataclass(slots=True)
 class UmPosition:
     symbol: str
     position_amt: float
@@ -59,17 +72,8 @@ def init_exchange(config: Dict[str, Any]) -> ccxt.Exchange:
     return exchange
 
 def init_db(user):
-    conn = sqlite3.connect('trading_data.db')
-    c = conn.cursor()
-    c.execute(f'''CREATE TABLE IF NOT EXISTS {user}_total_equity
-                 (timestamp INTEGER, equity REAL)''')
-    c.execute(f'''CREATE TABLE IF NOT EXISTS {user}_coin_balance
-                 (asset TEXT PRIMARY KEY, total_balance REAL, borrowed REAL ,um_balance REAL, cm_balance REAL)''')
-    c.execute(f'''CREATE TABLE IF NOT EXISTS {user}_cm_positions
-                 (symbol TEXT PRIMARY KEY, contracts REAL, unrealized_pnl REAL, notional REAL)''')
-    c.execute(f'''CREATE TABLE IF NOT EXISTS {user}_um_positions
-                 (symbol TEXT PRIMARY KEY, contracts REAL, unrealized_pnl REAL, notional REAL)''')   
-    conn.commit()
+    conn = get_db_connection()
+    init_schema(conn)
     conn.close()
 
 def get_db_connection():
@@ -82,7 +86,30 @@ def parse_future_symbol(symbol: str) -> str:
     quote = part[0][-3:]
     return f"{base}/{quote}:{base}-{expiry_date}"
 
-def fetch_account_balance(exchange: ccxt.binance) -> Dict[str, Coin]:
+def balance_ticker_symbols(res: List[Dict[str, Any]]) -> List[str]:
+    return [f"{coin['asset']}/USDT" for coin in res if coin["asset"] != "USDT"]
+
+@timed('parse')
+def parse_account_balance(res: List[Dict[str, Any]], tickers: Dict[str, Any]) -> Dict[str, Coin]:
+    coins = {}
+    for coin in res:
+        coins[coin["asset"]] = Coin(
+            asset=coin["asset"],
+            total_wallet_balance=float(coin["totalWalletBalance"]),
+            cross_margin_asset=float(coin["crossMarginAsset"]),
+            cross_margin_borrowed=float(coin["crossMarginBorrowed"]),
+            cross_margin_free=float(coin["crossMarginFree"]),
+            cross_margin_interest=float(coin["crossMarginInterest"]),
+            cross_margin_locked=float(coin["crossMarginLocked"]),
+            um_wallet_balance=float(coin["umWalletBalance"]),
+            um_unrealized_pnl=float(coin["umUnrealizedPNL"]),
+            cm_wallet_balance=float(coin["cmWalletBalance"]),
+            cm_unrealized_pnl=float(coin["cmUnrealizedPNL"]),
+            price_in_usdt=tickers[f"{coin['asset']}/USDT"]['last'] if coin['asset'] != 'USDT' else 1
+        )
+    return coins
+
+def fetch_account_balance(exchange: ccxt.binance, price_cache: Optional[PriceCache] = None) -> Dict[str, Coin]:
     
     # [
     #     {
@@ -100,29 +127,9 @@ def fetch_account_balance(exchange: ccxt.binance) -> Dict[str, Coin]:
     #         "updateTime": 1617939110373
     #     }
     # ]
-    coins = {}
-    res = exchange.papi_get_balance()
-    symbols = [f"{coin['asset']}/USDT" for coin in res if float(coin["totalWalletBalance"]) != 0 and coin["asset"] != "USDT"]
-    if symbols:
-        tickers = exchange.fetch_tickers(symbols)
-
-    for coin in res:
-        if float(coin["totalWalletBalance"]) != 0:
-            coins[coin["asset"]] = Coin(
-                asset=coin["asset"],
-                total_wallet_balance=float(coin["totalWalletBalance"]),
-                cross_margin_asset=float(coin["crossMarginAsset"]),
-                cross_margin_borrowed=float(coin["crossMarginBorrowed"]),
-                cross_margin_free=float(coin["crossMarginFree"]),
-                cross_margin_interest=float(coin["crossMarginInterest"]),
-                cross_margin_locked=float(coin["crossMarginLocked"]),
-                um_wallet_balance=float(coin["umWalletBalance"]),
-                um_unrealized_pnl=float(coin["umUnrealizedPNL"]),
-                cm_wallet_balance=float(coin["cmWalletBalance"]),
-                cm_unrealized_pnl=float(coin["cmUnrealizedPNL"]),
-                price_in_usdt=tickers[f"{coin['asset']}/USDT"]['last'] if coin['asset'] != 'USDT' else 1
-            )
-    return coins
+    res = compact_portfolio_balance(exchange.papi_get_balance())
+    tickers = fetch_usdt_tickers(exchange, balance_ticker_symbols(res), price_cache)
+    return parse_account_balance(res, tickers)
 
 def fetch_total_equity_1(exchange: ccxt.binance) -> float:
     res = exchange.papi_get_account()
@@ -131,11 +138,12 @@ def fetch_total_equity_1(exchange: ccxt.binance) -> float:
 def fetch_total_equity_2(coins: Dict[str, Coin]) -> float:
     return sum([(coin.total_wallet_balance+coin.cm_unrealized_pnl+coin.um_unrealized_pnl-coin.cross_margin_borrowed) * coin.price_in_usdt for coin in coins.values()])
 
-def fetch_cm_position(exchange: ccxt.binance) -> Dict[str, CmPosition]:
+@timed('parse')
+def parse_cm_position(res: List[Dict[str, Any]], contract_sizes: Dict[str, float]) -> Dict[str, CmPosition]:
     position = {}
-    res = exchange.papi_get_cm_positionrisk()
-    exchange.load_markets()
     for pos in res:
+        if pos['symbol'] not in contract_sizes:
+            continue
         position[pos['symbol']] = CmPosition(
             symbol=pos['symbol'],
             position_amt=float(pos['positionAmt']),
@@ -148,13 +156,13 @@ def fetch_cm_position(exchange: ccxt.binance) -> Dict[str, CmPosition]:
             max_qty=float(pos['maxQty']),
             notional_value=float(pos['notionalValue']),
             break_even_price=float(pos['breakEvenPrice']),
-            contract_size=float(exchange.markets[parse_future_symbol(pos['symbol'])]['info']['contractSize'])
+            contract_size=contract_sizes[pos['symbol']]
         )
     return position
 
-def fetch_um_position(exchange: ccxt.binance) -> Dict[str, UmPosition]:
+@timed('parse')
+def parse_um_position(res: List[Dict[str, Any]]) -> Dict[str, UmPosition]:
     position = {}
-    res = exchange.papi_get_um_positionrisk()
     for pos in res:
         position[pos['symbol']] = UmPosition(
             symbol=pos['symbol'],
@@ -171,88 +179,68 @@ def fetch_um_position(exchange: ccxt.binance) -> Dict[str, UmPosition]:
         )
     return position
 
-def update_total_equity_and_balance(exchange: ccxt.binance, user):
-    coins = fetch_account_balance(exchange)
-    total_equity = fetch_total_equity_2(coins)
-    conn = get_db_connection()
-    c = conn.cursor()
-    
-    # Insert total equity
-    c.execute(f"INSERT INTO {user}_total_equity VALUES (?, ?)", (int(time.time()), total_equity))
-    
-    # Get existing coins in the database
-    c.execute(f"SELECT asset FROM {user}_coin_balance")
-    existing_coins = set(row[0] for row in c.fetchall())
-    
-    # Update or insert coin balances
-    current_coins = set()
-    for coin in coins.values():
-        c.execute(f"INSERT OR REPLACE INTO {user}_coin_balance VALUES (?, ?, ?, ?, ?)", 
-                  (coin.asset, coin.total_wallet_balance, coin.cross_margin_borrowed, 
-                   coin.um_wallet_balance, coin.cm_wallet_balance))
-        current_coins.add(coin.asset)
-    
-    # Delete coins that no longer exist
-    coins_to_delete = existing_coins - current_coins
-    for coin in coins_to_delete:
-        c.execute(f"DELETE FROM {user}_coin_balance WHERE asset = ?", (coin,))
-        print(f"Deleted balance for {coin}")
-    
-    conn.commit()
-    conn.close()
+def fetch_cm_position(exchange: ccxt.binance) -> Dict[str, CmPosition]:
+    res = compact_positions(exchange.papi_get_cm_positionrisk())
+    contract_sizes = get_contract_sizes(exchange, [pos['symbol'] for pos in res])
+    return parse_cm_position(res, contract_sizes)
+
+def fetch_um_position(exchange: ccxt.binance) -> Dict[str, UmPosition]:
+    return parse_um_position(compact_positions(exchange.papi_get_um_positionrisk()))
+
+def write_total_equity_and_balance(batch: Batch, coins: Dict[str, Coin]):
+    value_wallet(
+        batch,
+        PORTFOLIO,
+        {coin.asset: coin.total_wallet_balance + coin.cm_unrealized_pnl + coin.um_unrealized_pnl - coin.cross_margin_borrowed for coin in coins.values()},
+        {coin.asset: coin.cross_margin_borrowed for coin in coins.values() if coin.cross_margin_borrowed},
+        {coin.asset: coin.price_in_usdt for coin in coins.values()},
+    )
+
+    # The portfolio wallet holds the totals; UM and CM hold their share of them
+    batch.sync(BALANCES, PORTFOLIO, {
+        coin.asset: (coin.total_wallet_balance, None, None, coin.cross_margin_borrowed)
+        for coin in coins.values()
+    })
+    batch.sync(BALANCES, UM, {
+        coin.asset: (coin.um_wallet_balance + coin.um_unrealized_pnl, coin.um_wallet_balance, coin.um_unrealized_pnl, None)
+        for coin in coins.values()
+        if coin.um_wallet_balance != 0 or coin.um_unrealized_pnl != 0
+    })
+    batch.sync(BALANCES, CM, {
+        coin.asset: (coin.cm_wallet_balance + coin.cm_unrealized_pnl, coin.cm_wallet_balance, coin.cm_unrealized_pnl, None)
+        for coin in coins.values()
+        if coin.cm_wallet_balance != 0 or coin.cm_unrealized_pnl != 0
+    })
+
+def write_positions(batch: Batch, cm_positions: Dict[str, CmPosition], um_positions: Dict[str, UmPosition]):
+    cm_rows = {
+        pos.symbol: (pos.position_amt, pos.un_realized_profit, abs(pos.position_amt * pos.contract_size))
+        for pos in cm_positions.values()
+    }
+    um_rows = {
+        pos.symbol: (pos.position_amt, pos.un_realized_profit, abs(pos.notional))
+        for pos in um_positions.values()
+    }
+    batch.sync(POSITIONS, CM, cm_rows)
+    batch.sync(POSITIONS, UM, um_rows)
+    value_notional(batch, PORTFOLIO, UM, CM)
+
+def update_total_equity_and_balance(exchange: ccxt.binance, user, price_cache: Optional[PriceCache] = None):
+    coins = fetch_account_balance(exchange, price_cache)
+    with get_store().cycle(user, VENUE) as batch:
+        write_total_equity_and_balance(batch, coins)
 
 def update_positions(exchange: ccxt.binance, user):
     cm_positions = fetch_cm_position(exchange)
     um_positions = fetch_um_position(exchange)
-    conn = get_db_connection()
-    c = conn.cursor()
-    
-    # Get existing CM positions in the database
-    c.execute(f"SELECT symbol FROM {user}_cm_positions")
-    existing_cm_symbols = set(row[0] for row in c.fetchall())
-    
-    # Update or insert CM positions
-    current_cm_symbols = set()
-    for pos in cm_positions.values():
-        symbol = pos.symbol
-        contracts = pos.position_amt
-        unrealized_pnl = pos.un_realized_profit
-        notional = abs(contracts * pos.contract_size)
-        c.execute(f"INSERT OR REPLACE INTO {user}_cm_positions VALUES (?, ?, ?, ?)", 
-                  (symbol, contracts, unrealized_pnl, notional))
-        current_cm_symbols.add(symbol)
-    
-    # Delete CM positions that no longer exist
-    cm_symbols_to_delete = existing_cm_symbols - current_cm_symbols
-    for symbol in cm_symbols_to_delete:
-        c.execute(f"DELETE FROM {user}_cm_positions WHERE symbol = ?", (symbol,))
-        print(f"Deleted CM position for {symbol}")
-    
-    # Get existing UM positions in the database
-    c.execute(f"SELECT symbol FROM {user}_um_positions")
-    existing_um_symbols = set(row[0] for row in c.fetchall())
-    
-    # Update or insert UM positions
-    current_um_symbols = set()
-    for pos in um_positions.values():
-        symbol = pos.symbol
-        contracts = pos.position_amt
-        unrealized_pnl = pos.un_realized_profit
-        notional = abs(pos.notional)
-        c.execute(f"INSERT OR REPLACE INTO {user}_um_positions VALUES (?, ?, ?, ?)", 
-                  (symbol, contracts, unrealized_pnl, notional))
-        current_um_symbols.add(symbol)
-    
-    # Delete UM positions that no longer exist
-    um_symbols_to_delete = existing_um_symbols - current_um_symbols
-    for symbol in um_symbols_to_delete:
-        c.execute(f"DELETE FROM {user}_um_positions WHERE symbol = ?", (symbol,))
-        print(f"Deleted UM position for {symbol}")
-    
-    conn.commit()
-    conn.close()
+    with get_store().cycle(user, VENUE) as batch:
+        write_positions(batch, cm_positions, um_positions)
 
-def update_data(exchange: ccxt.Exchange, user):
-    update_total_equity_and_balance(exchange, user)
-    update_positions(exchange, user)
+def update_data(exchange: ccxt.Exchange, user, price_cache: Optional[PriceCache] = None):
+    coins = fetch_account_balance(exchange, price_cache)
+    cm_positions = fetch_cm_position(exchange)
+    um_positions = fetch_um_position(exchange)
+    with get_store().cycle(user, VENUE) as batch:
+        write_total_equity_and_balance(batch, coins)
+        write_positions(batch, cm_positions, um_positions)
     print("Data updated")
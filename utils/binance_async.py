@@ -0,0 +1,55 @@
+import asyncio
+from typing import Any, Dict, Optional
+
+import ccxt.async_support as ccxt_async
+
+from utils.binance import (
+    VENUE,
+    Coin,
+    balance_ticker_symbols,
+    parse_account_balance,
+    parse_cm_position,
+    parse_um_position,
+    write_positions,
+    write_total_equity_and_balance,
+)
+from utils.markets import get_contract_sizes_async
+from utils.parsing import compact_portfolio_balance, compact_positions
+from utils.prices import PriceCache, fetch_usdt_tickers_async
+from utils.storage import get_store
+
+
+def init_exchange(config: Dict[str, Any]) -> ccxt_async.Exchange:
+    exchange_class = getattr(ccxt_async, config['exchange_id'])
+    exchange = exchange_class(config)
+    exchange.set_sandbox_mode(config.get('sandbox', False))
+    return exchange
+
+async def fetch_account_balance(exchange: ccxt_async.binance, price_cache: Optional[PriceCache] = None) -> Dict[str, Coin]:
+    res = compact_portfolio_balance(await exchange.papi_get_balance())
+    tickers = await fetch_usdt_tickers_async(exchange, balance_ticker_symbols(res), price_cache)
+    return parse_account_balance(res, tickers)
+
+async def fetch_cm_position(exchange: ccxt_async.binance):
+    res = compact_positions(await exchange.papi_get_cm_positionrisk())
+    return parse_cm_position(res, await get_contract_sizes_async(exchange, [pos['symbol'] for pos in res]))
+
+async def fetch_um_position(exchange: ccxt_async.binance):
+    return parse_um_position(compact_positions(await exchange.papi_get_um_positionrisk()))
+
+def write_data(user, coins: Dict[str, Coin], cm_positions, um_positions):
+    with get_store().cycle(user, VENUE) as batch:
+        write_total_equity_and_balance(batch, coins)
+        write_positions(batch, cm_positions, um_positions)
+
+async def fetch_data(exchange: ccxt_async.binance, price_cache: Optional[PriceCache] = None):
+    """(coins, cm_positions, um_positions) of the account, as write_data takes them."""
+    return await asyncio.gather(
+        fetch_account_balance(exchange, price_cache),
+        fetch_cm_position(exchange),
+        fetch_um_position(exchange),
+    )
+
+async def update_data(exchange: ccxt_async.binance, user, price_cache: Optional[PriceCache] = None):
+    write_data(user, *await fetch_data(exchange, price_cache))
+    print("Data updated")
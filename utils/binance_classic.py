@@ -1,17 +1,29 @@
 import ccxt
 from utils.binance import init_exchange
 from utils.constants import CONFIG
+from utils.markets import get_contract_sizes, get_registry
+from utils.metrics import timed
+from utils.parsing import compact_futures_account, compact_spot_account
+from utils.prices import PriceCache, fetch_usdt_tickers
+from utils.schema import BALANCES, POSITIONS, init_schema
+from utils.storage import Batch, get_store
+from utils.valuation import value_notional, value_wallet
 from dataclasses import dataclass
 import sqlite3
-from typing import Dict, List
+from typing import Any, Collection, Dict, List, Optional, Set
 import time
 
+VENUE = "binance"
+SPOT = "spot"
+UM = "um"
+CM = "cm"
+
 
 def get_db_connection():
     return sqlite3.connect("trading_data.db")
 
 
-@dataclass
+@dataclass(slots=True)
 class SpotCoin:
     asset: str
     free: float
@@ -23,7 +35,7 @@ class SpotCoin:
         return self.free + self.locked
 
 
-@dataclass
+@dataclass(slots=True)
 class UmCoin:
     asset: str
     unrealizedProfit: float
@@ -35,7 +47,7 @@ class UmCoin:
         return self.walletBalance + self.unrealizedProfit
 
 
-@dataclass
+@dataclass(slots=True)
 class CmCoin:
     asset: str
     unrealizedProfit: float
@@ -47,7 +59,7 @@ class CmCoin:
         return self.walletBalance + self.unrealizedProfit
 
 
-@dataclass
+@dataclass(slots=True)
 class UmPosition:
     symbol: str
     position_amt: float
@@ -55,85 +67,91 @@ class UmPosition:
     notional: float
 
 
-@dataclass
+@dataclass(slots=True)
 class CmPosition:
     symbol: str
     position_amt: float
     unrealized_profit: float
+    contract_size: float
+
+    @property
+    def notional(self):
+        # Inverse contracts have a fixed value in USD
+        return self.position_amt * self.contract_size
 
 
-def get_valid_usdt_symbols(exchange: ccxt.binance):
-    valid_symbols = []
-    market = exchange.load_markets()
-    for symbol, mkt in market.items():
-        if mkt["spot"] and mkt["active"] and mkt["quote"] == "USDT":
-            valid_symbols.append(symbol)
-    return valid_symbols
+def get_valid_usdt_symbols(exchange: ccxt.binance) -> Set[str]:
+    """Call on every cycle; the set follows the registry's refreshed markets."""
+    return get_registry().lookups(exchange.id, exchange.load_markets()).usdt_symbols
 
 
 def init_db(user):
-    conn = sqlite3.connect("trading_data.db")
-    c = conn.cursor()
-    c.execute(f"""CREATE TABLE IF NOT EXISTS {user}_total_equity
-                 (timestamp INTEGER, spot_equity REAL, um_equity REAL, cm_equity REAL)""")
-    c.execute(f"""CREATE TABLE IF NOT EXISTS {user}_coin_balance
-                 (asset TEXT PRIMARY KEY, total_balance REAL)""")
-    c.execute(f"""CREATE TABLE IF NOT EXISTS {user}_cm_coin_balance
-                 (asset TEXT PRIMARY KEY, wallet_balance REAL, unrealized_profit REAL, total_balance REAL)""")
-    c.execute(f"""CREATE TABLE IF NOT EXISTS {user}_um_coin_balance
-                 (asset TEXT PRIMARY KEY, wallet_balance REAL, unrealized_profit REAL, total_balance REAL)""")
-
-    c.execute(f"""CREATE TABLE IF NOT EXISTS {user}_cm_positions
-                 (symbol TEXT PRIMARY KEY, contracts REAL, unrealized_pnl REAL)""")
-    c.execute(f"""CREATE TABLE IF NOT EXISTS {user}_um_positions
-                 (symbol TEXT PRIMARY KEY, contracts REAL, unrealized_pnl REAL)""")
-    conn.commit()
+    conn = get_db_connection()
+    init_schema(conn)
     conn.close()
 
 
-def query_cm_account_info(exchange: ccxt.binance, valid_usdt_symbols: List[str]):
-    res = exchange.dapiprivate_get_account()
-    positions = {}
-    for pos in res["positions"]:
-        if float(pos["positionAmt"]) != 0:
-            positions[pos["symbol"]] = CmPosition(
-                symbol=pos["symbol"],
-                position_amt=float(pos["positionAmt"]),
-                unrealized_profit=float(pos["unrealizedProfit"]),
-            )
+def usdt_price(asset: str, tickers: Dict[str, Any]) -> float:
+    if f"{asset}/USDT" in tickers:
+        return tickers[f"{asset}/USDT"]["last"]
+    elif asset == "USDT":
+        return 1
+    else:
+        return 0
 
-    cm_coins = {}
+
+def wallet_ticker_symbols(assets: List[Dict[str, Any]], valid_usdt_symbols: Collection[str]) -> List[str]:
     symbols = [
         f"{coin['asset']}/USDT"
-        for coin in res["assets"]
-        if coin["asset"] != "USDT" and float(coin["walletBalance"]) != 0
+        for coin in assets
+        if coin["asset"] != "USDT"
     ]
-    symbols = [s for s in symbols if s in valid_usdt_symbols]
-    if symbols:
-        tickers = exchange.fetch_tickers(symbols)
-    else:
-        tickers = {}
+    return [s for s in symbols if s in valid_usdt_symbols]
+
+
+def spot_ticker_symbols(res: Dict[str, Any], valid_usdt_symbols: Collection[str]) -> List[str]:
+    symbols = [
+        f"{coin['asset']}/USDT"
+        for coin in res["balances"]
+        if coin["asset"] != "USDT"
+    ]
+    return [s for s in symbols if s in valid_usdt_symbols]
+
 
+@timed('parse')
+def parse_cm_account(res: Dict[str, Any], tickers: Dict[str, Any], contract_sizes: Dict[str, float]):
+    positions = {}
+    for pos in res["positions"]:
+        if pos["symbol"] not in contract_sizes:
+            continue
+        positions[pos["symbol"]] = CmPosition(
+            symbol=pos["symbol"],
+            position_amt=float(pos["positionAmt"]),
+            unrealized_profit=float(pos["unrealizedProfit"]),
+            contract_size=contract_sizes[pos["symbol"]],
+        )
+
+    cm_coins = {}
     for coin in res["assets"]:
-        if float(coin["walletBalance"]) != 0:
-            if f"{coin['asset']}/USDT" in tickers:
-                price = tickers[f"{coin['asset']}/USDT"]["last"]
-            elif coin["asset"] == "USDT":
-                price = 1
-            else:
-                price = 0
-
-            cm_coins[coin["asset"]] = CmCoin(
-                asset=coin["asset"],
-                unrealizedProfit=float(coin["unrealizedProfit"]),
-                walletBalance=float(coin["walletBalance"]),
-                price_in_usdt=price,
-            )
+        cm_coins[coin["asset"]] = CmCoin(
+            asset=coin["asset"],
+            unrealizedProfit=float(coin["unrealizedProfit"]),
+            walletBalance=float(coin["walletBalance"]),
+            price_in_usdt=usdt_price(coin["asset"], tickers),
+        )
 
     return {"position": positions, "coins": cm_coins}
 
 
-def query_spot_account_info(exchange: ccxt.binance, valid_usdt_symbols: List[str]):
+def query_cm_account_info(exchange: ccxt.binance, valid_usdt_symbols: Collection[str], price_cache: Optional[PriceCache] = None):
+    res = compact_futures_account(exchange.dapiprivate_get_account())
+    symbols = wallet_ticker_symbols(res["assets"], valid_usdt_symbols)
+    tickers = fetch_usdt_tickers(exchange, symbols, price_cache)
+    contract_sizes = get_contract_sizes(exchange, [pos["symbol"] for pos in res["positions"]])
+    return parse_cm_account(res, tickers, contract_sizes)
+
+
+def query_spot_account_info(exchange: ccxt.binance, valid_usdt_symbols: Collection[str], price_cache: Optional[PriceCache] = None):
     """
         {'accountType': 'SPOT',
     'balances': [{'asset': 'BTC', 'free': '0.00000000', 'locked': '0.00000000'},
@@ -163,43 +181,26 @@ def query_spot_account_info(exchange: ccxt.binance, valid_usdt_symbols: List[str
     'uid': '1041165650',
     'updateTime': '1733845763670'}
     """
+    res = compact_spot_account(exchange.private_get_account())
+    symbols = spot_ticker_symbols(res, valid_usdt_symbols)
+    tickers = fetch_usdt_tickers(exchange, symbols, price_cache)
+    return parse_spot_account(res, tickers)
+
+
+@timed('parse')
+def parse_spot_account(res: Dict[str, Any], tickers: Dict[str, Any]) -> Dict[str, SpotCoin]:
     coins = {}
-    res = exchange.private_get_account()
-    balances = res["balances"]
-    symbols = [
-        f"{coin['asset']}/USDT"
-        for coin in balances
-        if (float(coin["free"]) != 0 or float(coin["locked"]) != 0)
-        and coin["asset"] != "USDT"
-    ]
-    # symbols = [f"{coin['asset']}/USDT" for coin in balances if coin["asset"] != "USDT"]
-    symbols = [s for s in symbols if s in valid_usdt_symbols]
-    if symbols:
-        tickers = exchange.fetch_tickers(symbols)
-    else:
-        tickers = {}
-
-    for coin in balances:
-        if float(coin["free"]) != 0 or float(coin["locked"]) != 0:
-            usdt_symbol = f"{coin['asset']}/USDT"
-
-            if usdt_symbol in tickers:
-                price = tickers[usdt_symbol]["last"]
-            elif coin["asset"] == "USDT":
-                price = 1
-            else:
-                price = 0
-
-            coins[coin["asset"]] = SpotCoin(
-                asset=coin["asset"],
-                free=float(coin["free"]),
-                locked=float(coin["locked"]),
-                price_in_usdt=price,
-            )
+    for coin in res["balances"]:
+        coins[coin["asset"]] = SpotCoin(
+            asset=coin["asset"],
+            free=float(coin["free"]),
+            locked=float(coin["locked"]),
+            price_in_usdt=usdt_price(coin["asset"], tickers),
+        )
     return coins
 
 
-def query_um_account_info(exchange: ccxt.binance, valid_usdt_symbols: List[str]):
+def query_um_account_info(exchange: ccxt.binance, valid_usdt_symbols: Collection[str], price_cache: Optional[PriceCache] = None):
     """
        {'assets': [{'asset': 'FDUSD',
                 'availableBalance': '181130.03317916',
@@ -314,49 +315,34 @@ def query_um_account_info(exchange: ccxt.binance, valid_usdt_symbols: List[str])
     'totalUnrealizedProfit': '58.91394793',
     'totalWalletBalance': '199889.43675008'}
     """
-    res = exchange.fapiPrivateV3GetAccount()
+    res = compact_futures_account(exchange.fapiPrivateV3GetAccount())
+    symbols = wallet_ticker_symbols(res["assets"], valid_usdt_symbols)
+    tickers = fetch_usdt_tickers(exchange, symbols, price_cache)
+    return parse_um_account(res, tickers)
+
 
+@timed('parse')
+def parse_um_account(res: Dict[str, Any], tickers: Dict[str, Any]):
     position = {}
     for pos in res["positions"]:
-        if float(pos["positionAmt"]) != 0:
-            position[pos["symbol"]] = UmPosition(
-                symbol=pos["symbol"],
-                position_amt=float(pos["positionAmt"]),
-                unrealized_profit=float(pos["unrealizedProfit"]),
-                notional=float(pos["notional"]),
-            )
+        position[pos["symbol"]] = UmPosition(
+            symbol=pos["symbol"],
+            position_amt=float(pos["positionAmt"]),
+            unrealized_profit=float(pos["unrealizedProfit"]),
+            notional=float(pos["notional"]),
+        )
 
     total_wallet_balance = res["totalWalletBalance"]
     total_unrealized_profit = res["totalUnrealizedProfit"]
 
     um_coins = {}
-
-    symbols = [
-        f"{coin['asset']}/USDT"
-        for coin in res["assets"]
-        if coin["asset"] != "USDT" and float(coin["walletBalance"]) != 0
-    ]
-    symbols = [s for s in symbols if s in valid_usdt_symbols]
-    if symbols:
-        tickers = exchange.fetch_tickers(symbols)
-    else:
-        tickers = {}
-
     for coin in res["assets"]:
-        if float(coin["walletBalance"]) != 0:
-            if f"{coin['asset']}/USDT" in tickers:
-                price = tickers[f"{coin['asset']}/USDT"]["last"]
-            elif coin["asset"] == "USDT":
-                price = 1
-            else:
-                price = 0
-
-            um_coins[coin["asset"]] = UmCoin(
-                asset=coin["asset"],
-                unrealizedProfit=float(coin["unrealizedProfit"]),
-                walletBalance=float(coin["walletBalance"]),
-                price_in_usdt=price,
-            )
+        um_coins[coin["asset"]] = UmCoin(
+            asset=coin["asset"],
+            unrealizedProfit=float(coin["unrealizedProfit"]),
+            walletBalance=float(coin["walletBalance"]),
+            price_in_usdt=usdt_price(coin["asset"], tickers),
+        )
 
     return {
         "total_wallet_balance": float(total_wallet_balance),
@@ -367,57 +353,20 @@ def query_um_account_info(exchange: ccxt.binance, valid_usdt_symbols: List[str])
 
 
 def update_positions(
-    user: str, um_positions: Dict[str, UmPosition], cm_positions: Dict[str, CmPosition]
+    batch: Batch, um_positions: Dict[str, UmPosition], cm_positions: Dict[str, CmPosition]
 ):
-    conn = get_db_connection()
-    c = conn.cursor()
-
-    # Get existing CM positions in the database
-    c.execute(f"SELECT symbol FROM {user}_cm_positions")
-    existing_cm_symbols = set(row[0] for row in c.fetchall())
-
-    # Update or insert CM positions
-    current_cm_symbols = set()
-    for pos in cm_positions.values():
-        symbol = pos.symbol
-        contracts = pos.position_amt
-        unrealized_pnl = pos.unrealized_profit
-
-        c.execute(
-            f"INSERT OR REPLACE INTO {user}_cm_positions VALUES (?, ?, ?)",
-            (symbol, contracts, unrealized_pnl),
-        )
-        current_cm_symbols.add(symbol)
-
-    # Delete CM positions that no longer exist
-    cm_symbols_to_delete = existing_cm_symbols - current_cm_symbols
-    for symbol in cm_symbols_to_delete:
-        c.execute(f"DELETE FROM {user}_cm_positions WHERE symbol = ?", (symbol,))
-        print(f"Deleted CM position for {symbol}")
-
-    # Get existing UM positions in the database
-    c.execute(f"SELECT symbol FROM {user}_um_positions")
-    existing_um_symbols = set(row[0] for row in c.fetchall())
-    current_um_symbols = set()
-
-    for pos in um_positions.values():
-        symbol = pos.symbol
-        contracts = pos.position_amt
-        unrealized_pnl = pos.unrealized_profit
-        c.execute(
-            f"INSERT OR REPLACE INTO {user}_um_positions VALUES (?, ?, ?)",
-            (symbol, contracts, unrealized_pnl),
-        )
-        current_um_symbols.add(symbol)
-
-    # Delete UM positions that no longer exist
-    um_symbols_to_delete = existing_um_symbols - current_um_symbols
-    for symbol in um_symbols_to_delete:
-        c.execute(f"DELETE FROM {user}_um_positions WHERE symbol = ?", (symbol,))
-        print(f"Deleted UM position for {symbol}")
-
-    conn.commit()
-    conn.close()
+    batch.sync(
+        POSITIONS,
+        CM,
+        {pos.symbol: (pos.position_amt, pos.unrealized_profit, abs(pos.notional)) for pos in cm_positions.values()},
+    )
+    batch.sync(
+        POSITIONS,
+        UM,
+        {pos.symbol: (pos.position_amt, pos.unrealized_profit, abs(pos.notional)) for pos in um_positions.values()},
+    )
+    value_notional(batch, UM)
+    value_notional(batch, CM)
 
 
 def fetch_spot_equity(coins: Dict[str, SpotCoin]):
@@ -438,96 +387,57 @@ def fetch_cm_equity(coins: Dict[str, CmCoin]):
 
 
 def update_total_equity_and_balance(
-    user,
+    batch: Batch,
     coins: Dict[str, SpotCoin],
     cm_coins: Dict[str, CmCoin],
     um_coins: Dict[str, UmCoin],
-    spot_equity: float,
     um_equity: float,
-    cm_equity: float,
 ):
-    conn = get_db_connection()
-    c = conn.cursor()
-
-    # Insert total equity
-    c.execute(
-        f"INSERT INTO {user}_total_equity VALUES (?, ?, ?, ?)",
-        (int(time.time()), spot_equity, um_equity, cm_equity),
+    value_wallet(batch, SPOT, {coin.asset: coin.total for coin in coins.values()},
+                 prices={coin.asset: coin.price_in_usdt for coin in coins.values()})
+    value_wallet(batch, CM, {coin.asset: coin.total for coin in cm_coins.values()},
+                 prices={coin.asset: coin.price_in_usdt for coin in cm_coins.values()})
+    # Binance values the UM wallet itself; the coins are held for repricing
+    value_wallet(batch, UM, {coin.asset: coin.total for coin in um_coins.values()},
+                 prices={coin.asset: coin.price_in_usdt for coin in um_coins.values()}, equity=um_equity)
+
+    # Replace coin balances, dropping coins that no longer exist
+    batch.sync(
+        BALANCES,
+        SPOT,
+        {coin.asset: (coin.total, None, None, None) for coin in coins.values()},
+    )
+    batch.sync(
+        BALANCES,
+        CM,
+        {
+            coin.asset: (coin.total, coin.walletBalance, coin.unrealizedProfit, None)
+            for coin in cm_coins.values()
+        },
+    )
+    batch.sync(
+        BALANCES,
+        UM,
+        {
+            coin.asset: (coin.total, coin.walletBalance, coin.unrealizedProfit, None)
+            for coin in um_coins.values()
+        },
     )
-
-    # Get existing coins in the database
-    c.execute(f"SELECT asset FROM {user}_coin_balance")
-    existing_coins = set(row[0] for row in c.fetchall())
-
-    # Update or insert coin balances
-    current_coins = set()
-    for coin in coins.values():
-        c.execute(
-            f"INSERT OR REPLACE INTO {user}_coin_balance VALUES (?, ?)",
-            (coin.asset, coin.total),
-        )
-        current_coins.add(coin.asset)
-
-    # Delete coins that no longer exist
-    coins_to_delete = existing_coins - current_coins
-    for coin in coins_to_delete:
-        c.execute(f"DELETE FROM {user}_coin_balance WHERE asset = ?", (coin,))
-        print(f"Deleted balance for {coin}")
-
-    c.execute(f"SELECT asset FROM {user}_cm_coin_balance")
-    existing_cm_coins = set(row[0] for row in c.fetchall())
-
-    current_cm_coins = set()
-    for coin in cm_coins.values():
-        c.execute(
-            f"INSERT OR REPLACE INTO {user}_cm_coin_balance VALUES (?, ?, ?, ?)",
-            (coin.asset, coin.walletBalance, coin.unrealizedProfit, coin.total),
-        )
-        current_cm_coins.add(coin.asset)
-
-    cm_coins_to_delete = existing_cm_coins - current_cm_coins
-    for coin in cm_coins_to_delete:
-        c.execute(f"DELETE FROM {user}_cm_coin_balance WHERE asset = ?", (coin,))
-        print(f"Deleted balance for {coin}")
-
-    c.execute(f"SELECT asset FROM {user}_um_coin_balance")
-    existing_um_coins = set(row[0] for row in c.fetchall())
-
-    current_um_coins = set()
-    for coin in um_coins.values():
-        c.execute(
-            f"INSERT OR REPLACE INTO {user}_um_coin_balance VALUES (?, ?, ?, ?)",
-            (coin.asset, coin.walletBalance, coin.unrealizedProfit, coin.total),
-        )
-        current_um_coins.add(coin.asset)
-
-    um_coins_to_delete = existing_um_coins - current_um_coins
-    for coin in um_coins_to_delete:
-        c.execute(f"DELETE FROM {user}_um_coin_balance WHERE asset = ?", (coin,))
-        print(f"Deleted balance for {coin}")
-
-    conn.commit()
-    conn.close()
 
 
-def update_data(user, exchange: ccxt.binance, valid_usdt_symbols: List[str]):
-    coins = query_spot_account_info(exchange, valid_usdt_symbols)
-    spot_equity = fetch_spot_equity(coins)
+def write_data(user, coins: Dict[str, SpotCoin], um_info: Dict[str, Any], cm_info: Dict[str, Any]):
+    um_equity = um_info["total_unrealized_profit"] + um_info["total_wallet_balance"]
 
-    res = query_um_account_info(exchange, valid_usdt_symbols)
-    um_equity = res["total_unrealized_profit"] + res["total_wallet_balance"]
-    um_coins = res["coins"]
+    with get_store().cycle(user, VENUE) as batch:
+        update_total_equity_and_balance(batch, coins, cm_info["coins"], um_info["coins"], um_equity)
+        update_positions(batch, um_info["position"], cm_info["position"])
 
-    um_positions = res["position"]
-    res = query_cm_account_info(exchange, valid_usdt_symbols)
-    cm_positions = res["position"]
-    cm_coins = res["coins"]
-    cm_equity = fetch_cm_equity(cm_coins)
 
-    update_total_equity_and_balance(
-        user, coins, cm_coins, um_coins, spot_equity, um_equity, cm_equity
-    )
-    update_positions(user, um_positions, cm_positions)
+def update_data(user, exchange: ccxt.binance, valid_usdt_symbols: Collection[str], price_cache: Optional[PriceCache] = None):
+    coins = query_spot_account_info(exchange, valid_usdt_symbols, price_cache)
+    um_info = query_um_account_info(exchange, valid_usdt_symbols, price_cache)
+    cm_info = query_cm_account_info(exchange, valid_usdt_symbols, price_cache)
+    write_data(user, coins, um_info, cm_info)
     print("Data updated")
 
 
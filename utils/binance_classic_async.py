@@ -0,0 +1,46 @@
+import asyncio
+from typing import Collection, Optional, Set
+
+import ccxt.async_support as ccxt_async
+
+from utils.binance_async import init_exchange
+from utils.binance_classic import (
+    parse_cm_account,
+    parse_spot_account,
+    parse_um_account,
+    spot_ticker_symbols,
+    wallet_ticker_symbols,
+    write_data,
+)
+from utils.markets import get_contract_sizes_async, get_registry
+from utils.parsing import compact_futures_account, compact_spot_account
+from utils.prices import PriceCache, fetch_usdt_tickers_async
+
+
+async def get_valid_usdt_symbols(exchange: ccxt_async.binance) -> Set[str]:
+    return get_registry().lookups(exchange.id, await exchange.load_markets()).usdt_symbols
+
+
+async def fetch_data(exchange: ccxt_async.binance, valid_usdt_symbols: Collection[str], price_cache: Optional[PriceCache] = None):
+    """(coins, um_info, cm_info) of the account, as write_data takes them."""
+    spot_res, um_res, cm_res = await asyncio.gather(
+        exchange.private_get_account(),
+        exchange.fapiPrivateV3GetAccount(),
+        exchange.dapiprivate_get_account(),
+    )
+    spot_res, um_res, cm_res = compact_spot_account(spot_res), compact_futures_account(um_res), compact_futures_account(cm_res)
+    spot_tickers, um_tickers, cm_tickers, contract_sizes = await asyncio.gather(
+        fetch_usdt_tickers_async(exchange, spot_ticker_symbols(spot_res, valid_usdt_symbols), price_cache),
+        fetch_usdt_tickers_async(exchange, wallet_ticker_symbols(um_res["assets"], valid_usdt_symbols), price_cache),
+        fetch_usdt_tickers_async(exchange, wallet_ticker_symbols(cm_res["assets"], valid_usdt_symbols), price_cache),
+        get_contract_sizes_async(exchange, [pos["symbol"] for pos in cm_res["positions"]]),
+    )
+    coins = parse_spot_account(spot_res, spot_tickers)
+    um_info = parse_um_account(um_res, um_tickers)
+    cm_info = parse_cm_account(cm_res, cm_tickers, contract_sizes)
+    return coins, um_info, cm_info
+
+
+async def update_data(user, exchange: ccxt_async.binance, valid_usdt_symbols: Collection[str], price_cache: Optional[PriceCache] = None):
+    write_data(user, *await fetch_data(exchange, valid_usdt_symbols, price_cache))
+    print("Data updated")
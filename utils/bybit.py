@@ -1,36 +1,73 @@
 import ccxt
 import sqlite3
 import time
-from typing import Dict, Any, List, Tuple
+from typing import Dict, Any, List, Optional, Tuple
 from dataclasses import dataclass
 from apscheduler.schedulers.blocking import BlockingScheduler
 
-@dataclass
+from utils.metrics import timed
+from utils.schema import BALANCES, POSITIONS, init_schema
+from utils.storage import Batch, get_store
+from utils.valuation import value_notional, value_wallet
+
+VENUE = 'bybit'
+WALLET_TYPE = 'unified'
+POSITIONS_PAGE_SIZE = 200
+
+@dataclass(slots=True)
 class Position:
     symbol: str
     contracts: float
     unrealized_pnl: float
     notional: float
 
+@dataclass(slots=True)
+class Coin:
+    coin: str
+    # Wallet balance plus unrealised PnL, negative when borrowed
+    equity: float
+    borrowed: float
+    usd_value: float
+
+@dataclass
+class Snapshot:
+    """Raw responses of one cycle: one unified balance and every page of positions."""
+    balance: Dict[str, Any]
+    positions: List[Dict[str, Any]]
+
+@dataclass
+class AccountState:
+    equity: float
+    coins: Dict[str, Coin]
+    balances: Dict[str, float]
+    positions: Dict[str, Position]
+
 def init_exchange(config: Dict[str, Any]) -> ccxt.Exchange:
     exchange_class = getattr(ccxt, config['exchange_id'])
     exchange = exchange_class(config)
     exchange.set_sandbox_mode(config.get('sandbox', False))
     return exchange
 
-def fetch_total_equity(exchange: ccxt.Exchange) -> float:
-    balance = exchange.fetch_balance()
+def parse_total_equity(balance: Dict[str, Any]) -> float:
     total_equity = balance['info']['result']['list'][0]['totalEquity']
     return float(total_equity)
 
-def fetch_coin_balance(exchange: ccxt.Exchange) -> Dict[str, float]:
-    balance = exchange.fetch_balance()
-    coin_balance = balance['free']
-    return coin_balance
-
-def fetch_positions(exchange: ccxt.Exchange) -> Dict[str, Position]:
+def parse_coins(balance: Dict[str, Any]) -> Dict[str, Coin]:
+    coins = {}
+    for coin in balance['info']['result']['list'][0].get('coin', []):
+        coins[coin['coin']] = Coin(
+            coin=coin['coin'],
+            equity=float(coin.get('equity') or 0),
+            borrowed=float(coin.get('borrowAmount') or 0),
+            usd_value=float(coin.get('usdValue') or 0),
+        )
+    return coins
+
+def parse_coin_balance(balance: Dict[str, Any]) -> Dict[str, float]:
+    return balance['free']
+
+def parse_positions(res: List[Dict[str, Any]]) -> Dict[str, Position]:
     positions = {}
-    res = exchange.fetch_positions(params={"limit": 200})
     for pos in res:
         symbol = pos['symbol']
         side = pos['side']
@@ -44,31 +81,58 @@ def fetch_positions(exchange: ccxt.Exchange) -> Dict[str, Position]:
         positions[symbol] = position
     return positions
 
+def next_cursor(page: List[Dict[str, Any]]) -> Optional[str]:
+    # ccxt copies result.nextPageCursor into the raw info of the first position
+    if not page:
+        return None
+    return page[0]['info'].get('nextPageCursor') or None
+
+def positions_params(cursor: Optional[str]) -> Dict[str, Any]:
+    params = {"limit": POSITIONS_PAGE_SIZE}
+    if cursor:
+        params["cursor"] = cursor
+    return params
+
+def fetch_all_positions(exchange: ccxt.Exchange) -> List[Dict[str, Any]]:
+    """Follow nextPageCursor until the last page of positions."""
+    positions = []
+    cursor = None
+    while True:
+        page = exchange.fetch_positions(params=positions_params(cursor))
+        positions.extend(page)
+        cursor = next_cursor(page) if len(page) >= POSITIONS_PAGE_SIZE else None
+        if cursor is None:
+            return positions
+
+def fetch_snapshot(exchange: ccxt.Exchange) -> Snapshot:
+    return Snapshot(exchange.fetch_balance(), fetch_all_positions(exchange))
+
+@timed('parse')
+def parse_snapshot(snapshot: Snapshot) -> AccountState:
+    return AccountState(
+        parse_total_equity(snapshot.balance),
+        parse_coins(snapshot.balance),
+        parse_coin_balance(snapshot.balance),
+        parse_positions(snapshot.positions),
+    )
+
+def fetch_total_equity(exchange: ccxt.Exchange) -> float:
+    return parse_total_equity(exchange.fetch_balance())
+
+def fetch_coin_balance(exchange: ccxt.Exchange) -> Dict[str, float]:
+    return parse_coin_balance(exchange.fetch_balance())
+
+def fetch_positions(exchange: ccxt.Exchange) -> Dict[str, Position]:
+    return parse_positions(fetch_all_positions(exchange))
+
 def init_db(user):
-    conn = sqlite3.connect('trading_data.db')
-    c = conn.cursor()
-    c.execute(f'''CREATE TABLE IF NOT EXISTS {user}_total_equity
-                 (timestamp INTEGER, equity REAL)''')
-    c.execute(f'''CREATE TABLE IF NOT EXISTS {user}_coin_balance
-                 (coin TEXT PRIMARY KEY, balance REAL)''')
-    c.execute(f'''CREATE TABLE IF NOT EXISTS {user}_positions
-                 (symbol TEXT PRIMARY KEY, contracts REAL, unrealized_pnl REAL, notional REAL)''')
-    c.execute(f'''CREATE TABLE IF NOT EXISTS {user}_total_notional
-                 (timestamp INTEGER, notional REAL)''')
-    conn.commit()
+    conn = get_db_connection()
+    init_schema(conn)
     conn.close()
 
 def get_db_connection():
     return sqlite3.connect('trading_data.db')
 
-def update_total_equity(exchange: ccxt.Exchange, user):
-    equity = fetch_total_equity(exchange)
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute(f"INSERT INTO {user}_total_equity VALUES (?, ?)", (int(time.time()), equity))
-    conn.commit()
-    conn.close()
-
 def rename_tables(conn: sqlite3.Connection, table_names: List[Tuple[str, str]]):
     cursor = conn.cursor()
     
@@ -84,53 +148,46 @@ def rename_tables(conn: sqlite3.Connection, table_names: List[Tuple[str, str]]):
     conn.commit()
     cursor.close()
 
-def update_coin_balance(exchange: ccxt.Exchange, user):
-    balances = fetch_coin_balance(exchange)
-    conn = get_db_connection()
-    c = conn.cursor()
-
-    c.execute(f"SELECT coin FROM {user}_coin_balance")
-    existing_coins = set(row[0] for row in c.fetchall())
-
-    current_coins = set(balances.keys())
+def write_total_equity(batch: Batch, equity: float, coins: Dict[str, Coin]):
+    # Bybit reports the unified account's equity in USD already; the coins are held for repricing
+    value_wallet(
+        batch,
+        WALLET_TYPE,
+        {coin.coin: coin.equity for coin in coins.values()},
+        {coin.coin: coin.borrowed for coin in coins.values() if coin.borrowed},
+        {coin.coin: coin.usd_value / coin.equity for coin in coins.values() if coin.equity},
+        equity=equity,
+    )
+
+def write_coin_balance(batch: Batch, balances: Dict[str, float]):
+    batch.sync(BALANCES, WALLET_TYPE, {coin: (balance, None, None, None) for coin, balance in balances.items()})
+
+def write_positions(batch: Batch, positions: Dict[str, Position]):
+    batch.sync(POSITIONS, WALLET_TYPE, {
+        symbol: (position.contracts, position.unrealized_pnl, position.notional)
+        for symbol, position in positions.items()
+    })
+    value_notional(batch, WALLET_TYPE)
+
+def persist(user, state: AccountState):
+    with get_store().cycle(user, VENUE) as batch:
+        write_total_equity(batch, state.equity, state.coins)
+        write_coin_balance(batch, state.balances)
+        write_positions(batch, state.positions)
 
-    for coin, balance in balances.items():
-        c.execute(f"INSERT OR REPLACE INTO {user}_coin_balance VALUES (?, ?)", (coin, balance))
-
-    coins_to_delete = existing_coins - current_coins
-    for coin in coins_to_delete:
-        c.execute(f"DELETE FROM {user}_coin_balance WHERE coin = ?", (coin,))
-        print(f"Deleted balance for {coin}")
+def update_total_equity(exchange: ccxt.Exchange, user):
+    balance = exchange.fetch_balance()
+    with get_store().cycle(user, VENUE) as batch:
+        write_total_equity(batch, parse_total_equity(balance), parse_coins(balance))
 
-    conn.commit()
-    conn.close()
+def update_coin_balance(exchange: ccxt.Exchange, user):
+    with get_store().cycle(user, VENUE) as batch:
+        write_coin_balance(batch, fetch_coin_balance(exchange))
 
 def update_positions(exchange: ccxt.Exchange, user):
-    positions = fetch_positions(exchange)
-    total_notional = sum([p.notional for p in positions.values()])
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute(f"INSERT INTO {user}_total_notional VALUES (?, ?)", (int(time.time()), total_notional))
-    c.execute(f"SELECT symbol FROM {user}_positions")
-    existing_symbols = set(row[0] for row in c.fetchall())
-    
-    current_symbols = set(positions.keys())
-    
-    for symbol, position in positions.items():
-        c.execute(f"INSERT OR REPLACE INTO {user}_positions VALUES (?, ?, ?, ?)",
-                  (symbol, position.contracts, position.unrealized_pnl, position.notional))
-    
-    symbols_to_delete = existing_symbols - current_symbols
-    for symbol in symbols_to_delete:
-        c.execute(f"DELETE FROM {user}_positions WHERE symbol = ?", (symbol,))
-        print(f"Deleted position for {symbol}")
-    
-    conn.commit()
-    conn.close()
+    with get_store().cycle(user, VENUE) as batch:
+        write_positions(batch, fetch_positions(exchange))
 
 def update_data(exchange: ccxt.Exchange, user):
-    update_total_equity(exchange, user)
-    update_coin_balance(exchange, user)
-    update_positions(exchange, user)
+    persist(user, parse_snapshot(fetch_snapshot(exchange)))
     print("Data updated")
-
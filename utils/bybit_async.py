@@ -0,0 +1,31 @@
+import asyncio
+from typing import Any, Dict, List
+
+import ccxt.async_support as ccxt_async
+
+from utils.bybit import POSITIONS_PAGE_SIZE, Snapshot, next_cursor, parse_snapshot, persist, positions_params
+
+
+def init_exchange(config: Dict[str, Any]) -> ccxt_async.Exchange:
+    exchange_class = getattr(ccxt_async, config['exchange_id'])
+    exchange = exchange_class(config)
+    exchange.set_sandbox_mode(config.get('sandbox', False))
+    return exchange
+
+async def fetch_all_positions(exchange: ccxt_async.Exchange) -> List[Dict[str, Any]]:
+    positions = []
+    cursor = None
+    while True:
+        page = await exchange.fetch_positions(params=positions_params(cursor))
+        positions.extend(page)
+        cursor = next_cursor(page) if len(page) >= POSITIONS_PAGE_SIZE else None
+        if cursor is None:
+            return positions
+
+async def fetch_snapshot(exchange: ccxt_async.Exchange) -> Snapshot:
+    balance, positions = await asyncio.gather(exchange.fetch_balance(), fetch_all_positions(exchange))
+    return Snapshot(balance, positions)
+
+async def update_data(exchange: ccxt_async.Exchange, user):
+    persist(user, parse_snapshot(await fetch_snapshot(exchange)))
+    print("Data updated")
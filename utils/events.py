@@ -0,0 +1,230 @@
+import json
+import sqlite3
+import threading
+from collections import deque
+from dataclasses import asdict, dataclass
+from itertools import islice
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+from utils.schema import BALANCES, POSITIONS, Table, get_meta, set_meta
+
+EVENTS_PORT = 9110
+BUFFER_SIZE = 100000
+READ_LIMIT = 1000
+KEEPALIVE = 15
+
+EQUITY_SAMPLE = 'equity_sample'
+BALANCE_CHANGED = 'balance_changed'
+POSITION_OPENED = 'position_opened'
+POSITION_RESIZED = 'position_resized'
+POSITION_UPDATED = 'position_updated'
+POSITION_CLOSED = 'position_closed'
+# Current-state tables whose changes become events
+EVENT_TABLES = (BALANCES, POSITIONS)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS events (
+    seq INTEGER PRIMARY KEY,
+    ts INTEGER NOT NULL,
+    type TEXT NOT NULL,
+    account TEXT NOT NULL,
+    venue TEXT NOT NULL,
+    wallet_type TEXT NOT NULL,
+    key TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS events_ts ON events (ts);
+'''
+EVENTS_INSERT_SQL = "INSERT INTO events VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+
+Row = Tuple[Any, ...]
+Values = Optional[Dict[str, Optional[float]]]
+
+
+@dataclass(slots=True)
+class Event:
+    """
+    One committed change. `values` is the new row (None once a balance is
+    removed or a position closed) and `previous` the row it replaced (None
+    for a new balance or an opened position). Equity samples have no key.
+    """
+    seq: int
+    ts: int
+    type: str
+    account: str
+    venue: str
+    wallet_type: str
+    key: Optional[str]
+    values: Values
+    previous: Values = None
+
+    def to_row(self) -> Row:
+        data = json.dumps({'values': self.values, 'previous': self.previous})
+        return (self.seq, self.ts, self.type, self.account, self.venue, self.wallet_type, self.key, data)
+
+    @classmethod
+    def from_row(cls, row: Row) -> 'Event':
+        seq, ts, type, account, venue, wallet_type, key, data = row
+        return cls(seq, ts, type, account, venue, wallet_type, key, **json.loads(data))
+
+    def to_json(self) -> str:
+        return json.dumps(asdict(self))
+
+
+def init_events(conn: sqlite3.Connection) -> int:
+    """Create the event log and return the last sequence number handed out."""
+    conn.executescript(SCHEMA)
+    last = conn.execute("SELECT coalesce(max(seq), 0) FROM events").fetchone()[0]
+    return max(last, get_meta(conn, 'event_seq') or 0)
+
+
+def prune_events(conn: sqlite3.Connection, before: int):
+    # Keep the high-water mark, so sequence numbers go on from it even if
+    # the log is emptied
+    last = conn.execute("SELECT max(seq) FROM events").fetchone()[0]
+    if last is not None:
+        set_meta(conn, 'event_seq', max(last, get_meta(conn, 'event_seq') or 0))
+    conn.execute("DELETE FROM events WHERE ts < ?", (before,))
+
+
+def row_values(table: Table, row: Optional[Row]) -> Values:
+    return None if row is None else dict(zip(table.columns, row))
+
+
+def row_event_type(table: Table, old: Optional[Row], new: Optional[Row]) -> str:
+    if table is BALANCES:
+        return BALANCE_CHANGED
+    if old is None:
+        return POSITION_OPENED
+    if new is None:
+        return POSITION_CLOSED
+    return POSITION_RESIZED if old[0] != new[0] else POSITION_UPDATED
+
+
+class EventBus:
+    """
+    In-process pub/sub of committed change events, resumable by sequence number.
+
+    The store assigns every event the next sequence number and writes it to
+    the events table in the transaction that makes the change. After the
+    commit, it publishes the events here. Recent events are also kept in
+    memory. A consumer that reconnects reads everything after the last
+    sequence number it saw: from memory if the events are still buffered,
+    otherwise from the table.
+    """
+
+    def __init__(self, connect: Callable[[], sqlite3.Connection], last_seq: int = 0, buffer_size: int = BUFFER_SIZE):
+        self.connect = connect
+        self.last_seq = last_seq
+        self.buffer: Deque[Event] = deque(maxlen=buffer_size)
+        self._subscribers: List[Callable[[Event], None]] = []
+        self._condition = threading.Condition()
+
+    def publish(self, events: List[Event]):
+        if not events:
+            return
+        with self._condition:
+            self.buffer.extend(events)
+            self.last_seq = events[-1].seq
+            subscribers = list(self._subscribers)
+            self._condition.notify_all()
+        for callback in subscribers:
+            for event in events:
+                try:
+                    callback(event)
+                except Exception as e:
+                    print(f"Event subscriber failed: {e!r}")
+
+    def subscribe(self, callback: Callable[[Event], None], since: Optional[int] = None):
+        """
+        Call `callback` with every event published from now on, on the
+        writer thread. With `since`, first replay the events after that
+        sequence number.
+        """
+        while True:
+            # The backlog is replayed without the lock, so publishing goes on
+            backlog = [] if since is None else self.read(since)
+            for event in backlog:
+                callback(event)
+                since = event.seq
+            with self._condition:
+                # Done once caught up, or when what is left was pruned and
+                # nothing was published since the last read
+                caught_up = since is None or since >= self.last_seq
+                if caught_up or not (backlog or self.buffer and self.buffer[-1].seq > since):
+                    self._subscribers.append(callback)
+                    return
+
+    def read(self, since: int, limit: int = READ_LIMIT) -> List[Event]:
+        """Up to `limit` events with a sequence number above `since`, oldest first."""
+        with self._condition:
+            if since >= self.last_seq:
+                return []
+            buffer = self.buffer
+            if buffer and buffer[0].seq <= since + 1:
+                start = since + 1 - buffer[0].seq
+                return list(islice(buffer, start, start + limit))
+        conn = self.connect()
+        try:
+            rows = conn.execute("SELECT * FROM events WHERE seq > ? ORDER BY seq LIMIT ?", (since, limit)).fetchall()
+        finally:
+            conn.close()
+        return [Event.from_row(row) for row in rows]
+
+    def wait(self, since: int, timeout: Optional[float] = None, limit: int = READ_LIMIT) -> List[Event]:
+        """Block until there are events after `since` (or the timeout passes) and return them."""
+        with self._condition:
+            self._condition.wait_for(lambda: self.last_seq > since, timeout)
+        return self.read(since, limit)
+
+
+class EventsHandler(BaseHTTPRequestHandler):
+    """
+    Server-sent events: GET /events streams every event after `?since=` or
+    the Last-Event-ID header (only new events when neither is given),
+    optionally only those of `?account=`.
+    """
+    bus: EventBus
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != '/events':
+            self.send_error(404)
+            return
+        query = parse_qs(url.query)
+        since = query.get('since', [self.headers.get('Last-Event-ID')])[0]
+        account = query.get('account', [None])[0]
+        try:
+            since = self.bus.last_seq if since is None else int(since)
+        except ValueError:
+            self.send_error(400, 'since must be a sequence number')
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        try:
+            while True:
+                events = self.bus.wait(since, KEEPALIVE)
+                if not events:
+                    self.wfile.write(b': keepalive\n\n')
+                for event in events:
+                    if account is None or event.account == account:
+                        self.wfile.write(f"id: {event.seq}\nevent: {event.type}\ndata: {event.to_json()}\n\n".encode())
+                    since = event.seq
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            return
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_events(bus: EventBus, port: int = EVENTS_PORT, host: str = '127.0.0.1') -> ThreadingHTTPServer:
+    """Stream the bus as server-sent events on a background thread."""
+    handler = type('BusEventsHandler', (EventsHandler,), {'bus': bus})
+    server = ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, name='events', daemon=True).start()
+    return server
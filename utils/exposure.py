@@ -0,0 +1,114 @@
+import math
+import re
+import sqlite3
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+from utils.schema import HOLDINGS, POSITIONS, Table, get_meta, set_meta
+
+EXPOSURE_TABLES = (HOLDINGS, POSITIONS)
+# Bump when the contribution of a row changes, to rebuild the table once
+EXPOSURE_VERSION = 2
+# Longest first so BTCUSDT is not read as BTCUSD + T
+QUOTES = ('FDUSD', 'USDT', 'USDC', 'BUSD', 'USD')
+# Contracts quoted per 1000 (or a million) units, e.g. 1000PEPEUSDT
+MULTIPLIER = re.compile(r'^(?:1000+|1M)(?=[A-Z])')
+# Residue left by adding and subtracting the same floats
+EPSILON = 1e-9
+
+# quantity: net amount held across every wallet; net/gross notional and
+# positions: open derivative positions on the asset, in the quote currency
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS exposure (
+    asset TEXT PRIMARY KEY,
+    ts INTEGER NOT NULL,
+    quantity REAL NOT NULL,
+    net_notional REAL NOT NULL,
+    gross_notional REAL NOT NULL,
+    positions INTEGER NOT NULL
+) WITHOUT ROWID;
+'''
+
+ADD_SQL = f'''
+INSERT INTO exposure VALUES (?, ?, ?, ?, ?, ?)
+ON CONFLICT (asset) DO UPDATE SET
+    ts = excluded.ts,
+    quantity = CASE WHEN abs(quantity + excluded.quantity) < {EPSILON} THEN 0 ELSE quantity + excluded.quantity END,
+    net_notional = CASE WHEN abs(net_notional + excluded.net_notional) < {EPSILON} THEN 0 ELSE net_notional + excluded.net_notional END,
+    gross_notional = CASE WHEN abs(gross_notional + excluded.gross_notional) < {EPSILON} THEN 0 ELSE gross_notional + excluded.gross_notional END,
+    positions = positions + excluded.positions
+'''
+
+Delta = List[float]
+Row = Tuple[Any, ...]
+
+
+@lru_cache(maxsize=None)
+def base_asset(symbol: str) -> str:
+    """
+    Canonical base asset of a symbol in any venue's format: BTC/USDT:USDT
+    (ccxt), BTCUSDT (Binance UM), BTCUSD_PERP or BTCUSD_250328 (Binance CM)
+    are all BTC, and 1000PEPEUSDT is PEPE.
+    """
+    if '/' in symbol:
+        base = symbol.split('/')[0]
+    else:
+        base = symbol.split('_')[0]
+        for quote in QUOTES:
+            if base.endswith(quote) and len(base) > len(quote):
+                base = base[:-len(quote)]
+                break
+    return MULTIPLIER.sub('', base)
+
+
+def contribution(table: Table, row: Optional[Row]) -> Delta:
+    """(quantity, net notional, gross notional, positions) one row adds to its asset."""
+    if row is None:
+        return [0.0, 0.0, 0.0, 0]
+    if table is HOLDINGS:
+        return [row[0] or 0.0, 0.0, 0.0, 0]
+    contracts, _, notional = row
+    notional = abs(notional or 0.0)
+    return [0.0, math.copysign(notional, contracts or 0.0), notional, 1]
+
+
+def exposure_asset(table: Table, key: str) -> str:
+    # Holdings are keyed by asset already; FDUSD or BUSD are not pairs
+    return key if table is HOLDINGS else base_asset(key)
+
+
+def add_deltas(deltas: Dict[str, Delta], table: Table, key: str, old: Optional[Row], new: Optional[Row]):
+    """Fold the change of one row from old to new (None when absent) into the per-asset deltas."""
+    delta = deltas.setdefault(exposure_asset(table, key), [0.0, 0.0, 0.0, 0])
+    for i, (before, after) in enumerate(zip(contribution(table, old), contribution(table, new))):
+        delta[i] += after - before
+
+
+def apply_exposure(conn: sqlite3.Connection, deltas: Dict[str, Delta], ts: int):
+    """Add per-asset deltas to the exposure table; must run in the transaction that writes the rows."""
+    rows = [(asset, ts, *delta) for asset, delta in deltas.items() if any(delta)]
+    conn.executemany(ADD_SQL, rows)
+    conn.executemany(
+        "DELETE FROM exposure WHERE asset = ? AND quantity = 0 AND gross_notional = 0 AND positions = 0",
+        [row[:1] for row in rows],
+    )
+
+
+def init_exposure(conn: sqlite3.Connection):
+    """Create the exposure table and rebuild it when it is empty or was built by another version."""
+    conn.executescript(SCHEMA)
+    if get_meta(conn, 'exposure_version') == EXPOSURE_VERSION and conn.execute("SELECT 1 FROM exposure LIMIT 1").fetchone():
+        return
+    deltas: Dict[str, Delta] = {}
+    for table in EXPOSURE_TABLES:
+        for key, ts, *values in conn.execute(f"SELECT {table.key}, ts, {', '.join(table.columns)} FROM {table.name}"):
+            add_deltas(deltas, table, key, None, tuple(values))
+    with conn:
+        conn.execute("DELETE FROM exposure")
+        apply_exposure(conn, deltas, conn.execute("SELECT coalesce(max(ts), 0) FROM positions").fetchone()[0])
+        set_meta(conn, 'exposure_version', EXPOSURE_VERSION)
+
+
+def query_exposure(conn: sqlite3.Connection) -> List[Tuple[str, int, float, float, float, int]]:
+    """Firm-wide (asset, ts, quantity, net_notional, gross_notional, positions), largest gross notional first."""
+    return conn.execute("SELECT * FROM exposure ORDER BY gross_notional DESC, asset").fetchall()
@@ -0,0 +1,130 @@
+import sqlite3
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from utils.schema import BALANCES, POSITIONS, SCOPE, Table
+
+HISTORY_TABLES = (BALANCES, POSITIONS)
+# valid_to of the open version in the interval index; the table itself keeps NULL
+OPEN_END = 1e12
+
+Row = Tuple[Any, ...]
+
+
+def history_name(table: Table) -> str:
+    return f"{table.name}_history"
+
+
+def index_name(table: Table) -> str:
+    return f"{table.name}_history_index"
+
+
+def history_schema(table: Table) -> str:
+    name = history_name(table)
+    columns = ',\n    '.join(f"{column} REAL" for column in table.columns)
+    return f'''
+CREATE TABLE IF NOT EXISTS {name} (
+    id INTEGER PRIMARY KEY,
+    account TEXT NOT NULL,
+    venue TEXT NOT NULL,
+    wallet_type TEXT NOT NULL,
+    {table.key} TEXT NOT NULL,
+    valid_from INTEGER NOT NULL,
+    valid_to INTEGER,
+    {columns}
+);
+CREATE UNIQUE INDEX IF NOT EXISTS {name}_open ON {name} (account, venue, wallet_type, {table.key}) WHERE valid_to IS NULL;
+CREATE VIRTUAL TABLE IF NOT EXISTS {index_name(table)} USING rtree(id, account_min, account_max, valid_from, valid_to);
+'''
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS history_accounts (
+    id INTEGER PRIMARY KEY,
+    account TEXT NOT NULL UNIQUE
+);
+''' + ''.join(history_schema(table) for table in HISTORY_TABLES)
+
+
+def init_history(conn: sqlite3.Connection):
+    """Create the history tables and open a version for every current row that has none yet."""
+    conn.executescript(SCHEMA)
+    with conn:
+        for table in HISTORY_TABLES:
+            seed_history(conn, table)
+
+
+def seed_history(conn: sqlite3.Connection, table: Table):
+    name = history_name(table)
+    columns = ', '.join(SCOPE + (table.key,) + table.columns)
+    scope_match = ' AND '.join(f"h.{column} = t.{column}" for column in SCOPE + (table.key,))
+    last_id = conn.execute(f"SELECT coalesce(max(id), 0) FROM {name}").fetchone()[0]
+    conn.execute(f"INSERT OR IGNORE INTO history_accounts (account) SELECT DISTINCT account FROM {table.name}")
+    conn.execute(f"""INSERT INTO {name} ({columns}, valid_from)
+        SELECT {', '.join(f"t.{column}" for column in SCOPE + (table.key,) + table.columns)}, t.ts FROM {table.name} t
+        WHERE NOT EXISTS (SELECT 1 FROM {name} h WHERE {scope_match} AND h.valid_to IS NULL)""")
+    conn.execute(f"""INSERT INTO {index_name(table)}
+        SELECT h.id, a.id, a.id, h.valid_from, ? FROM {name} h JOIN history_accounts a ON a.account = h.account
+        WHERE h.id > ?""", (OPEN_END, last_id))
+
+
+def account_id(conn: sqlite3.Connection, account: str) -> int:
+    conn.execute("INSERT OR IGNORE INTO history_accounts (account) VALUES (?)", (account,))
+    return conn.execute("SELECT id FROM history_accounts WHERE account = ?", (account,)).fetchone()[0]
+
+
+def record_history(conn: sqlite3.Connection, table: Table, scope: Tuple[str, str, str], ts: int,
+                   changed: Sequence[Row], deleted: Sequence[Any]):
+    """
+    Close the open version of every changed or deleted key at `ts` and open a
+    new version for every changed row, given as (key, values...). Must run in
+    the transaction that writes the current-state table.
+    """
+    name = history_name(table)
+    key_match = ' AND '.join(f"{column} = ?" for column in SCOPE + (table.key,))
+    closed = []
+    for key in [row[0] for row in changed] + list(deleted):
+        version = conn.execute(f"UPDATE {name} SET valid_to = ? WHERE {key_match} AND valid_to IS NULL RETURNING id",
+                               (ts,) + scope + (key,)).fetchone()
+        if version is not None:
+            closed.append((ts, version[0]))
+    conn.executemany(f"UPDATE {index_name(table)} SET valid_to = ? WHERE id = ?", closed)
+
+    if not changed:
+        return
+    account = account_id(conn, scope[0])
+    columns = ', '.join(SCOPE + (table.key, 'valid_from') + table.columns)
+    insert_sql = f"INSERT INTO {name} ({columns}) VALUES ({', '.join('?' * (len(SCOPE) + 2 + len(table.columns)))})"
+    opened = []
+    for key, *values in changed:
+        cursor = conn.execute(insert_sql, scope + (key, ts) + tuple(values))
+        opened.append((cursor.lastrowid, account, account, ts, OPEN_END))
+    conn.executemany(f"INSERT INTO {index_name(table)} VALUES (?, ?, ?, ?, ?)", opened)
+
+
+def state_at(conn: sqlite3.Connection, table: Table, account: str, ts: int,
+             wallet_type: Optional[str] = None) -> Dict[str, Dict[str, Row]]:
+    """
+    Rebuild the rows an account held in `table` at `ts`, as {wallet_type: {key: values}}.
+
+    The interval index finds the versions valid at `ts` in logarithmic time
+    in the number of versions; it stores 32-bit floats, so its matches are
+    checked against the exact bounds in the history table.
+    """
+    found = conn.execute("SELECT id FROM history_accounts WHERE account = ?", (account,)).fetchone()
+    if found is None:
+        return {}
+    wallet_filter = " AND h.wallet_type = ?" if wallet_type else ""
+    params: List[Any] = [found[0], found[0], ts, ts, ts, ts]
+    if wallet_type:
+        params.append(wallet_type)
+    rows = conn.execute(
+        f"""SELECT h.wallet_type, h.{table.key}, {', '.join(f"h.{column}" for column in table.columns)}
+            FROM {index_name(table)} i JOIN {history_name(table)} h ON h.id = i.id
+            WHERE i.account_min <= ? AND i.account_max >= ? AND i.valid_from <= ? AND i.valid_to > ?
+              AND h.valid_from <= ? AND (h.valid_to IS NULL OR h.valid_to > ?){wallet_filter}""",
+        params,
+    ).fetchall()
+    state: Dict[str, Dict[str, Row]] = {}
+    for wallet, key, *values in rows:
+        state.setdefault(wallet, {})[key] = tuple(values)
+    return state
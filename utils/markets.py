@@ -0,0 +1,287 @@
+import asyncio
+import json
+import os
+import threading
+import time
+import weakref
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import ccxt
+
+CACHE_DIR = '.cache'
+DEFAULT_REFRESH_INTERVAL = 3600
+# Least time between two reloads for the same unknown contract
+UNKNOWN_RELOAD_INTERVAL = 600
+
+# Everything ccxt's set_markets builds from the markets and currencies
+MARKET_ATTRIBUTES = (
+    'markets', 'markets_by_id', 'symbols', 'ids',
+    'currencies', 'currencies_by_id', 'codes', 'baseCurrencies', 'quoteCurrencies',
+)
+
+
+def cm_contract_sizes(markets: Dict[str, Any]) -> Dict[str, float]:
+    """Map the exchange id of every inverse (coin-margined) contract to its contract size."""
+    return {
+        mkt['id']: float(mkt['info'].get('contractSize') or mkt['contractSize'])
+        for mkt in markets.values()
+        if mkt.get('inverse')
+    }
+
+
+def usdt_spot_symbols(markets: Dict[str, Any]) -> Set[str]:
+    return {
+        symbol
+        for symbol, mkt in markets.items()
+        if mkt["spot"] and mkt["active"] and mkt["quote"] == "USDT"
+    }
+
+
+@dataclass(slots=True)
+class MarketLookups:
+    """What the updaters look up in one generation of a venue's markets."""
+    markets: Dict[str, Any]
+    contract_sizes: Dict[str, float]
+    usdt_symbols: Set[str]
+
+
+def derive_lookups(markets: Dict[str, Any]) -> MarketLookups:
+    return MarketLookups(markets, cm_contract_sizes(markets), usdt_spot_symbols(markets))
+
+
+def market_snapshot(exchange: ccxt.Exchange) -> Dict[str, Any]:
+    return {name: getattr(exchange, name) for name in MARKET_ATTRIBUTES}
+
+
+def restore_snapshot(cached: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Rebuild the lookups set_markets derives from markets that already went
+    through it once, without deep-extending every market again.
+    """
+    markets = {market['symbol']: market for market in cached['markets']}
+    markets_by_id: Dict[str, list] = {}
+    # Spot first, as set_markets resolves market id conflicts
+    for market in sorted(markets.values(), key=lambda market: not market['spot']):
+        markets_by_id.setdefault(market['id'], []).append(market)
+    currencies = cached['currencies'] or {}
+    return {
+        'markets': markets,
+        'markets_by_id': markets_by_id,
+        'symbols': sorted(markets),
+        'ids': sorted(markets_by_id),
+        'currencies': currencies,
+        'currencies_by_id': {currency['id']: currency for currency in currencies.values() if 'id' in currency},
+        'codes': sorted(currencies),
+        'baseCurrencies': cached['baseCurrencies'],
+        'quoteCurrencies': cached['quoteCurrencies'],
+    }
+
+
+def share_markets(exchange: ccxt.Exchange, snapshot: Dict[str, Any]):
+    for name, value in snapshot.items():
+        setattr(exchange, name, value)
+
+
+class MarketRegistry:
+    """One copy of each venue's markets, shared read-only by every exchange instance of that venue."""
+
+    def __init__(self, cache_dir: Optional[str] = None, max_age: float = DEFAULT_REFRESH_INTERVAL):
+        self.cache_dir = cache_dir
+        self.max_age = max_age
+        self.snapshots: Dict[str, Dict[str, Any]] = {}
+        self.updated: Dict[str, float] = {}
+        self.loads: Dict[str, int] = defaultdict(int)
+        self.derived: Dict[str, MarketLookups] = {}
+        self.unknown: Dict[Tuple[str, str], float] = {}
+        self.instances: Dict[str, weakref.WeakSet] = defaultdict(weakref.WeakSet)
+        self._lock = threading.Lock()
+        self._venue_locks: Dict[str, threading.Lock] = defaultdict(threading.Lock)
+        self._async_locks: Dict[str, asyncio.Lock] = {}
+        self._reloading: Set[str] = set()
+        self._tasks: Set[asyncio.Task] = set()
+
+    def attach(self, exchange: ccxt.Exchange) -> ccxt.Exchange:
+        """Share the venue's markets with a sync or async exchange, now and after every reload."""
+        venue = exchange.id
+        load_markets = exchange.load_markets
+        with self._lock:
+            self.instances[venue].add(exchange)
+            snapshot = self.snapshots.get(venue)
+        if snapshot is not None:
+            share_markets(exchange, snapshot)
+
+        if asyncio.iscoroutinefunction(load_markets):
+            async def shared_load_markets(reload=False, params={}):
+                return await self.load_async(exchange, load_markets, reload, params)
+        else:
+            def shared_load_markets(reload=False, params={}):
+                return self.load(exchange, load_markets, reload, params)
+        exchange.load_markets = shared_load_markets
+        return exchange
+
+    def publish(self, venue: str, snapshot: Dict[str, Any], updated: Optional[float] = None):
+        with self._lock:
+            self.snapshots[venue] = snapshot
+            self.updated[venue] = updated or time.time()
+            self.loads[venue] += 1
+            instances = list(self.instances[venue])
+        for instance in instances:
+            share_markets(instance, snapshot)
+
+    def lookups(self, venue: str, markets: Dict[str, Any]) -> MarketLookups:
+        """Lookups of markets returned by load_markets."""
+        with self._lock:
+            lookups = self.derived.get(venue)
+            if lookups is not None and lookups.markets is markets:
+                return lookups
+            shared = self.snapshots.get(venue, {}).get('markets') is markets
+        lookups = derive_lookups(markets)
+        if shared:
+            # Markets of exchanges that are not attached are not kept
+            with self._lock:
+                self.derived[venue] = lookups
+        return lookups
+
+    def reload_for(self, venue: str, symbols: List[str], known: Dict[str, Any]) -> bool:
+        """Whether symbols missing from `known` call for a reload; each can ask once per UNKNOWN_RELOAD_INTERVAL."""
+        now = time.time()
+        due = []
+        with self._lock:
+            for symbol in symbols:
+                if symbol not in known and now - self.unknown.get((venue, symbol), 0) >= UNKNOWN_RELOAD_INTERVAL:
+                    self.unknown[(venue, symbol)] = now
+                    due.append(symbol)
+        return bool(due)
+
+    def cache_path(self, venue: str) -> str:
+        return os.path.join(self.cache_dir, f"ccxt_markets_{venue}.json")
+
+    def read_cache(self, exchange: ccxt.Exchange) -> bool:
+        """Build the exchange's markets from the disk cache and publish them."""
+        if self.cache_dir is None:
+            return False
+        try:
+            with open(self.cache_path(exchange.id)) as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            return False
+        snapshot = restore_snapshot(cached)
+        share_markets(exchange, snapshot)
+        self.publish(exchange.id, snapshot, cached['updated'])
+        return True
+
+    def write_cache(self, venue: str, snapshot: Dict[str, Any]):
+        if self.cache_dir is None:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self.cache_path(venue)
+        with open(f"{path}.tmp", 'w') as f:
+            json.dump({
+                'updated': time.time(),
+                'markets': list(snapshot['markets'].values()),
+                'currencies': snapshot['currencies'],
+                'baseCurrencies': snapshot['baseCurrencies'],
+                'quoteCurrencies': snapshot['quoteCurrencies'],
+            }, f)
+        os.replace(f"{path}.tmp", path)
+
+    def _share(self, exchange: ccxt.Exchange) -> bool:
+        snapshot = self.snapshots.get(exchange.id)
+        if snapshot is None:
+            return False
+        share_markets(exchange, snapshot)
+        return True
+
+    def _stale(self, venue: str) -> bool:
+        if venue in self._reloading or time.time() - self.updated[venue] < self.max_age:
+            return False
+        self._reloading.add(venue)
+        return True
+
+    def load(self, exchange: ccxt.Exchange, load_markets, reload: bool = False, params={}) -> Dict[str, Any]:
+        venue = exchange.id
+        with self._venue_locks[venue]:
+            if not reload and (self._share(exchange) or self.read_cache(exchange)):
+                if self._stale(venue):
+                    threading.Thread(target=self._reload, args=(exchange, load_markets), name=f"markets-{venue}", daemon=True).start()
+                return exchange.markets
+            load_markets(reload=True, params=params)
+            snapshot = market_snapshot(exchange)
+            self.publish(venue, snapshot)
+        self.write_cache(venue, snapshot)
+        return exchange.markets
+
+    def _reload(self, exchange: ccxt.Exchange, load_markets):
+        try:
+            self.load(exchange, load_markets, reload=True)
+        except Exception as e:
+            print(f"Market reload for {exchange.id} failed: {e!r}")
+        finally:
+            self._reloading.discard(exchange.id)
+
+    async def load_async(self, exchange: ccxt.Exchange, load_markets, reload: bool = False, params={}) -> Dict[str, Any]:
+        venue = exchange.id
+        lock = self._async_locks.setdefault(venue, asyncio.Lock())
+        async with lock:
+            if not reload and (self._share(exchange) or await asyncio.to_thread(self.read_cache, exchange)):
+                if self._stale(venue):
+                    task = asyncio.ensure_future(self._reload_async(exchange, load_markets))
+                    self._tasks.add(task)
+                    task.add_done_callback(self._tasks.discard)
+                return exchange.markets
+            await load_markets(reload=True, params=params)
+            snapshot = market_snapshot(exchange)
+            self.publish(venue, snapshot)
+        await asyncio.to_thread(self.write_cache, venue, snapshot)
+        return exchange.markets
+
+    async def _reload_async(self, exchange: ccxt.Exchange, load_markets):
+        try:
+            await self.load_async(exchange, load_markets, reload=True)
+        except Exception as e:
+            print(f"Market reload for {exchange.id} failed: {e!r}")
+        finally:
+            self._reloading.discard(exchange.id)
+
+
+_registry: Optional[MarketRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_registry() -> MarketRegistry:
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = MarketRegistry(CACHE_DIR)
+        return _registry
+
+
+def missing_contracts(venue: str, symbols: List[str], contract_sizes: Dict[str, float]):
+    missing = sorted(set(symbols) - contract_sizes.keys())
+    if missing:
+        print(f"Skipping positions in contracts unknown to {venue}: {', '.join(missing)}")
+
+
+def get_contract_sizes(exchange: ccxt.Exchange, symbols: List[str]) -> Dict[str, float]:
+    """
+    Contract sizes of the CM contracts, reloading the markets for a contract
+    listed since they were loaded. A contract still unknown after the reload,
+    such as a delisted one, is left out, and its positions are skipped.
+    """
+    registry = get_registry()
+    contract_sizes = registry.lookups(exchange.id, exchange.load_markets()).contract_sizes
+    if registry.reload_for(exchange.id, symbols, contract_sizes):
+        contract_sizes = registry.lookups(exchange.id, exchange.load_markets(reload=True)).contract_sizes
+        missing_contracts(exchange.id, symbols, contract_sizes)
+    return contract_sizes
+
+
+async def get_contract_sizes_async(exchange: ccxt.Exchange, symbols: List[str]) -> Dict[str, float]:
+    registry = get_registry()
+    contract_sizes = registry.lookups(exchange.id, await exchange.load_markets()).contract_sizes
+    if registry.reload_for(exchange.id, symbols, contract_sizes):
+        contract_sizes = registry.lookups(exchange.id, await exchange.load_markets(reload=True)).contract_sizes
+        missing_contracts(exchange.id, symbols, contract_sizes)
+    return contract_sizes
@@ -0,0 +1,268 @@
+import asyncio
+import contextvars
+import math
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import ccxt
+
+METRICS_PORT = 9108
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+OPENMETRICS_CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+# Account whose cycle is running in this thread or task, for metrics that
+# are recorded far from where the account is known
+current_account = contextvars.ContextVar('current_account', default='none')
+
+
+def escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def format_labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    pairs = [f'{name}="{escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    type = ''
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values: Dict[Tuple[str, ...], Any] = {}
+        self._lock = threading.Lock()
+
+    def key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        raise NotImplementedError
+
+    def render(self, openmetrics: bool = False) -> List[str]:
+        name = self.name if openmetrics or self.type != 'counter' else f"{self.name}_total"
+        lines = [f"# HELP {name} {self.help}", f"# TYPE {name} {self.type}"]
+        lines += [f"{sample}{labels} {format_value(value)}" for sample, labels, value in self.samples()]
+        return lines
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = self.key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self.key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            return [(f"{self.name}_total", format_labels(self.labels, key), value) for key, value in sorted(self._values.items())]
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self.key(labels)] = value
+
+    def value(self, **labels) -> Optional[float]:
+        return self._values.get(self.key(labels))
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, format_labels(self.labels, key), value) for key, value in sorted(self._values.items())]
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(float(bound) for bound in buckets) + (math.inf,)
+
+    def observe(self, value: float, **labels):
+        key = self.key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value)
+
+    def count(self, **labels) -> int:
+        counts, _ = self._values.get(self.key(labels), ([0], 0.0))
+        return counts[-1]
+
+    def sum(self, **labels) -> float:
+        _, total = self._values.get(self.key(labels), ([0], 0.0))
+        return total
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, (counts, total) in sorted(self._values.items()):
+                for bound, count in zip(self.buckets, counts):
+                    samples.append((f"{self.name}_bucket", format_labels(self.labels, key, f'le="{format_value(bound)}"'), count))
+                samples.append((f"{self.name}_sum", format_labels(self.labels, key), total))
+                samples.append((f"{self.name}_count", format_labels(self.labels, key), counts[-1]))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: List[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self, openmetrics: bool = False) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines += metric.render(openmetrics)
+        if openmetrics:
+            lines.append('# EOF')
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+EXCHANGE_REQUEST_SECONDS = REGISTRY.register(Histogram(
+    'exchange_request_seconds', 'Latency of exchange REST calls', ('account', 'venue', 'endpoint')))
+EXCHANGE_REQUEST_ERRORS = REGISTRY.register(Counter(
+    'exchange_request_errors', 'Exchange REST calls that raised', ('account', 'venue', 'endpoint', 'error')))
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    'cycle_stage_seconds', 'Time spent parsing, valuing and enqueueing the batch within a cycle', ('account', 'stage')))
+CYCLE_SECONDS = REGISTRY.register(Histogram(
+    'cycle_seconds', 'Duration of whole update cycles', ('account',), buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 45, 60, 120)))
+CYCLE_LAG_SECONDS = REGISTRY.register(Histogram(
+    'cycle_lag_seconds', 'Delay between the scheduled and actual start of a cycle', ('account',)))
+CYCLE_EVENTS = REGISTRY.register(Counter(
+    'cycle_events', 'Cycles by outcome: ok, failed, late, skipped, missed, overrun', ('account', 'event')))
+LAST_SUCCESS = REGISTRY.register(Gauge(
+    'last_success_timestamp_seconds', 'Unix time of the last successful cycle', ('account',)))
+DB_WRITE_SECONDS = REGISTRY.register(Histogram(
+    'db_write_seconds', 'Time to apply one batch in the database', ()))
+DB_ROWS = REGISTRY.register(Counter(
+    'db_rows', 'Rows written per table and operation: inserted, replaced, deleted, upserted (rollups)', ('table', 'op')))
+API_REQUESTS = REGISTRY.register(Counter(
+    'api_requests', 'Read API requests by result: miss (ran SQL), hit or not_modified (served from cache)', ('endpoint', 'result')))
+RATE_LIMIT_WAIT_SECONDS = REGISTRY.register(Counter(
+    'rate_limit_wait_seconds', 'Time requests waited for request-weight budget', ('bucket',)))
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    with STAGE_SECONDS.time(account=current_account.get(), stage=name):
+        yield
+
+
+def timed(name: str) -> Callable:
+    """Record every call of the decorated function as a cycle stage."""
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with stage(name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def endpoint_name(api: Any, method: str, path: str) -> str:
+    api = api if isinstance(api, str) else '/'.join(api)
+    return f"{method} {api}/{path}"
+
+
+def instrument(exchange: ccxt.Exchange, account: str, venue: str) -> ccxt.Exchange:
+    """Time every REST call of a sync or async ccxt exchange."""
+    fetch2 = exchange.fetch2
+
+    def record(endpoint: str, start: float, error: Optional[Exception] = None):
+        EXCHANGE_REQUEST_SECONDS.observe(time.perf_counter() - start, account=account, venue=venue, endpoint=endpoint)
+        if error is not None:
+            EXCHANGE_REQUEST_ERRORS.inc(account=account, venue=venue, endpoint=endpoint, error=type(error).__name__)
+
+    if asyncio.iscoroutinefunction(fetch2):
+        async def timed_fetch2(path, api='public', method='GET', params={}, headers=None, body=None, config={}):
+            endpoint = endpoint_name(api, method, path)
+            start = time.perf_counter()
+            try:
+                result = await fetch2(path, api, method, params, headers, body, config)
+            except Exception as e:
+                record(endpoint, start, e)
+                raise
+            record(endpoint, start)
+            return result
+    else:
+        def timed_fetch2(path, api='public', method='GET', params={}, headers=None, body=None, config={}):
+            endpoint = endpoint_name(api, method, path)
+            start = time.perf_counter()
+            try:
+                result = fetch2(path, api, method, params, headers, body, config)
+            except Exception as e:
+                record(endpoint, start, e)
+                raise
+            record(endpoint, start)
+            return result
+
+    exchange.fetch2 = timed_fetch2
+    return exchange
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        openmetrics = 'application/openmetrics-text' in self.headers.get('Accept', '')
+        body = self.registry.render(openmetrics).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', OPENMETRICS_CONTENT_TYPE if openmetrics else PROMETHEUS_CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port: int = METRICS_PORT, host: str = '127.0.0.1') -> ThreadingHTTPServer:
+    """Expose /metrics on a background thread."""
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    return server
@@ -0,0 +1,167 @@
+import sqlite3
+import time
+from typing import Dict, List, Optional, Tuple
+
+from utils.accounts import BINANCE, BINANCE_CLASSIC, BYBIT
+from utils.bybit import rename_tables
+from utils.rollup import backfill_rollups, init_rollup
+from utils.schema import BALANCES, POSITIONS, init_schema
+
+LEGACY_PREFIX = 'legacy_'
+
+# Tables each legacy layout created with init_db(user)
+LEGACY_TABLES = {
+    BYBIT: ('total_equity', 'coin_balance', 'positions', 'total_notional'),
+    BINANCE: ('total_equity', 'coin_balance', 'cm_positions', 'um_positions'),
+    BINANCE_CLASSIC: ('total_equity', 'coin_balance', 'cm_coin_balance', 'um_coin_balance', 'cm_positions', 'um_positions'),
+}
+
+
+def table_exists(conn: sqlite3.Connection, name: str) -> bool:
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (name,)).fetchone() is not None
+
+
+def table_columns(conn: sqlite3.Connection, name: str) -> List[str]:
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({name})")]
+
+
+def detect_layout(conn: sqlite3.Connection, user: str) -> Optional[str]:
+    if table_exists(conn, f"{user}_total_notional"):
+        return BYBIT
+    if 'spot_equity' in table_columns(conn, f"{user}_total_equity"):
+        return BINANCE_CLASSIC
+    if 'borrowed' in table_columns(conn, f"{user}_coin_balance"):
+        return BINANCE
+    return None
+
+
+def find_legacy_users(conn: sqlite3.Connection) -> Dict[str, str]:
+    """Map every user with per-user tables to its legacy layout."""
+    users = {}
+    suffix = '_total_equity'
+    for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name LIKE ?", (f"%{suffix}",)):
+        if name.startswith(LEGACY_PREFIX):
+            continue
+        user = name[:-len(suffix)]
+        layout = detect_layout(conn, user)
+        if layout is None:
+            print(f"Skipping {user}: unknown table layout")
+            continue
+        users[user] = layout
+    return users
+
+
+def insert_balances(conn: sqlite3.Connection, rows: List[Tuple]):
+    # Rows already written by a running updater are newer; keep them
+    conn.executemany(BALANCES.upsert_sql.replace('OR REPLACE', 'OR IGNORE'), rows)
+
+
+def insert_positions(conn: sqlite3.Connection, rows: List[Tuple]):
+    conn.executemany(POSITIONS.upsert_sql.replace('OR REPLACE', 'OR IGNORE'), rows)
+
+
+def import_equity(conn: sqlite3.Connection, user: str, venue: str, wallet_type: str, table: str, source: str, column: str = 'equity'):
+    conn.execute(
+        f"""INSERT INTO equity (account, venue, wallet_type, ts, {column})
+            SELECT ?, ?, ?, timestamp, {source} FROM {user}_{table} WHERE true
+            ON CONFLICT (account, venue, wallet_type, ts) DO UPDATE SET {column} = coalesce({column}, excluded.{column})""",
+        (user, venue, wallet_type),
+    )
+
+
+def import_bybit(conn: sqlite3.Connection, user: str, ts: int):
+    import_equity(conn, user, 'bybit', 'unified', 'total_equity', 'equity')
+    import_equity(conn, user, 'bybit', 'unified', 'total_notional', 'notional', column='notional')
+    insert_balances(conn, [
+        (user, 'bybit', 'unified', coin, ts, balance, None, None, None)
+        for coin, balance in conn.execute(f"SELECT coin, balance FROM {user}_coin_balance")
+    ])
+    insert_positions(conn, [
+        (user, 'bybit', 'unified', symbol, ts, contracts, unrealized_pnl, notional)
+        for symbol, contracts, unrealized_pnl, notional in conn.execute(f"SELECT * FROM {user}_positions")
+    ])
+
+
+def import_binance(conn: sqlite3.Connection, user: str, ts: int):
+    import_equity(conn, user, 'binance', 'portfolio', 'total_equity', 'equity')
+    balances = conn.execute(f"SELECT asset, total_balance, borrowed, um_balance, cm_balance FROM {user}_coin_balance").fetchall()
+    rows = [(user, 'binance', 'portfolio', asset, ts, total, None, None, borrowed) for asset, total, borrowed, _, _ in balances]
+    rows += [(user, 'binance', 'um', asset, ts, um, um, None, None) for asset, _, _, um, _ in balances if um]
+    rows += [(user, 'binance', 'cm', asset, ts, cm, cm, None, None) for asset, _, _, _, cm in balances if cm]
+    insert_balances(conn, rows)
+    for wallet_type in ('um', 'cm'):
+        insert_positions(conn, [
+            (user, 'binance', wallet_type, symbol, ts, contracts, unrealized_pnl, notional)
+            for symbol, contracts, unrealized_pnl, notional in conn.execute(f"SELECT * FROM {user}_{wallet_type}_positions")
+        ])
+
+
+def import_binance_classic(conn: sqlite3.Connection, user: str, ts: int):
+    for wallet_type in ('spot', 'um', 'cm'):
+        import_equity(conn, user, 'binance', wallet_type, 'total_equity', f"{wallet_type}_equity")
+    rows = [
+        (user, 'binance', 'spot', asset, ts, total, None, None, None)
+        for asset, total in conn.execute(f"SELECT asset, total_balance FROM {user}_coin_balance")
+    ]
+    for wallet_type in ('um', 'cm'):
+        rows += [
+            (user, 'binance', wallet_type, asset, ts, total, wallet_balance, unrealized_profit, None)
+            for asset, wallet_balance, unrealized_profit, total in conn.execute(f"SELECT * FROM {user}_{wallet_type}_coin_balance")
+        ]
+        insert_positions(conn, [
+            (user, 'binance', wallet_type, symbol, ts, contracts, unrealized_pnl, None)
+            for symbol, contracts, unrealized_pnl in conn.execute(f"SELECT * FROM {user}_{wallet_type}_positions")
+        ])
+    insert_balances(conn, rows)
+
+
+IMPORTERS = {
+    BYBIT: import_bybit,
+    BINANCE: import_binance,
+    BINANCE_CLASSIC: import_binance_classic,
+}
+
+
+def imported_range(conn: sqlite3.Connection, user: str, layout: str) -> Tuple[Optional[int], Optional[int]]:
+    """First and last timestamp of a user's legacy equity and notional samples."""
+    bounds = [
+        conn.execute(f"SELECT min(timestamp), max(timestamp) FROM {user}_{table}").fetchone()
+        for table in ('total_equity', 'total_notional')
+        if table in LEGACY_TABLES[layout] and table_exists(conn, f"{user}_{table}")
+    ]
+    starts = [start for start, _ in bounds if start is not None]
+    ends = [end for _, end in bounds if end is not None]
+    return (min(starts), max(ends)) if starts else (None, None)
+
+
+def migrate_user(conn: sqlite3.Connection, user: str, layout: str, keep: bool = False) -> Tuple[Optional[int], Optional[int]]:
+    """
+    Import one user's per-user tables into the normalized schema and return
+    the time range of the imported samples.
+
+    The import runs in one transaction. Afterwards the old tables are renamed
+    to legacy_<name> with rename_tables, so running the migration again does
+    not import them twice; pass keep=True to leave them in place.
+    """
+    imported = imported_range(conn, user, layout)
+    with conn:
+        IMPORTERS[layout](conn, user, int(time.time()))
+    if not keep:
+        tables = [f"{user}_{table}" for table in LEGACY_TABLES[layout] if table_exists(conn, f"{user}_{table}")]
+        rename_tables(conn, [(table, f"{LEGACY_PREFIX}{table}") for table in tables])
+    return imported
+
+
+def migrate(conn: sqlite3.Connection, keep: bool = False) -> Dict[str, str]:
+    init_schema(conn)
+    init_rollup(conn)
+    users = find_legacy_users(conn)
+    for user, layout in users.items():
+        start, end = migrate_user(conn, user, layout, keep)
+        print(f"Migrated {user} ({layout})")
+        if start is not None:
+            # Imported history predates the rollups. Only its range is folded
+            # in: raw samples older than that may be pruned already, and their
+            # buckets must be kept.
+            backfill_rollups(conn, start, end, user)
+    return users
@@ -0,0 +1,79 @@
+import contextvars
+from typing import Any, Dict, List
+from urllib.parse import urlsplit
+
+import ccxt
+import orjson
+
+# Account responses decoded with orjson. It returns JSON numbers as floats
+# rather than ccxt's strings, which the parsers of these responses accept as
+# they call float() on every amount. Everything else, markets and tickers
+# parsed by ccxt included, keeps ccxt's decoder.
+FAST_JSON_PATHS = (
+    '/api/v3/account',
+    '/fapi/v3/account',
+    '/dapi/v1/account',
+    '/papi/v1/balance',
+    '/papi/v1/um/positionRisk',
+    '/papi/v1/cm/positionRisk',
+)
+
+# Path of the response being decoded in this thread or task
+response_path = contextvars.ContextVar('response_path', default='')
+
+
+def is_zero(value: Any) -> bool:
+    """True for 0, '' and decimal strings of zeros such as '0.00000000', without calling float()."""
+    if isinstance(value, str):
+        return value.strip('-0.') == ''
+    return not value
+
+
+def nonzero(rows: List[Dict[str, Any]], *fields: str) -> List[Dict[str, Any]]:
+    """Rows in which any of the given fields is not zero."""
+    if len(fields) == 1:
+        field, = fields
+        return [row for row in rows if not is_zero(row[field])]
+    return [row for row in rows if not all(is_zero(row[field]) for field in fields)]
+
+
+# Binance pads account payloads with a row for every listed asset and
+# symbol, most of them zero. These drop those rows as soon as a response
+# arrives, so ticker lookups and parsing only see what the account holds.
+
+def compact_spot_account(res: Dict[str, Any]) -> Dict[str, Any]:
+    return dict(res, balances=nonzero(res['balances'], 'free', 'locked'))
+
+
+def compact_futures_account(res: Dict[str, Any]) -> Dict[str, Any]:
+    """UM (fapi v3) and CM (dapi) account: assets with a wallet balance and open positions."""
+    return dict(res, assets=nonzero(res['assets'], 'walletBalance'), positions=nonzero(res['positions'], 'positionAmt'))
+
+
+def compact_portfolio_balance(res: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    return nonzero(res, 'totalWalletBalance')
+
+
+def compact_positions(res: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Portfolio-margin position risk: open positions only."""
+    return nonzero(res, 'positionAmt')
+
+
+def fast_json(exchange: ccxt.Exchange) -> ccxt.Exchange:
+    """Decode the exchange's responses to FAST_JSON_PATHS with orjson."""
+    on_rest_response = exchange.on_rest_response
+    on_json_response = exchange.on_json_response
+
+    def remember_path(code, reason, url, method, headers, body, request_headers, request_body):
+        # ccxt decodes the body right after this, with no await in between
+        response_path.set(urlsplit(url).path)
+        return on_rest_response(code, reason, url, method, headers, body, request_headers, request_body)
+
+    def decode(body):
+        if response_path.get().endswith(FAST_JSON_PATHS):
+            return orjson.loads(body)
+        return on_json_response(body)
+
+    exchange.on_rest_response = remember_path
+    exchange.on_json_response = decode
+    return exchange
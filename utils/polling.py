@@ -0,0 +1,111 @@
+import threading
+from collections import deque
+from typing import Deque, Dict
+
+from utils.schema import POSITIONS
+from utils.storage import Batch
+
+MIN_INTERVAL = 5
+MAX_INTERVAL = 300
+# Equity samples used to judge whether PnL is moving
+HISTORY = 5
+# Weights of the share of the request budget an account gets
+IDLE_WEIGHT = 0.1
+OPEN_WEIGHT = 1.0
+# Every MOVE_STEP of relative equity change between samples adds one weight, up to MAX_WEIGHT
+MOVE_STEP = 0.0005
+MAX_WEIGHT = 10.0
+
+
+def allocate(weights: Dict[str, float], budget: float, min_interval: float, max_interval: float) -> Dict[str, float]:
+    """
+    Split `budget` cycles per second across accounts in proportion to their
+    weights, keeping every interval within [min_interval, max_interval].
+
+    Accounts that would fall outside the bounds are pinned to them and the
+    rest of the budget is shared among the others, so the total rate stays at
+    the budget whenever the bounds allow it.
+    """
+    rates: Dict[str, float] = {}
+    free = dict(weights)
+    left = budget
+    while free:
+        total = sum(free.values())
+        share = {key: left * weight / total if total else left / len(free) for key, weight in free.items()}
+        fast = [key for key, rate in share.items() if rate > 1 / min_interval]
+        slow = [key for key, rate in share.items() if rate < 1 / max_interval]
+        pinned = {key: 1 / min_interval for key in fast} if fast else {key: 1 / max_interval for key in slow}
+        if not pinned:
+            rates.update(share)
+            break
+        for key, rate in pinned.items():
+            rates[key] = rate
+            left -= rate
+            del free[key]
+        left = max(left, 0.0)
+    return {key: 1 / rate if rate else max_interval for key, rate in rates.items()}
+
+
+class AdaptivePolicy:
+    """
+    Polling intervals that follow what each account is doing.
+
+    The policy learns from every batch the store writes: how many positions
+    the account holds and how its total equity moved over the last few
+    cycles. Accounts with open positions and moving PnL get a larger share of
+    a fixed budget (as many cycles as polling every `base` seconds would
+    make), flat accounts back off towards max_interval.
+    """
+
+    def __init__(self, base: float, min_interval: float = MIN_INTERVAL, max_interval: float = MAX_INTERVAL):
+        self.base = base
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.accounts = set()
+        self.positions: Dict[str, int] = {}
+        self.equity: Dict[str, Deque[float]] = {}
+        self._intervals: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def add(self, account: str):
+        with self._lock:
+            self.accounts.add(account)
+            self._intervals = {}
+
+    def observe(self, batch: Batch):
+        """Store subscriber: record the positions and equity of a written batch."""
+        with self._lock:
+            if batch.account not in self.accounts:
+                return
+            position_rows = [rows for (table, _), rows in batch.syncs.items() if table is POSITIONS]
+            if position_rows:
+                self.positions[batch.account] = sum(len(rows) for rows in position_rows)
+            equities = [values['equity'] for values in batch.equity.values() if values.get('equity') is not None]
+            if equities:
+                self.equity.setdefault(batch.account, deque(maxlen=HISTORY)).append(sum(equities))
+            self._intervals = {}
+
+    def weight(self, account: str) -> float:
+        samples = list(self.equity.get(account, ()))
+        move = max(
+            (abs(b - a) / abs(a) for a, b in zip(samples, samples[1:]) if a),
+            default=0.0,
+        )
+        open_positions = self.positions.get(account)
+        if open_positions is None and not samples:
+            return OPEN_WEIGHT
+        if not open_positions and move < MOVE_STEP:
+            return IDLE_WEIGHT
+        return min(OPEN_WEIGHT + move / MOVE_STEP, MAX_WEIGHT)
+
+    def interval(self, account: str) -> float:
+        with self._lock:
+            if not self._intervals:
+                weights = {key: self.weight(key) for key in self.accounts}
+                budget = len(self.accounts) / self.base
+                self._intervals = allocate(weights, budget, self.min_interval, self.max_interval)
+            return self._intervals.get(account, self.base)
+
+    def intervals(self) -> Dict[str, float]:
+        return {account: round(self.interval(account), 1) for account in sorted(self.accounts)}
+
@@ -0,0 +1,123 @@
+import asyncio
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+import ccxt
+
+
+DEFAULT_TTL = 30
+
+
+class PriceCache:
+    """
+    Process-wide cache of last prices for every <asset>/USDT spot pair.
+
+    All prices are fetched with one bulk fetch_tickers call and served from
+    memory until they are older than `ttl` seconds. `hits` counts lookups
+    answered from memory, i.e. fetch_tickers calls saved.
+    """
+
+    def __init__(self, exchange: ccxt.Exchange, ttl: float = DEFAULT_TTL, quote: str = 'USDT'):
+        self.exchange = exchange
+        self.ttl = ttl
+        self.quote = quote
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self._tickers: Dict[str, Dict[str, Any]] = {}
+        self._updated = 0.0
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._subscribers: List[Callable[[Dict[str, Dict[str, Any]]], None]] = []
+
+    @property
+    def fresh(self) -> bool:
+        return time.monotonic() - self._updated < self.ttl
+
+    def refresh(self):
+        suffix = f"/{self.quote}"
+        res = self.exchange.fetch_tickers()
+        tickers = {
+            symbol: {'last': ticker['last']}
+            for symbol, ticker in res.items()
+            if symbol.endswith(suffix) and ticker.get('last') is not None
+        }
+        with self._lock:
+            self._tickers = tickers
+            self._updated = time.monotonic()
+            self.refreshes += 1
+        for callback in self._subscribers:
+            try:
+                callback(tickers)
+            except Exception as e:
+                print(f"Price subscriber failed: {e!r}")
+
+    def subscribe(self, callback: Callable[[Dict[str, Dict[str, Any]]], None]):
+        """Call `callback` with every refreshed set of tickers."""
+        self._subscribers.append(callback)
+
+    def tickers(self, symbols: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        """Return {symbol: {'last': price}} for the requested symbols that have a price."""
+        with self._lock:
+            fresh = self.fresh
+            if fresh:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if not fresh:
+            # Concurrent misses wait for a single refresh instead of each making one.
+            with self._refresh_lock:
+                if not self.fresh:
+                    self.refresh()
+        tickers = self._tickers
+        return {symbol: tickers[symbol] for symbol in symbols if symbol in tickers}
+
+    def start(self, interval: Optional[float] = None):
+        """Refresh in a background thread, by default slightly faster than the TTL."""
+        if self._thread is not None:
+            return
+        interval = interval or self.ttl * 0.8
+        self._thread = threading.Thread(target=self._run, args=(interval,), name='price-cache', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self, interval: float):
+        while not self._stop.is_set():
+            try:
+                with self._refresh_lock:
+                    self.refresh()
+            except Exception as e:
+                print(f"Price refresh failed: {e!r}")
+            self._stop.wait(interval)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'refreshes': self.refreshes,
+            'symbols': len(self._tickers),
+            'age': round(time.monotonic() - self._updated, 1) if self._updated else None,
+        }
+
+
+def fetch_usdt_tickers(exchange: ccxt.Exchange, symbols: List[str], price_cache: Optional[PriceCache] = None) -> Dict[str, Any]:
+    if not symbols:
+        return {}
+    if price_cache is not None:
+        return price_cache.tickers(symbols)
+    return exchange.fetch_tickers(symbols)
+
+
+async def fetch_usdt_tickers_async(exchange, symbols: List[str], price_cache: Optional[PriceCache] = None) -> Dict[str, Any]:
+    if not symbols:
+        return {}
+    if price_cache is not None:
+        if price_cache.fresh:
+            return price_cache.tickers(symbols)
+        return await asyncio.to_thread(price_cache.tickers, symbols)
+    return await exchange.fetch_tickers(symbols)
@@ -0,0 +1,242 @@
+import asyncio
+import contextvars
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Tuple
+
+import ccxt
+
+from utils.metrics import RATE_LIMIT_WAIT_SECONDS
+
+# Binance counts request weight per IP in fixed one-minute windows, separately
+# for each API family; Bybit allows 600 requests per IP in every 5 seconds.
+WEIGHT_HEADER = 'x-mbx-used-weight-1m'
+HEADROOM = 0.9
+
+# Holds the headers of the response to the governed request running in this
+# thread or task; the exchange's last_response_headers belongs to whichever
+# concurrent request finished last
+response_headers = contextvars.ContextVar('response_headers')
+
+
+@dataclass(frozen=True)
+class Limit:
+    weight: int
+    window: float
+
+
+LIMITS = {
+    'binance:spot': Limit(6000, 60),
+    'binance:papi': Limit(6000, 60),
+    'binance:fapi': Limit(2400, 60),
+    'binance:dapi': Limit(2400, 60),
+    'bybit': Limit(600, 5),
+}
+
+# Weight of the Binance endpoints the updaters call, keyed by (api, path).
+# Anything missing falls back to ccxt's own cost for the endpoint.
+WEIGHTS = {
+    ('papi', 'balance'): 20,
+    ('papi', 'um/positionRisk'): 5,
+    ('papi', 'cm/positionRisk'): 1,
+    ('papi', 'listenKey'): 1,
+    ('private', 'account'): 20,
+    ('fapiPrivateV3', 'account'): 5,
+    ('fapiPrivate', 'listenKey'): 1,
+    ('dapiPrivate', 'account'): 5,
+    ('dapiPrivate', 'listenKey'): 1,
+    ('public', 'userDataStream'): 2,
+    ('public', 'exchangeInfo'): 20,
+    ('fapiPublic', 'exchangeInfo'): 1,
+    ('dapiPublic', 'exchangeInfo'): 1,
+}
+# ticker/24hr costs 2 for one symbol and 80 for all of them
+TICKER_24HR_WEIGHT = (2, 80)
+
+
+def binance_family(api: Any) -> str:
+    api = api if isinstance(api, str) else api[0]
+    for family in ('papi', 'fapi', 'dapi'):
+        if api.startswith(family):
+            return family
+    return 'spot'
+
+
+def binance_weight(exchange: ccxt.Exchange, api: Any, method: str, path: str, params: Dict[str, Any], config: Dict[str, Any]) -> int:
+    if path == 'ticker/24hr' and binance_family(api) == 'spot':
+        return TICKER_24HR_WEIGHT[0] if 'symbol' in params else TICKER_24HR_WEIGHT[1]
+    weight = WEIGHTS.get((api, path))
+    if weight is None:
+        weight = exchange.calculate_rate_limiter_cost(api, method, path, params, config)
+    return max(int(weight), 1)
+
+
+def header(headers: Optional[Dict[str, Any]], name: str) -> Optional[str]:
+    for key, value in (headers or {}).items():
+        if key.lower() == name:
+            return value
+    return None
+
+
+class Bucket:
+    """Weight used in the current window of one limit, as counted here and as reported by the exchange."""
+
+    def __init__(self, limit: Limit):
+        self.limit = limit
+        self.window_start = 0.0
+        self.used = 0
+        self.blocked_until = 0.0
+
+    def roll(self, now: float):
+        start = now - now % self.limit.window
+        if start != self.window_start:
+            self.window_start = start
+            self.used = 0
+
+    def reserve(self, weight: int, now: float) -> float:
+        """Count `weight` and return 0 if it fits in this window, else return how long to wait."""
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        self.roll(now)
+        budget = self.limit.weight * HEADROOM
+        if self.used + weight > budget and self.used > 0:
+            return self.window_start + self.limit.window - now
+        self.used += weight
+        return 0.0
+
+
+class RateGovernor:
+    """Process-wide request budget per venue, API family and egress IP."""
+
+    def __init__(self):
+        self.buckets: Dict[Tuple[str, str], Bucket] = {}
+        self.waits = 0
+        self.waited = 0.0
+        self._lock = threading.Lock()
+
+    def bucket(self, key: str, ip: str) -> Bucket:
+        if (key, ip) not in self.buckets:
+            self.buckets[(key, ip)] = Bucket(LIMITS[key])
+        return self.buckets[(key, ip)]
+
+    def reserve(self, key: str, ip: str, weight: int) -> Tuple[float, float]:
+        """Return (delay, window start); the weight is counted only when delay is 0."""
+        with self._lock:
+            bucket = self.bucket(key, ip)
+            delay = bucket.reserve(weight, time.time())
+            if delay:
+                self.waits += 1
+                self.waited += delay
+                RATE_LIMIT_WAIT_SECONDS.inc(delay, bucket=f"{key}@{ip}")
+            return delay, bucket.window_start
+
+    def acquire(self, key: str, ip: str, weight: int) -> float:
+        while True:
+            delay, window_start = self.reserve(key, ip, weight)
+            if not delay:
+                return window_start
+            time.sleep(delay)
+
+    async def acquire_async(self, key: str, ip: str, weight: int) -> float:
+        while True:
+            delay, window_start = self.reserve(key, ip, weight)
+            if not delay:
+                return window_start
+            await asyncio.sleep(delay)
+
+    def observe(self, key: str, ip: str, window_start: float, headers: Optional[Dict[str, Any]], error: Optional[Exception] = None):
+        with self._lock:
+            bucket = self.bucket(key, ip)
+            used = header(headers, WEIGHT_HEADER)
+            if used is not None and bucket.window_start == window_start:
+                bucket.used = max(bucket.used, int(used))
+            if isinstance(error, (ccxt.DDoSProtection, ccxt.RateLimitExceeded)):
+                retry_after = header(headers, 'retry-after')
+                delay = float(retry_after) if retry_after else bucket.limit.window
+                bucket.blocked_until = max(bucket.blocked_until, time.time() + delay)
+                print(f"Rate limited on {key} ({ip}), pausing {delay:.0f}s")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'used': {f"{key}@{ip}": bucket.used for (key, ip), bucket in self.buckets.items()},
+                'waits': self.waits,
+                'waited': round(self.waited, 1),
+            }
+
+
+def limit_key(exchange: ccxt.Exchange, api: Any) -> str:
+    if exchange.id == 'bybit':
+        return 'bybit'
+    return f"binance:{binance_family(api)}"
+
+
+def request_weight(exchange: ccxt.Exchange, api: Any, method: str, path: str, params: Dict[str, Any], config: Dict[str, Any]) -> int:
+    if exchange.id == 'bybit':
+        return 1
+    return binance_weight(exchange, api, method, path, params, config)
+
+
+def install(exchange: ccxt.Exchange, governor: RateGovernor, ip: str = 'default'):
+    """Route every REST request of a sync or async ccxt exchange through the governor."""
+    fetch2 = exchange.fetch2
+    on_rest_response = exchange.on_rest_response
+
+    def prepare(path, api, method, params, config):
+        key = limit_key(exchange, api)
+        weight = request_weight(exchange, api, method, path, params, config)
+        return key, weight
+
+    def capture_headers(code, reason, url, method, headers, body, request_headers, request_body):
+        holder = response_headers.get(None)
+        if holder is not None:
+            holder['headers'] = headers
+        return on_rest_response(code, reason, url, method, headers, body, request_headers, request_body)
+
+    if asyncio.iscoroutinefunction(fetch2):
+        async def governed_fetch2(path, api='public', method='GET', params={}, headers=None, body=None, config={}):
+            key, weight = prepare(path, api, method, params, config)
+            window_start = await governor.acquire_async(key, ip, weight)
+            holder = {}
+            token = response_headers.set(holder)
+            try:
+                result = await fetch2(path, api, method, params, headers, body, config)
+            except Exception as e:
+                governor.observe(key, ip, window_start, holder.get('headers'), e)
+                raise
+            finally:
+                response_headers.reset(token)
+            governor.observe(key, ip, window_start, holder.get('headers'))
+            return result
+    else:
+        def governed_fetch2(path, api='public', method='GET', params={}, headers=None, body=None, config={}):
+            key, weight = prepare(path, api, method, params, config)
+            window_start = governor.acquire(key, ip, weight)
+            holder = {}
+            token = response_headers.set(holder)
+            try:
+                result = fetch2(path, api, method, params, headers, body, config)
+            except Exception as e:
+                governor.observe(key, ip, window_start, holder.get('headers'), e)
+                raise
+            finally:
+                response_headers.reset(token)
+            governor.observe(key, ip, window_start, holder.get('headers'))
+            return result
+
+    exchange.on_rest_response = capture_headers
+    exchange.fetch2 = governed_fetch2
+    return exchange
+
+
+_governor: Optional[RateGovernor] = None
+_governor_lock = threading.Lock()
+
+
+def get_governor() -> RateGovernor:
+    global _governor
+    with _governor_lock:
+        if _governor is None:
+            _governor = RateGovernor()
+        return _governor
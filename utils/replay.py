@@ -0,0 +1,213 @@
+import ast
+import asyncio
+import inspect
+import json
+from dataclasses import dataclass, field
+from itertools import cycle
+from typing import Any, Callable, Dict, Iterator, List
+
+import ccxt
+
+import utils.binance_classic as binance_classic_utils
+from utils.accounts import BINANCE, BINANCE_CLASSIC, BYBIT
+from utils.bybit import POSITIONS_PAGE_SIZE
+
+# The ccxt methods each updater calls, i.e. everything a replay has to answer
+RECORDED_METHODS = {
+    BYBIT: ('fetch_balance', 'fetch_positions'),
+    BINANCE: ('papi_get_balance', 'papi_get_cm_positionrisk', 'papi_get_um_positionrisk', 'fetch_tickers', 'load_markets'),
+    BINANCE_CLASSIC: ('private_get_account', 'fapiPrivateV3GetAccount', 'dapiprivate_get_account', 'fetch_tickers', 'load_markets'),
+}
+
+
+@dataclass
+class Recording:
+    """Raw responses of the ccxt methods an updater called, in call order per method."""
+    venue: str
+    calls: Dict[str, List[Any]] = field(default_factory=dict)
+
+    def add(self, method: str, response: Any):
+        self.calls.setdefault(method, []).append(response)
+
+    def save(self, path: str):
+        with open(path, 'w') as f:
+            json.dump({'venue': self.venue, 'calls': self.calls}, f)
+
+
+def load_recording(path: str) -> Recording:
+    with open(path) as f:
+        data = json.load(f)
+    return Recording(data['venue'], data['calls'])
+
+
+def recorded(method: str, original: Callable, recording: Recording) -> Callable:
+    if asyncio.iscoroutinefunction(original):
+        async def async_wrapper(*args, **kwargs):
+            response = await original(*args, **kwargs)
+            recording.add(method, response)
+            return response
+        return async_wrapper
+
+    def wrapper(*args, **kwargs):
+        response = original(*args, **kwargs)
+        recording.add(method, response)
+        return response
+    return wrapper
+
+
+def record(exchange: ccxt.Exchange, recording: Recording) -> ccxt.Exchange:
+    """Wrap the venue's methods on a sync or async exchange so every response is added to `recording`."""
+    for method in RECORDED_METHODS[recording.venue]:
+        setattr(exchange, method, recorded(method, getattr(exchange, method), recording))
+    return exchange
+
+
+class ReplayExchange:
+    """
+    Stand-in for a ccxt exchange that answers from a recording.
+
+    Every method returns its recorded responses in order and starts over once
+    they are used up, so one recorded cycle can be replayed any number of
+    times. Arguments are ignored: a replay reproduces the calls it was
+    recorded from, including Bybit's position pages.
+    """
+
+    def __init__(self, recording: Recording, is_async: bool = False):
+        self.id = 'bybit' if recording.venue == BYBIT else 'binance'
+        self.recording = recording
+        self.is_async = is_async
+        self.calls: Dict[str, int] = {}
+        self._responses: Dict[str, Iterator[Any]] = {
+            method: cycle(responses) for method, responses in recording.calls.items()
+        }
+
+    def _respond(self, method: str) -> Any:
+        if method not in self._responses:
+            raise AttributeError(f"No recorded responses for {method}")
+        self.calls[method] = self.calls.get(method, 0) + 1
+        return next(self._responses[method])
+
+    def __getattr__(self, method: str) -> Callable:
+        if method.startswith('_'):
+            raise AttributeError(method)
+        if self.is_async:
+            async def replay(*args, **kwargs):
+                return self._respond(method)
+            return replay
+        return lambda *args, **kwargs: self._respond(method)
+
+    async def close(self):
+        pass
+
+
+def docstring_payload(func: Callable) -> Any:
+    """Evaluate the sample response kept in a function's docstring."""
+    return ast.literal_eval(inspect.getdoc(func))
+
+
+def sample_recording() -> Recording:
+    """One binance_classic cycle built from the spot and UM samples in the module's docstrings."""
+    spot = docstring_payload(binance_classic_utils.query_spot_account_info)
+    um = docstring_payload(binance_classic_utils.query_um_account_info)
+    recording = Recording(BINANCE_CLASSIC)
+    recording.add('private_get_account', spot)
+    recording.add('fapiPrivateV3GetAccount', um)
+    recording.add('dapiprivate_get_account', {'assets': [], 'positions': []})
+    recording.add('fetch_tickers', {})
+    recording.add('load_markets', {})
+    return recording
+
+
+def asset_name(i: int) -> str:
+    return 'USDT' if i == 0 else f"A{i}"
+
+
+def synthetic_markets(size: int) -> Dict[str, Any]:
+    markets = {}
+    for i in range(1, size + 1):
+        spot = f"A{i}/USDT"
+        markets[spot] = {'id': f"A{i}USDT", 'symbol': spot, 'spot': True, 'inverse': False,
+                         'active': True, 'quote': 'USDT', 'contractSize': None, 'info': {}}
+        inverse = f"A{i}/USD:A{i}"
+        markets[inverse] = {'id': f"A{i}USD_PERP", 'symbol': inverse, 'spot': False, 'inverse': True,
+                            'active': True, 'quote': 'USD', 'contractSize': 10.0, 'info': {'contractSize': '10'}}
+    return markets
+
+
+def synthetic_tickers(size: int) -> Dict[str, Any]:
+    return {f"A{i}/USDT": {'symbol': f"A{i}/USDT", 'last': 1.0 + i} for i in range(1, size + 1)}
+
+
+def synthetic_classic(size: int) -> Recording:
+    """`size` non-zero coins in each wallet and `size` UM and CM positions, shaped like the docstring samples."""
+    spot = docstring_payload(binance_classic_utils.query_spot_account_info)
+    um = docstring_payload(binance_classic_utils.query_um_account_info)
+    um_asset = next(asset for asset in um['assets'] if asset['asset'] == 'USDT')
+    um_position = um['positions'][0]
+    assets = [dict(um_asset, asset=asset_name(i), walletBalance=f"{100 + i}", unrealizedProfit='1.5') for i in range(size)]
+    spot['balances'] = [{'asset': asset_name(i), 'free': f"{10 + i}", 'locked': '0.5'} for i in range(size)]
+    um['assets'] = assets
+    um['positions'] = [dict(um_position, symbol=f"A{i}USDT", positionAmt='-2.622', notional='-2553.21') for i in range(1, size + 1)]
+    cm = {
+        'assets': [dict(asset, walletBalance='0.25') for asset in assets],
+        'positions': [dict(um_position, symbol=f"A{i}USD_PERP", positionAmt='3') for i in range(1, size + 1)],
+    }
+
+    recording = Recording(BINANCE_CLASSIC)
+    recording.add('private_get_account', spot)
+    recording.add('fapiPrivateV3GetAccount', um)
+    recording.add('dapiprivate_get_account', cm)
+    # One bulk ticker call per wallet without a price cache
+    for _ in range(3):
+        recording.add('fetch_tickers', synthetic_tickers(size))
+    recording.add('load_markets', synthetic_markets(size))
+    return recording
+
+
+def synthetic_portfolio_margin(size: int) -> Recording:
+    """`size` coins in the portfolio margin account and `size` UM and CM positions."""
+    balance = [{
+        'asset': asset_name(i), 'totalWalletBalance': f"{100 + i}", 'crossMarginAsset': '10', 'crossMarginBorrowed': '1',
+        'crossMarginFree': '9', 'crossMarginInterest': '0.01', 'crossMarginLocked': '1', 'umWalletBalance': '50',
+        'umUnrealizedPNL': '2.5', 'cmWalletBalance': '40', 'cmUnrealizedPNL': '-1.5', 'updateTime': 1617939110373,
+    } for i in range(size)]
+    position = {'entryPrice': '97000', 'markPrice': '97400', 'unRealizedProfit': '58.9', 'liquidationPrice': '0',
+                'leverage': '5', 'positionSide': 'BOTH', 'breakEvenPrice': '97010', 'updateTime': 1733890825855}
+    um = [dict(position, symbol=f"A{i}USDT", positionAmt='-2.622', maxNotionalValue='8000000', notional='-2553.21') for i in range(1, size + 1)]
+    cm = [dict(position, symbol=f"A{i}USD_PERP", positionAmt='3', maxQty='100', notionalValue='0.3') for i in range(1, size + 1)]
+
+    recording = Recording(BINANCE)
+    recording.add('papi_get_balance', balance)
+    recording.add('papi_get_cm_positionrisk', cm)
+    recording.add('papi_get_um_positionrisk', um)
+    recording.add('fetch_tickers', synthetic_tickers(size))
+    recording.add('load_markets', synthetic_markets(size))
+    return recording
+
+
+def synthetic_bybit(size: int) -> Recording:
+    """`size` coins in the unified wallet and `size` positions, split into pages like the v5 API."""
+    balance = {
+        'info': {'retCode': 0, 'result': {'list': [{'accountType': 'UNIFIED', 'totalEquity': f"{1000 * size}"}]}},
+        'free': {asset_name(i): 10.0 + i for i in range(size)},
+    }
+    positions = [{
+        'symbol': f"A{i}/USDT:USDT", 'side': 'long' if i % 2 else 'short', 'contracts': 2.5, 'notional': 2553.21,
+        'unrealizedPnl': 58.9, 'info': {'symbol': f"A{i}USDT"},
+    } for i in range(size)]
+
+    recording = Recording(BYBIT)
+    recording.add('fetch_balance', balance)
+    for start in range(0, max(size, 1), POSITIONS_PAGE_SIZE):
+        page = positions[start:start + POSITIONS_PAGE_SIZE]
+        if page and start + POSITIONS_PAGE_SIZE < size:
+            page[0] = dict(page[0], info=dict(page[0]['info'], nextPageCursor=str(start + POSITIONS_PAGE_SIZE)))
+        recording.add('fetch_positions', page)
+    return recording
+
+
+SYNTHETIC = {
+    BYBIT: synthetic_bybit,
+    BINANCE: synthetic_portfolio_margin,
+    BINANCE_CLASSIC: synthetic_classic,
+}
@@ -0,0 +1,138 @@
+import sqlite3
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+DAY = 86400
+
+# Bucket sizes in seconds and how long each is kept (None = forever)
+RESOLUTIONS = (300, 3600, DAY)
+RETENTION = {
+    300: 90 * DAY,
+    3600: 2 * 365 * DAY,
+    DAY: None,
+}
+RAW_RETENTION = 7 * DAY
+RAW_INTERVAL = 60
+MAX_POINTS = 1000
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS equity_rollup (
+    account TEXT NOT NULL,
+    venue TEXT NOT NULL,
+    wallet_type TEXT NOT NULL,
+    resolution INTEGER NOT NULL,
+    bucket INTEGER NOT NULL,
+    open REAL,
+    high REAL,
+    low REAL,
+    close REAL,
+    notional_open REAL,
+    notional_high REAL,
+    notional_low REAL,
+    notional_close REAL,
+    PRIMARY KEY (account, venue, wallet_type, resolution, bucket)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS equity_rollup_bucket ON equity_rollup (resolution, bucket);
+'''
+
+# max()/min() return NULL if any argument is NULL, so missing values are
+# replaced by the other side before comparing.
+UPSERT_SQL = '''
+INSERT INTO equity_rollup VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (account, venue, wallet_type, resolution, bucket) DO UPDATE SET
+    open = coalesce(open, excluded.open),
+    high = max(coalesce(high, excluded.high), coalesce(excluded.high, high)),
+    low = min(coalesce(low, excluded.low), coalesce(excluded.low, low)),
+    close = coalesce(excluded.close, close),
+    notional_open = coalesce(notional_open, excluded.notional_open),
+    notional_high = max(coalesce(notional_high, excluded.notional_high), coalesce(excluded.notional_high, notional_high)),
+    notional_low = min(coalesce(notional_low, excluded.notional_low), coalesce(excluded.notional_low, notional_low)),
+    notional_close = coalesce(excluded.notional_close, notional_close)
+'''
+
+
+def init_rollup(conn: sqlite3.Connection):
+    conn.executescript(SCHEMA)
+    conn.commit()
+
+
+def update_rollups(conn: sqlite3.Connection, samples: Iterable[Tuple[str, str, str, int, Optional[float], Optional[float]]]):
+    """Fold new (account, venue, wallet_type, ts, equity, notional) samples into every resolution."""
+    rows = []
+    for account, venue, wallet_type, ts, equity, notional in samples:
+        for resolution in RESOLUTIONS:
+            bucket = ts - ts % resolution
+            rows.append((account, venue, wallet_type, resolution, bucket,
+                         equity, equity, equity, equity, notional, notional, notional, notional))
+    conn.executemany(UPSERT_SQL, rows)
+
+
+def backfill_rollups(conn: sqlite3.Connection, since: int = 0, until: Optional[int] = None, account: Optional[str] = None):
+    """Fold the raw samples from `since` to `until` (of one account, if given) into the rollups, e.g. after a migration."""
+    where, args = "ts >= ?", [since]
+    if until is not None:
+        where, args = where + " AND ts <= ?", args + [until]
+    if account is not None:
+        where, args = where + " AND account = ?", args + [account]
+    cursor = conn.execute(
+        f"SELECT account, venue, wallet_type, ts, equity, notional FROM equity WHERE {where} ORDER BY account, venue, wallet_type, ts",
+        args,
+    )
+    with conn:
+        while True:
+            samples = cursor.fetchmany(10000)
+            if not samples:
+                break
+            update_rollups(conn, samples)
+
+
+def prune(conn: sqlite3.Connection, raw_retention: int = RAW_RETENTION, now: Optional[int] = None):
+    """Delete raw samples and rollup buckets older than their retention."""
+    now = now or int(time.time())
+    with conn:
+        conn.execute("DELETE FROM equity WHERE ts < ?", (now - raw_retention,))
+        for resolution, retention in RETENTION.items():
+            if retention is not None:
+                conn.execute("DELETE FROM equity_rollup WHERE resolution = ? AND bucket < ?", (resolution, now - retention))
+
+
+def pick_resolution(start: int, end: int, max_points: int = MAX_POINTS, raw_retention: int = RAW_RETENTION, now: Optional[int] = None) -> int:
+    """
+    Choose the resolution to serve a window from: the finest one that keeps the
+    window under `max_points` and still has data for `start`. 0 means raw samples.
+    """
+    now = now or int(time.time())
+    span = max(end - start, 1)
+    candidates = [(0, RAW_INTERVAL, raw_retention)] + [(r, r, RETENTION[r]) for r in RESOLUTIONS]
+    for resolution, interval, retention in candidates:
+        if span / interval <= max_points and (retention is None or start >= now - retention):
+            return resolution
+    return RESOLUTIONS[-1]
+
+
+def query_equity(conn: sqlite3.Connection, account: str, start: int, end: int, wallet_type: Optional[str] = None,
+                 max_points: int = MAX_POINTS, raw_retention: int = RAW_RETENTION, now: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Return the equity history of an account between start and end.
+
+    Rows are (wallet_type, ts, open, high, low, close, notional) at the
+    resolution chosen by pick_resolution; raw samples have open = high = low = close.
+    """
+    resolution = pick_resolution(start, end, max_points, raw_retention, now)
+    wallet_filter = " AND wallet_type = ?" if wallet_type else ""
+    params: List[Any] = [account]
+    if wallet_type:
+        params.append(wallet_type)
+    if resolution == 0:
+        rows = conn.execute(
+            f"""SELECT wallet_type, ts, equity, equity, equity, equity, notional FROM equity
+                WHERE account = ?{wallet_filter} AND ts BETWEEN ? AND ? ORDER BY wallet_type, ts""",
+            params + [start, end],
+        ).fetchall()
+    else:
+        rows = conn.execute(
+            f"""SELECT wallet_type, bucket, open, high, low, close, notional_close FROM equity_rollup
+                WHERE account = ?{wallet_filter} AND resolution = ? AND bucket BETWEEN ? AND ? ORDER BY wallet_type, bucket""",
+            params + [resolution, start - start % resolution, end],
+        ).fetchall()
+    return {'resolution': resolution, 'rows': rows}
@@ -0,0 +1,186 @@
+import asyncio
+import threading
+import time
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from apscheduler.events import EVENT_JOB_MAX_INSTANCES, EVENT_JOB_MISSED, EVENT_JOB_SUBMITTED
+from apscheduler.schedulers.base import BaseScheduler
+
+from utils.metrics import CYCLE_EVENTS, CYCLE_LAG_SECONDS, CYCLE_SECONDS, LAST_SUCCESS, current_account
+from utils.polling import AdaptivePolicy
+
+# A cycle starting this long after its scheduled time counts as late
+LATE_AFTER = 5.0
+# Share of the stagger slot each start may be randomly delayed by
+JITTER_FRACTION = 0.25
+MAX_JITTER = 5.0
+
+JOB_DEFAULTS = {'coalesce': True, 'max_instances': 1}
+
+
+@dataclass
+class CycleStats:
+    runs: int = 0
+    failures: int = 0
+    late: int = 0
+    skipped: int = 0
+    missed: int = 0
+    overruns: int = 0
+    max_lag: float = 0.0
+    max_duration: float = 0.0
+
+
+class CycleMonitor:
+    """
+    Per-account record of how update cycles ran.
+
+    Listens to scheduler events: a cycle submitted more than LATE_AFTER
+    seconds after its scheduled time is late, a cycle dropped because the
+    previous one was still running is skipped, and one dropped after its
+    misfire grace time is missed. Cycle wrappers add durations, failures and
+    deadline overruns.
+    """
+
+    def __init__(self, late_after: float = LATE_AFTER):
+        self.late_after = late_after
+        self.stats: Dict[str, CycleStats] = {}
+        self._lock = threading.Lock()
+
+    def _stats(self, job_id: str) -> CycleStats:
+        if job_id not in self.stats:
+            self.stats[job_id] = CycleStats()
+        return self.stats[job_id]
+
+    def listen(self, scheduler: BaseScheduler):
+        scheduler.add_listener(self.on_event, EVENT_JOB_SUBMITTED | EVENT_JOB_MAX_INSTANCES | EVENT_JOB_MISSED)
+
+    def on_event(self, event):
+        with self._lock:
+            stats = self._stats(event.job_id)
+            if event.code == EVENT_JOB_SUBMITTED:
+                scheduled = max(event.scheduled_run_times)
+                lag = (datetime.now(scheduled.tzinfo) - scheduled).total_seconds()
+                stats.max_lag = max(stats.max_lag, lag)
+                CYCLE_LAG_SECONDS.observe(max(lag, 0.0), account=event.job_id)
+                if lag > self.late_after:
+                    stats.late += 1
+                    CYCLE_EVENTS.inc(account=event.job_id, event='late')
+                    print(f"Cycle {event.job_id} started {lag:.1f}s late")
+            elif event.code == EVENT_JOB_MAX_INSTANCES:
+                stats.skipped += 1
+                CYCLE_EVENTS.inc(account=event.job_id, event='skipped')
+                print(f"Cycle {event.job_id} skipped: previous cycle still running")
+            elif event.code == EVENT_JOB_MISSED:
+                stats.missed += 1
+                CYCLE_EVENTS.inc(account=event.job_id, event='missed')
+                print(f"Cycle {event.job_id} missed its run time")
+
+    def record(self, job_id: str, duration: float, deadline: Optional[float], failed: bool):
+        with self._lock:
+            stats = self._stats(job_id)
+            stats.runs += 1
+            stats.failures += failed
+            stats.max_duration = max(stats.max_duration, duration)
+            if deadline is not None and duration > deadline:
+                stats.overruns += 1
+                CYCLE_EVENTS.inc(account=job_id, event='overrun')
+        CYCLE_SECONDS.observe(duration, account=job_id)
+        CYCLE_EVENTS.inc(account=job_id, event='failed' if failed else 'ok')
+        if not failed:
+            LAST_SUCCESS.set(time.time(), account=job_id)
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {job_id: asdict(stats) for job_id, stats in self.stats.items()}
+
+    def wrap(self, job_id: str, job: Callable[[], None], deadline: Optional[float]) -> Callable[[], None]:
+        """
+        Time a blocking cycle. A thread cannot be interrupted, so an overrun is
+        only recorded; ccxt's per-request timeout bounds how long one call can hang.
+        """
+        def cycle():
+            current_account.set(job_id)
+            start = time.monotonic()
+            failed = True
+            try:
+                job()
+                failed = False
+            finally:
+                duration = time.monotonic() - start
+                self.record(job_id, duration, deadline, failed)
+                if deadline is not None and duration > deadline:
+                    print(f"Cycle {job_id} took {duration:.1f}s, over its {deadline:.0f}s deadline")
+        return cycle
+
+    def wrap_async(self, job_id: str, job: Callable[[], Awaitable[None]], deadline: Optional[float]) -> Callable[[], Awaitable[None]]:
+        """Time a coroutine cycle and cancel it at its deadline so it cannot hold up the next one."""
+        async def cycle():
+            current_account.set(job_id)
+            start = time.monotonic()
+            failed = True
+            try:
+                await asyncio.wait_for(job(), deadline)
+                failed = False
+            except asyncio.TimeoutError:
+                print(f"Cycle {job_id} cancelled at its {deadline:.0f}s deadline")
+                raise
+            finally:
+                self.record(job_id, time.monotonic() - start, deadline, failed)
+        return cycle
+
+
+def stagger_offsets(count: int, interval: float) -> List[float]:
+    """Spread `count` cycles evenly over one interval."""
+    return [interval * i / count for i in range(count)] if count else []
+
+
+def adaptive(scheduler: BaseScheduler, job_id: str, cycle: Callable, policy: AdaptivePolicy, is_async: bool) -> Callable:
+    """After every cycle, move the job's next run to the interval the policy gives the account."""
+    def reschedule():
+        next_run = datetime.now().astimezone() + timedelta(seconds=policy.interval(job_id))
+        scheduler.modify_job(job_id, next_run_time=next_run)
+
+    if is_async:
+        async def adaptive_cycle():
+            try:
+                await cycle()
+            finally:
+                reschedule()
+        return adaptive_cycle
+
+    def adaptive_cycle():
+        try:
+            cycle()
+        finally:
+            reschedule()
+    return adaptive_cycle
+
+
+def schedule_cycles(scheduler: BaseScheduler, jobs: List[Tuple[str, str, Callable]], interval: float,
+                    monitor: CycleMonitor, deadline: Optional[float] = None, is_async: bool = False,
+                    start: Optional[datetime] = None, policy: Optional[AdaptivePolicy] = None):
+    """
+    Add one interval job per (job id, name, callable), staggered across the interval.
+
+    Each start is additionally delayed by a random jitter of up to a quarter of
+    its slot. Missed runs are coalesced into one, a run later than half an
+    interval is dropped rather than run back to back with the next, and a
+    cycle never overlaps its predecessor. With a policy, each account's next
+    cycle is scheduled after the interval the policy picks for it instead.
+    """
+    start = start or datetime.now().astimezone()
+    offsets = stagger_offsets(len(jobs), interval)
+    slot = interval / max(len(jobs), 1)
+    jitter = min(slot * JITTER_FRACTION, MAX_JITTER)
+    for (job_id, name, job), offset in zip(jobs, offsets):
+        cycle = monitor.wrap_async(job_id, job, deadline) if is_async else monitor.wrap(job_id, job, deadline)
+        if policy is not None:
+            policy.add(job_id)
+            cycle = adaptive(scheduler, job_id, cycle, policy, is_async)
+        scheduler.add_job(
+            cycle, 'interval', seconds=interval, id=job_id, name=name,
+            start_date=start + timedelta(seconds=offset), jitter=jitter or None,
+            misfire_grace_time=max(int(interval / 2), 1), **JOB_DEFAULTS,
+        )
@@ -0,0 +1,117 @@
+import sqlite3
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+# Every row is scoped by account (the table prefix of the old per-user
+# tables, e.g. bybit1), venue (bybit, binance) and wallet type (unified,
+# portfolio, spot, um, cm).
+SCOPE = ('account', 'venue', 'wallet_type')
+
+
+@dataclass(frozen=True)
+class Table:
+    """A current-state table: one row per scope and key, with the time it last changed."""
+    name: str
+    key: str
+    columns: Tuple[str, ...]
+
+    @property
+    def all_columns(self) -> Tuple[str, ...]:
+        return SCOPE + (self.key, 'ts') + self.columns
+
+    @property
+    def select_sql(self) -> str:
+        where = ' AND '.join(f"{column} = ?" for column in SCOPE)
+        return f"SELECT {', '.join((self.key,) + self.columns)} FROM {self.name} WHERE {where}"
+
+    @property
+    def upsert_sql(self) -> str:
+        columns = self.all_columns
+        return f"INSERT OR REPLACE INTO {self.name} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+
+    @property
+    def delete_sql(self) -> str:
+        where = ' AND '.join(f"{column} = ?" for column in SCOPE + (self.key,))
+        return f"DELETE FROM {self.name} WHERE {where}"
+
+
+BALANCES = Table('balances', 'asset', ('balance', 'wallet_balance', 'unrealized_pnl', 'borrowed'))
+POSITIONS = Table('positions', 'symbol', ('contracts', 'unrealized_pnl', 'notional'))
+# What each wallet's equity is made of, net of borrowing (Batch.hold)
+HOLDINGS = Table('holdings', 'asset', ('quantity',))
+
+EQUITY_COLUMNS = SCOPE + ('ts', 'equity', 'notional')
+# Samples written separately in the same second are merged rather than replaced
+EQUITY_UPSERT_SQL = f"""INSERT INTO equity ({', '.join(EQUITY_COLUMNS)}) VALUES ({', '.join('?' * len(EQUITY_COLUMNS))})
+    ON CONFLICT (account, venue, wallet_type, ts) DO UPDATE SET
+        equity = coalesce(excluded.equity, equity),
+        notional = coalesce(excluded.notional, notional)"""
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS equity (
+    account TEXT NOT NULL,
+    venue TEXT NOT NULL,
+    wallet_type TEXT NOT NULL,
+    ts INTEGER NOT NULL,
+    equity REAL,
+    notional REAL,
+    PRIMARY KEY (account, venue, wallet_type, ts)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS equity_ts ON equity (ts);
+
+CREATE TABLE IF NOT EXISTS balances (
+    account TEXT NOT NULL,
+    venue TEXT NOT NULL,
+    wallet_type TEXT NOT NULL,
+    asset TEXT NOT NULL,
+    ts INTEGER NOT NULL,
+    balance REAL,
+    wallet_balance REAL,
+    unrealized_pnl REAL,
+    borrowed REAL,
+    PRIMARY KEY (account, venue, wallet_type, asset)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS balances_asset ON balances (asset, account);
+
+CREATE TABLE IF NOT EXISTS positions (
+    account TEXT NOT NULL,
+    venue TEXT NOT NULL,
+    wallet_type TEXT NOT NULL,
+    symbol TEXT NOT NULL,
+    ts INTEGER NOT NULL,
+    contracts REAL,
+    unrealized_pnl REAL,
+    notional REAL,
+    PRIMARY KEY (account, venue, wallet_type, symbol)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS positions_symbol ON positions (symbol, account);
+
+CREATE TABLE IF NOT EXISTS holdings (
+    account TEXT NOT NULL,
+    venue TEXT NOT NULL,
+    wallet_type TEXT NOT NULL,
+    asset TEXT NOT NULL,
+    ts INTEGER NOT NULL,
+    quantity REAL,
+    PRIMARY KEY (account, venue, wallet_type, asset)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+) WITHOUT ROWID;
+'''
+
+
+def init_schema(conn: sqlite3.Connection):
+    conn.executescript(SCHEMA)
+    conn.commit()
+
+
+def get_meta(conn: sqlite3.Connection, key: str) -> Optional[int]:
+    row = conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+    return None if row is None else row[0]
+
+
+def set_meta(conn: sqlite3.Connection, key: str, value: int):
+    conn.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, value))
@@ -0,0 +1,463 @@
+import json
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+import ccxt
+
+from utils.accounts import BYBIT
+from utils.ratelimit import LIMITS, WEIGHT_HEADER
+
+# Request weight the simulator charges per Binance endpoint, mirroring utils.ratelimit.WEIGHTS
+PATH_WEIGHTS = {
+    '/api/v3/account': 20,
+    '/api/v3/exchangeInfo': 20,
+    '/api/v3/ticker/24hr': 80,
+    '/fapi/v3/account': 5,
+    '/dapi/v1/account': 5,
+    '/papi/v1/balance': 20,
+    '/papi/v1/um/positionRisk': 5,
+    '/sapi/v1/capital/config/getall': 10,
+}
+DAY_MS = 86400 * 1000
+
+
+def parse_latency(spec: str) -> Callable[[random.Random], float]:
+    """
+    Build a latency sampler from 'fixed:S', 'uniform:LOW:HIGH', 'exp:MEAN' or
+    'lognormal:MEDIAN:SIGMA', all in seconds.
+    """
+    kind, *args = spec.split(':')
+    values = [float(arg) for arg in args]
+    if kind == 'fixed':
+        return lambda rng: values[0]
+    if kind == 'uniform':
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == 'exp':
+        return lambda rng: rng.expovariate(1 / values[0]) if values[0] else 0.0
+    if kind == 'lognormal':
+        median, sigma = values
+        return lambda rng: median * rng.lognormvariate(0, sigma)
+    raise ValueError(f"Unknown latency distribution {spec}")
+
+
+@dataclass
+class SimulatorConfig:
+    latency: str = 'lognormal:0.05:0.5'
+    # Share of requests answered with a 503
+    error_rate: float = 0.0
+    # Share of requests answered with a rate-limit error regardless of the weight used
+    throttle_rate: float = 0.0
+    # Fraction of the real per-IP limits enforced; lower it to provoke rate limiting
+    limit_scale: float = 1.0
+    # Coins and positions per account, and listed markets
+    assets: int = 10
+    positions: int = 10
+    markets: int = 0
+    # Share of position rows whose PnL moves between two requests
+    churn: float = 0.2
+    seed: int = 0
+
+
+@dataclass
+class Portfolio:
+    """Synthetic holdings of one simulated account, derived from its API key."""
+    assets: Dict[str, float]
+    um: Dict[int, float]
+    cm: Dict[int, float]
+    pnl: Dict[Tuple[str, int], float] = field(default_factory=dict)
+
+
+@dataclass
+class SimulatorStats:
+    requests: int = 0
+    errors: int = 0
+    throttled: int = 0
+    by_path: Dict[str, int] = field(default_factory=dict)
+
+
+class RateLimitError(Exception):
+    def __init__(self, retry_after: float):
+        self.retry_after = retry_after
+
+
+class Simulator:
+    """
+    Local stand-in for the Bybit v5 and Binance spot/fapi/dapi/papi endpoints
+    the updaters call, answering from synthetic portfolios.
+
+    Accounts are told apart by their API key; signatures are not checked.
+    Every response is delayed by a latency sample, and requests can fail with
+    a 503 or a rate-limit error at the configured rates. Request weight is
+    counted per venue and API family in fixed windows, like the exchanges do
+    per IP, against LIMITS scaled by limit_scale.
+    """
+
+    def __init__(self, config: Optional[SimulatorConfig] = None):
+        self.config = config or SimulatorConfig()
+        self.markets = self.config.markets or max(self.config.assets, self.config.positions, 1)
+        self.latency = parse_latency(self.config.latency)
+        self.stats = SimulatorStats()
+        self.portfolios: Dict[str, Portfolio] = {}
+        self.windows: Dict[str, Tuple[float, int]] = {}
+        self._rng = random.Random(self.config.seed)
+        self._lock = threading.Lock()
+        self.server: Optional[ThreadingHTTPServer] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def serve(self, port: int = 0, host: str = '127.0.0.1') -> str:
+        """Start answering on a background thread and return the base URL."""
+        simulator = self
+
+        class Handler(SimulatorHandler):
+            pass
+        Handler.simulator = simulator
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name='simulator', daemon=True).start()
+        return self.url
+
+    def shutdown(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+    # Request handling
+
+    def sample(self, draw: Callable[[random.Random], Any]) -> Any:
+        with self._lock:
+            return draw(self._rng)
+
+    def charge(self, family: str, weight: int) -> int:
+        """Count `weight` in the family's current window and return the weight used, or raise when over the limit."""
+        limit = LIMITS[family]
+        budget = max(int(limit.weight * self.config.limit_scale), 1)
+        now = time.time()
+        start = now - now % limit.window
+        with self._lock:
+            window_start, used = self.windows.get(family, (start, 0))
+            if window_start != start:
+                used = 0
+            if used + weight > budget:
+                self.windows[family] = (start, used)
+                raise RateLimitError(start + limit.window - now)
+            self.windows[family] = (start, used + weight)
+            return used + weight
+
+    def record(self, path: str, error: bool = False, throttled: bool = False):
+        with self._lock:
+            self.stats.requests += 1
+            self.stats.errors += error
+            self.stats.throttled += throttled
+            self.stats.by_path[path] = self.stats.by_path.get(path, 0) + 1
+
+    def portfolio(self, api_key: str) -> Portfolio:
+        with self._lock:
+            if api_key not in self.portfolios:
+                rng = random.Random(f"{self.config.seed}:{api_key}")
+                count = self.config.positions
+                self.portfolios[api_key] = Portfolio(
+                    assets={asset_name(i): round(rng.uniform(0.1, 1000), 8) for i in range(self.config.assets)},
+                    um={i: round(rng.uniform(-50, 50), 3) or 1.0 for i in sample_markets(rng, self.markets, count)},
+                    cm={i: float(rng.randint(1, 100)) for i in sample_markets(rng, self.markets, count)},
+                )
+            return self.portfolios[api_key]
+
+    def pnl(self, portfolio: Portfolio, key: Tuple[str, int]) -> float:
+        """Unrealized PnL of one position, moving on churn of the requests."""
+        with self._lock:
+            if key not in portfolio.pnl or self._rng.random() < self.config.churn:
+                portfolio.pnl[key] = round(self._rng.gauss(0, 100), 8)
+            return portfolio.pnl[key]
+
+    # Binance
+
+    def binance_spot_exchange_info(self, query) -> Any:
+        return {'timezone': 'UTC', 'serverTime': now_ms(), 'rateLimits': [], 'symbols': [{
+            'symbol': f"A{i}USDT", 'status': 'TRADING', 'baseAsset': f"A{i}", 'quoteAsset': 'USDT',
+            'baseAssetPrecision': 8, 'quotePrecision': 8, 'quoteAssetPrecision': 8,
+            'isSpotTradingAllowed': True, 'isMarginTradingAllowed': False,
+            'orderTypes': ['LIMIT', 'MARKET'], 'permissions': ['SPOT'], 'filters': [],
+        } for i in range(1, self.markets + 1)]}
+
+    def binance_fapi_exchange_info(self, query) -> Any:
+        return {'timezone': 'UTC', 'serverTime': now_ms(), 'rateLimits': [], 'assets': [], 'symbols': [{
+            'symbol': f"A{i}USDT", 'pair': f"A{i}USDT", 'contractType': 'PERPETUAL', 'deliveryDate': 4133404800000,
+            'onboardDate': 1569398400000, 'status': 'TRADING', 'baseAsset': f"A{i}", 'quoteAsset': 'USDT',
+            'marginAsset': 'USDT', 'pricePrecision': 2, 'quantityPrecision': 3, 'baseAssetPrecision': 8,
+            'quotePrecision': 8, 'underlyingType': 'COIN', 'filters': [], 'orderTypes': ['LIMIT', 'MARKET'],
+            'timeInForce': ['GTC'],
+        } for i in range(1, self.markets + 1)]}
+
+    def binance_dapi_exchange_info(self, query) -> Any:
+        return {'timezone': 'UTC', 'serverTime': now_ms(), 'rateLimits': [], 'symbols': [{
+            'symbol': f"A{i}USD_PERP", 'pair': f"A{i}USD", 'contractType': 'PERPETUAL', 'deliveryDate': 4133404800000,
+            'onboardDate': 1597042800000, 'contractStatus': 'TRADING', 'contractSize': 10, 'baseAsset': f"A{i}",
+            'quoteAsset': 'USD', 'marginAsset': f"A{i}", 'pricePrecision': 1, 'quantityPrecision': 0,
+            'baseAssetPrecision': 8, 'quotePrecision': 8, 'filters': [], 'orderTypes': ['LIMIT', 'MARKET'],
+            'timeInForce': ['GTC'],
+        } for i in range(1, self.markets + 1)]}
+
+    def binance_tickers(self, query) -> Any:
+        return [{
+            'symbol': f"A{i}USDT", 'lastPrice': str(price(i)), 'openPrice': str(price(i)), 'highPrice': str(price(i)),
+            'lowPrice': str(price(i)), 'bidPrice': str(price(i)), 'bidQty': '10', 'askPrice': str(price(i)),
+            'askQty': '10', 'volume': '1000', 'quoteVolume': str(1000 * price(i)),
+            'openTime': now_ms() - DAY_MS, 'closeTime': now_ms(),
+        } for i in range(1, self.markets + 1)]
+
+    def binance_currencies(self, query, portfolio: Portfolio) -> Any:
+        return []
+
+    def binance_margin_pairs(self, query, portfolio: Optional[Portfolio] = None) -> Any:
+        return []
+
+    def binance_spot_account(self, query, portfolio: Portfolio) -> Any:
+        return {'accountType': 'SPOT', 'canTrade': True, 'updateTime': now_ms(), 'balances': [
+            {'asset': asset, 'free': fmt(balance), 'locked': '0.00000000'} for asset, balance in portfolio.assets.items()
+        ]}
+
+    def binance_um_account(self, query, portfolio: Portfolio) -> Any:
+        positions = [{
+            'symbol': f"A{i}USDT", 'positionAmt': fmt(amount), 'positionSide': 'BOTH',
+            'unrealizedProfit': fmt(self.pnl(portfolio, ('um', i))), 'notional': fmt(amount * price(i)),
+            'initialMargin': '0', 'maintMargin': '0', 'isolatedMargin': '0', 'isolatedWallet': '0', 'updateTime': now_ms(),
+        } for i, amount in portfolio.um.items()]
+        pnl = sum(float(pos['unrealizedProfit']) for pos in positions)
+        wallet = portfolio.assets.get('USDT', 0.0)
+        return {
+            'assets': [wallet_asset('USDT', wallet, pnl)],
+            'positions': positions,
+            'totalWalletBalance': fmt(wallet),
+            'totalUnrealizedProfit': fmt(pnl),
+        }
+
+    def binance_cm_account(self, query, portfolio: Portfolio) -> Any:
+        positions = [{
+            'symbol': f"A{i}USD_PERP", 'positionAmt': fmt(amount), 'positionSide': 'BOTH',
+            'unrealizedProfit': fmt(self.pnl(portfolio, ('cm', i)) / price(i)), 'updateTime': now_ms(),
+        } for i, amount in portfolio.cm.items()]
+        return {
+            'assets': [wallet_asset(f"A{i}", 1.0, float(pos['unrealizedProfit'])) for i, pos in zip(portfolio.cm, positions)],
+            'positions': positions,
+        }
+
+    def binance_pm_balance(self, query, portfolio: Portfolio) -> Any:
+        return [{
+            'asset': asset, 'totalWalletBalance': fmt(balance), 'crossMarginAsset': fmt(balance), 'crossMarginBorrowed': '0',
+            'crossMarginFree': fmt(balance), 'crossMarginInterest': '0', 'crossMarginLocked': '0', 'umWalletBalance': '0',
+            'umUnrealizedPNL': '0', 'cmWalletBalance': '0', 'cmUnrealizedPNL': '0', 'updateTime': now_ms(),
+        } for asset, balance in portfolio.assets.items()]
+
+    def binance_pm_um_positions(self, query, portfolio: Portfolio) -> Any:
+        return [{
+            'symbol': f"A{i}USDT", 'positionAmt': fmt(amount), 'entryPrice': fmt(price(i)), 'markPrice': fmt(price(i)),
+            'unRealizedProfit': fmt(self.pnl(portfolio, ('um', i))), 'liquidationPrice': '0', 'leverage': '5',
+            'positionSide': 'BOTH', 'maxNotionalValue': '8000000', 'notional': fmt(amount * price(i)),
+            'breakEvenPrice': fmt(price(i)), 'updateTime': now_ms(),
+        } for i, amount in portfolio.um.items()]
+
+    def binance_pm_cm_positions(self, query, portfolio: Portfolio) -> Any:
+        return [{
+            'symbol': f"A{i}USD_PERP", 'positionAmt': fmt(amount), 'entryPrice': fmt(price(i)), 'markPrice': fmt(price(i)),
+            'unRealizedProfit': fmt(self.pnl(portfolio, ('cm', i)) / price(i)), 'liquidationPrice': '0', 'leverage': '5',
+            'positionSide': 'BOTH', 'maxQty': '1000', 'notionalValue': fmt(amount * 10 / price(i)),
+            'breakEvenPrice': fmt(price(i)), 'updateTime': now_ms(),
+        } for i, amount in portfolio.cm.items()]
+
+    # Bybit
+
+    def bybit_instruments(self, query) -> Any:
+        category = query.get('category', 'spot')
+        if category == 'spot':
+            instruments = [{
+                'symbol': f"A{i}USDT", 'baseCoin': f"A{i}", 'quoteCoin': 'USDT', 'status': 'Trading',
+                'lotSizeFilter': {'basePrecision': '0.0001', 'quotePrecision': '0.01', 'minOrderQty': '0.1',
+                                  'maxOrderQty': '100000', 'minOrderAmt': '1', 'maxOrderAmt': '1000000'},
+                'priceFilter': {'tickSize': '0.01'},
+            } for i in range(1, self.markets + 1)]
+        elif category == 'linear':
+            instruments = [{
+                'symbol': f"A{i}USDT", 'contractType': 'LinearPerpetual', 'status': 'Trading', 'baseCoin': f"A{i}",
+                'quoteCoin': 'USDT', 'settleCoin': 'USDT', 'launchTime': '1585526400000', 'deliveryTime': '0',
+                'priceScale': '2', 'leverageFilter': {'minLeverage': '1', 'maxLeverage': '100', 'leverageStep': '0.01'},
+                'priceFilter': {'minPrice': '0.01', 'maxPrice': '1000000', 'tickSize': '0.01'},
+                'lotSizeFilter': {'maxOrderQty': '100000', 'minOrderQty': '0.001', 'qtyStep': '0.001'},
+            } for i in range(1, self.markets + 1)]
+        else:
+            instruments = []
+        return bybit_result({'category': category, 'list': instruments, 'nextPageCursor': ''})
+
+    def bybit_currencies(self, query, portfolio: Portfolio) -> Any:
+        return bybit_result({'rows': []})
+
+    def bybit_query_api(self, query, portfolio: Portfolio) -> Any:
+        return bybit_result({'readOnly': 1, 'unified': 0, 'uta': 1})
+
+    def bybit_account_info(self, query, portfolio: Portfolio) -> Any:
+        return bybit_result({'unifiedMarginStatus': 4, 'marginMode': 'REGULAR_MARGIN'})
+
+    def bybit_wallet_balance(self, query, portfolio: Portfolio) -> Any:
+        coins = [{
+            'coin': asset, 'walletBalance': fmt(balance), 'equity': fmt(balance), 'availableToWithdraw': fmt(balance),
+            'usdValue': fmt(balance * (1 if asset == 'USDT' else price(int(asset[1:])))),
+            'borrowAmount': '0', 'accruedInterest': '0', 'locked': '0',
+        } for asset, balance in portfolio.assets.items()]
+        equity = sum(float(coin['usdValue']) for coin in coins)
+        return bybit_result({'list': [{'accountType': 'UNIFIED', 'totalEquity': fmt(equity), 'coin': coins}]})
+
+    def bybit_positions(self, query, portfolio: Portfolio) -> Any:
+        symbols = sorted(portfolio.um)
+        start = int(query.get('cursor') or 0)
+        limit = int(query.get('limit') or 20)
+        positions = [{
+            'symbol': f"A{i}USDT", 'side': 'Buy' if portfolio.um[i] > 0 else 'Sell', 'size': fmt(abs(portfolio.um[i])),
+            'positionValue': fmt(abs(portfolio.um[i]) * price(i)), 'avgPrice': fmt(price(i)), 'markPrice': fmt(price(i)),
+            'unrealisedPnl': fmt(self.pnl(portfolio, ('um', i))), 'leverage': '5', 'positionIdx': 0, 'tradeMode': 0,
+            'createdTime': '1676538056258', 'updatedTime': str(now_ms()),
+        } for i in symbols[start:start + limit]]
+        cursor = str(start + limit) if start + limit < len(symbols) else ''
+        return bybit_result({'category': query.get('category', 'linear'), 'list': positions, 'nextPageCursor': cursor})
+
+
+# URL path -> (Simulator method answering it, whether the answer depends on the account)
+ROUTES = {
+    '/api/v3/exchangeInfo': ('binance_spot_exchange_info', False),
+    '/fapi/v1/exchangeInfo': ('binance_fapi_exchange_info', False),
+    '/dapi/v1/exchangeInfo': ('binance_dapi_exchange_info', False),
+    '/api/v3/ticker/24hr': ('binance_tickers', False),
+    '/sapi/v1/capital/config/getall': ('binance_currencies', True),
+    '/sapi/v1/margin/allAssets': ('binance_currencies', True),
+    '/sapi/v1/margin/allPairs': ('binance_margin_pairs', False),
+    '/sapi/v1/margin/isolated/allPairs': ('binance_margin_pairs', True),
+    '/api/v3/account': ('binance_spot_account', True),
+    '/fapi/v3/account': ('binance_um_account', True),
+    '/dapi/v1/account': ('binance_cm_account', True),
+    '/papi/v1/balance': ('binance_pm_balance', True),
+    '/papi/v1/um/positionRisk': ('binance_pm_um_positions', True),
+    '/papi/v1/cm/positionRisk': ('binance_pm_cm_positions', True),
+    '/v5/market/instruments-info': ('bybit_instruments', False),
+    '/v5/asset/coin/query-info': ('bybit_currencies', True),
+    '/v5/user/query-api': ('bybit_query_api', True),
+    '/v5/account/info': ('bybit_account_info', True),
+    '/v5/account/wallet-balance': ('bybit_wallet_balance', True),
+    '/v5/position/list': ('bybit_positions', True),
+}
+
+
+class SimulatorHandler(BaseHTTPRequestHandler):
+    simulator: Simulator
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        simulator = self.simulator
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        bybit = url.path.startswith('/v5/')
+        route = ROUTES.get(url.path)
+        if route is None:
+            self.reply(404, {'code': -1, 'msg': f"Unknown path {url.path}"})
+            return
+
+        time.sleep(max(simulator.sample(simulator.latency), 0.0))
+        family = limit_family(url.path)
+        try:
+            if simulator.sample(lambda rng: rng.random()) < simulator.config.throttle_rate:
+                raise RateLimitError(1.0)
+            used = simulator.charge(family, 1 if bybit else PATH_WEIGHTS.get(url.path, 1))
+        except RateLimitError as e:
+            simulator.record(url.path, throttled=True)
+            self.rate_limited(bybit, e.retry_after)
+            return
+        if simulator.sample(lambda rng: rng.random()) < simulator.config.error_rate:
+            simulator.record(url.path, error=True)
+            if bybit:
+                self.reply(503, 'Service Unavailable', content_type='text/plain')
+            else:
+                self.reply(503, {'code': -1001, 'msg': 'Internal error; unable to process your request. Please try again.'})
+            return
+
+        name, private = route
+        handler = getattr(simulator, name)
+        if private:
+            api_key = self.headers.get('X-BAPI-API-KEY') if bybit else self.headers.get('X-MBX-APIKEY')
+            body = handler(query, simulator.portfolio(api_key or 'anonymous'))
+        else:
+            body = handler(query)
+        simulator.record(url.path)
+        self.reply(200, body, {} if bybit else {WEIGHT_HEADER: str(used)})
+
+    def rate_limited(self, bybit: bool, retry_after: float):
+        headers = {'Retry-After': str(max(int(retry_after + 0.999), 1))}
+        if bybit:
+            # Bybit reports its request limit in the body of a 200
+            self.reply(200, {'retCode': 10006, 'retMsg': 'Too many visits!', 'result': {}, 'time': now_ms()}, headers)
+        else:
+            self.reply(429, {'code': -1003, 'msg': 'Too many requests; current limit is exceeded.'}, headers)
+
+    def reply(self, status: int, body: Any, headers: Optional[Dict[str, str]] = None, content_type: str = 'application/json'):
+        data = (body if isinstance(body, str) else json.dumps(body)).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def simulated_config(config: Dict[str, Any], url: str) -> Dict[str, Any]:
+    """Return an exchange config (as for init_exchange) whose REST calls go to the simulator at `url`."""
+    exchange = getattr(ccxt, config['exchange_id'])()
+    api = {name: url + urlparse(base.replace('{hostname}', exchange.hostname or '')).path
+           for name, base in exchange.urls['api'].items()}
+    return dict(config, urls={'api': api})
+
+
+def limit_family(path: str) -> str:
+    if path.startswith('/v5/'):
+        return BYBIT
+    for family in ('papi', 'fapi', 'dapi'):
+        if path.startswith(f"/{family}/"):
+            return f"binance:{family}"
+    return 'binance:spot'
+
+
+def bybit_result(result: Dict[str, Any]) -> Dict[str, Any]:
+    return {'retCode': 0, 'retMsg': 'OK', 'result': result, 'retExtInfo': {}, 'time': now_ms()}
+
+
+def wallet_asset(asset: str, balance: float, pnl: float) -> Dict[str, Any]:
+    return {'asset': asset, 'walletBalance': fmt(balance), 'unrealizedProfit': fmt(pnl),
+            'marginBalance': fmt(balance + pnl), 'availableBalance': fmt(balance), 'updateTime': now_ms()}
+
+
+def sample_markets(rng: random.Random, markets: int, count: int) -> List[int]:
+    return sorted(rng.sample(range(1, markets + 1), min(count, markets)))
+
+
+def asset_name(i: int) -> str:
+    return 'USDT' if i == 0 else f"A{i}"
+
+
+def price(i: int) -> float:
+    return 1.0 + i
+
+
+def fmt(value: float) -> str:
+    return f"{value:.8f}"
+
+
+def now_ms() -> int:
+    return int(time.time() * 1000)
@@ -0,0 +1,232 @@
+import mmap
+import os
+import sqlite3
+import struct
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from utils.markets import CACHE_DIR
+from utils.schema import BALANCES, POSITIONS, Table
+from utils.storage import Batch
+
+SNAPSHOT_PATH = os.path.join('/dev/shm' if os.path.isdir('/dev/shm') else CACHE_DIR, 'trading_snapshot')
+MAGIC = b'ACCTSNAP'
+LAYOUT = 1
+WALLETS = 1024
+ROWS = 16384
+# Longest a reader waits out a writer, which may be descheduled mid-update
+READ_TIMEOUT = 1.0
+
+# magic, layout, flags, sequence, published at, capacity and count of wallets,
+# balances and positions. The sequence is odd while the writer is mid-update.
+HEADER = struct.Struct('<8sIIQd3I3I')
+HEADER_SIZE = 64
+FLAGS = struct.Struct('<I')
+FLAGS_OFFSET = 12
+SEQUENCE = struct.Struct('<Q')
+SEQUENCE_OFFSET = 16
+PUBLISHED = struct.Struct('<d')
+PUBLISHED_OFFSET = 24
+COUNTS = struct.Struct('<3I')
+COUNTS_OFFSET = 44
+TRUNCATED = 1
+
+SCOPE_FIELDS = [('account', 'S32'), ('venue', 'S16'), ('wallet_type', 'S16')]
+WALLET_DTYPE = np.dtype(SCOPE_FIELDS + [('ts', '<i8'), ('equity', '<f8'), ('notional', '<f8')])
+
+WalletKey = Tuple[str, str, str]
+
+
+def record_dtype(table: Table) -> np.dtype:
+    """One fixed-size record per row of a current-state table; NaN stands for NULL."""
+    return np.dtype(SCOPE_FIELDS + [(table.key, 'S32'), ('ts', '<i8')] + [(column, '<f8') for column in table.columns])
+
+
+RECORDS = {table: record_dtype(table) for table in (BALANCES, POSITIONS)}
+SECTIONS = (WALLET_DTYPE, RECORDS[BALANCES], RECORDS[POSITIONS])
+
+
+def layout(capacities: Tuple[int, int, int]) -> Tuple[List[int], int]:
+    """Offset of each section and the file size."""
+    offsets = []
+    offset = HEADER_SIZE
+    for dtype, capacity in zip(SECTIONS, capacities):
+        offsets.append(offset)
+        offset += dtype.itemsize * capacity
+    return offsets, offset
+
+
+def nan(value: Optional[float]) -> float:
+    return np.nan if value is None else value
+
+
+@dataclass
+class Snapshot:
+    """A consistent copy of the latest state of every wallet, as numpy record arrays."""
+    sequence: int
+    published: float
+    truncated: bool
+    wallets: np.ndarray
+    balances: np.ndarray
+    positions: np.ndarray
+
+    def of(self, account: str) -> 'Snapshot':
+        key = account.encode()
+        return Snapshot(self.sequence, self.published, self.truncated,
+                        *(array[array['account'] == key] for array in (self.wallets, self.balances, self.positions)))
+
+    def wallet(self, account: str, venue: str, wallet_type: str) -> Tuple[float, float]:
+        """(equity, notional) of a wallet; NaN when never sampled."""
+        match = self.wallets[(self.wallets['account'] == account.encode()) & (self.wallets['venue'] == venue.encode())
+                             & (self.wallets['wallet_type'] == wallet_type.encode())]
+        if not len(match):
+            return np.nan, np.nan
+        return float(match['equity'][0]), float(match['notional'][0])
+
+
+class SnapshotWriter:
+    """Publishes the latest state of every wallet to a seqlocked memory-mapped file for readers in other processes."""
+
+    def __init__(self, path: str = SNAPSHOT_PATH, wallets: int = WALLETS, balances: int = ROWS, positions: int = ROWS):
+        self.path = path
+        self.capacities = (wallets, balances, positions)
+        self.offsets, size = layout(self.capacities)
+        self._file = self._open(size)
+        self._mm = mmap.mmap(self._file.fileno(), size)
+        self._views = [
+            np.frombuffer(self._mm, dtype, capacity, offset)
+            for dtype, capacity, offset in zip(SECTIONS, self.capacities, self.offsets)
+        ]
+        self.equity: Dict[WalletKey, Tuple[int, float, float]] = {}
+        self.rows: Dict[Tuple[Table, WalletKey], Dict[str, Tuple[int, Tuple[Optional[float], ...]]]] = {}
+        self._packed: Dict[Tuple[Table, WalletKey], np.ndarray] = {}
+        self._warned = False
+
+    def _open(self, size: int):
+        if os.path.exists(self.path) and os.path.getsize(self.path) == size:
+            file = open(self.path, 'r+b')
+            magic, layout_version, _, _, _, *capacities = HEADER.unpack(file.read(HEADER.size))[:8]
+            if magic == MAGIC and layout_version == LAYOUT and tuple(capacities) == self.capacities:
+                return file
+            file.close()
+        # Build the new file aside: readers of the old one keep a valid mapping
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp = f"{self.path}.{os.getpid()}"
+        with open(tmp, 'wb') as file:
+            file.truncate(size)
+            file.write(HEADER.pack(MAGIC, LAYOUT, 0, 0, 0.0, *self.capacities, 0, 0, 0))
+        os.replace(tmp, self.path)
+        return open(self.path, 'r+b')
+
+    def seed(self, conn: sqlite3.Connection):
+        """Start from the current rows and the latest equity in the database."""
+        for account, venue, wallet_type, ts, equity, notional in conn.execute(
+                "SELECT account, venue, wallet_type, max(ts), equity, notional FROM equity GROUP BY account, venue, wallet_type"):
+            self.equity[(account, venue, wallet_type)] = (ts, nan(equity), nan(notional))
+        for table in RECORDS:
+            for account, venue, wallet_type, key, ts, *values in conn.execute(
+                    f"SELECT account, venue, wallet_type, {table.key}, ts, {', '.join(table.columns)} FROM {table.name}"):
+                self.rows.setdefault((table, (account, venue, wallet_type)), {})[key] = (ts, tuple(values))
+        for scope in self.rows:
+            self._pack(*scope)
+        self.publish()
+
+    def observe(self, batch: Batch):
+        """Store subscriber: take the equity and synced rows of a written batch and publish."""
+        for wallet_type, values in batch.equity.items():
+            key = (batch.account, batch.venue, wallet_type)
+            _, equity, notional = self.equity.get(key, (0, np.nan, np.nan))
+            # Samples may carry only one of the two, like the equity upsert
+            self.equity[key] = (batch.ts, nan(values.get('equity', equity)), nan(values.get('notional', notional)))
+        for (table, wallet_type), rows in batch.syncs.items():
+            if table not in RECORDS:
+                continue
+            key = (batch.account, batch.venue, wallet_type)
+            current = self.rows.get((table, key), {})
+            self.rows[(table, key)] = {
+                asset: current[asset] if asset in current and current[asset][1] == row else (batch.ts, row)
+                for asset, row in rows.items()
+            }
+            self._pack(table, key)
+        self.publish()
+
+    def _pack(self, table: Table, key: WalletKey):
+        scope = tuple(part.encode() for part in key)
+        self._packed[(table, key)] = np.array(
+            [scope + (name.encode(), ts) + tuple(nan(value) for value in row) for name, (ts, row) in self.rows[(table, key)].items()],
+            dtype=RECORDS[table],
+        )
+
+    def publish(self):
+        wallets = np.array(
+            [tuple(part.encode() for part in key) + values for key, values in self.equity.items()], dtype=WALLET_DTYPE)
+        sections = [wallets] + [
+            np.concatenate([packed for (table, _), packed in self._packed.items() if table is section] or [np.empty(0, dtype)])
+            for section, dtype in RECORDS.items()
+        ]
+        flags = 0
+        for i, capacity in enumerate(self.capacities):
+            if len(sections[i]) > capacity:
+                flags |= TRUNCATED
+                sections[i] = sections[i][:capacity]
+        if flags and not self._warned:
+            print(f"Snapshot {self.path} is full; raise its capacities {self.capacities}")
+            self._warned = True
+
+        sequence = SEQUENCE.unpack_from(self._mm, SEQUENCE_OFFSET)[0] | 1
+        SEQUENCE.pack_into(self._mm, SEQUENCE_OFFSET, sequence)
+        for view, section in zip(self._views, sections):
+            view[:len(section)] = section
+        FLAGS.pack_into(self._mm, FLAGS_OFFSET, flags)
+        PUBLISHED.pack_into(self._mm, PUBLISHED_OFFSET, time.time())
+        COUNTS.pack_into(self._mm, COUNTS_OFFSET, *(len(section) for section in sections))
+        SEQUENCE.pack_into(self._mm, SEQUENCE_OFFSET, sequence + 1)
+
+    def close(self):
+        # The mapping cannot close while numpy views export it
+        self._views = []
+        self._mm.close()
+        self._file.close()
+
+
+class SnapshotReader:
+    """Reads consistent copies of a snapshot file published by a SnapshotWriter."""
+
+    def __init__(self, path: str = SNAPSHOT_PATH):
+        with open(path, 'rb') as file:
+            self._mm = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, layout_version, _, _, _, *capacities = HEADER.unpack_from(self._mm)[:8]
+        if magic != MAGIC or layout_version != LAYOUT:
+            raise ValueError(f"{path} is not a layout {LAYOUT} snapshot")
+        offsets, _ = layout(tuple(capacities))
+        self._views = [
+            np.frombuffer(self._mm, dtype, capacity, offset)
+            for dtype, capacity, offset in zip(SECTIONS, capacities, offsets)
+        ]
+
+    @property
+    def sequence(self) -> int:
+        """Changes with every publish; poll it to skip reads when nothing changed."""
+        return SEQUENCE.unpack_from(self._mm, SEQUENCE_OFFSET)[0]
+
+    def read(self, timeout: float = READ_TIMEOUT) -> Snapshot:
+        mm = self._mm
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            sequence = SEQUENCE.unpack_from(mm, SEQUENCE_OFFSET)[0]
+            if sequence & 1:
+                continue
+            flags = FLAGS.unpack_from(mm, FLAGS_OFFSET)[0]
+            published = PUBLISHED.unpack_from(mm, PUBLISHED_OFFSET)[0]
+            counts = COUNTS.unpack_from(mm, COUNTS_OFFSET)
+            arrays = [view[:count].copy() for view, count in zip(self._views, counts)]
+            if SEQUENCE.unpack_from(mm, SEQUENCE_OFFSET)[0] == sequence:
+                return Snapshot(sequence, published, bool(flags & TRUNCATED), *arrays)
+        raise TimeoutError(f"No consistent snapshot within {timeout}s; is the writer stuck mid-update?")
+
+    def close(self):
+        self._views = []
+        self._mm.close()
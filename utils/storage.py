@@ -0,0 +1,247 @@
+import atexit
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from utils.events import EQUITY_SAMPLE, EVENT_TABLES, EVENTS_INSERT_SQL, Event, EventBus, init_events, prune_events, row_event_type, row_values
+from utils.exposure import EXPOSURE_TABLES, add_deltas, apply_exposure, init_exposure
+from utils.history import HISTORY_TABLES, history_name, init_history, record_history
+from utils.metrics import DB_ROWS, DB_WRITE_SECONDS, stage
+from utils.rollup import RAW_RETENTION, RESOLUTIONS, init_rollup, prune, update_rollups
+from utils.schema import EQUITY_UPSERT_SQL, HOLDINGS, Table, init_schema
+
+DB_PATH = 'trading_data.db'
+CACHE_SIZE_KB = 64 * 1024
+
+Row = Tuple[Any, ...]
+
+
+class Batch:
+    """
+    Writes collected during one cycle of one account.
+
+    `record_equity` sets the equity sample of a wallet for this cycle.
+    `sync` states the full set of rows a wallet should hold in a current-state
+    table such as BALANCES or POSITIONS, as {key: column values}. Nothing
+    touches the database until the batch is written by Store.write.
+    `hold` records what a wallet's equity is made of, for subscribers that
+    revalue it; the quantities are synced into the HOLDINGS table.
+    """
+
+    def __init__(self, account: str, venue: str, ts: Optional[int] = None):
+        self.account = account
+        self.venue = venue
+        self.ts = ts or int(time.time())
+        self.equity: Dict[str, Dict[str, float]] = {}
+        self.syncs: Dict[Tuple[Table, str], Dict[Any, Row]] = {}
+        self.holdings: Dict[str, Tuple[Dict[str, float], Dict[str, float], Dict[str, float]]] = {}
+
+    def record_equity(self, wallet_type: str, **values: float):
+        self.equity.setdefault(wallet_type, {}).update(values)
+
+    def sync(self, table: Table, wallet_type: str, rows: Dict[Any, Row]):
+        self.syncs[(table, wallet_type)] = rows
+
+    def hold(self, wallet_type: str, quantities: Dict[str, float], borrowed: Optional[Dict[str, float]] = None,
+             prices: Optional[Dict[str, float]] = None):
+        """Amount of each asset in the wallet's equity, net of borrowing, with the borrowed amounts and prices used."""
+        self.holdings[wallet_type] = (quantities, borrowed or {}, prices or {})
+
+
+def connect(path: str = DB_PATH) -> sqlite3.Connection:
+    """Open a read-write connection in WAL mode so readers never block the writer."""
+    conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA cache_size=-{CACHE_SIZE_KB}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    return conn
+
+
+def connect_readonly(path: str = DB_PATH) -> sqlite3.Connection:
+    """Open a read-only connection for dashboards and reports."""
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, timeout=30, check_same_thread=False)
+    conn.execute("PRAGMA query_only=ON")
+    conn.execute(f"PRAGMA cache_size=-{CACHE_SIZE_KB}")
+    return conn
+
+
+class Store:
+    """Single writer thread that diffs each batch against cached rows and writes only the changes."""
+
+    def __init__(self, path: str = DB_PATH):
+        self.path = path
+        self.conn = connect(path)
+        init_schema(self.conn)
+        init_rollup(self.conn)
+        init_history(self.conn)
+        init_exposure(self.conn)
+        self.events = EventBus(lambda: connect_readonly(path), init_events(self.conn))
+        self._seq = self.events.last_seq
+        self.sequence = 0
+        self.account_sequence: Dict[str, int] = {}
+        self._rows: Dict[Tuple[Table, Tuple[str, str, str]], Dict[Any, Row]] = {}
+        self._subscribers: List[Callable[[Batch], None]] = []
+        self._queue: "queue.Queue[Optional[Tuple[Callable[[], None], Future]]]" = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='db-writer', daemon=True)
+        self._thread.start()
+
+    def write(self, batch: Batch) -> Future:
+        """Queue a batch for the writer thread; the returned future resolves once it is committed."""
+        return self.submit(lambda: self._apply(batch))
+
+    def submit(self, task: Callable[[], None]) -> Future:
+        """Run a maintenance task on the writer thread, between batches."""
+        future = Future()
+        self._queue.put((task, future))
+        return future
+
+    def prune(self, raw_retention: int = RAW_RETENTION) -> Future:
+        def task():
+            prune(self.conn, raw_retention)
+            with self.conn:
+                prune_events(self.conn, int(time.time()) - raw_retention)
+        return self.submit(task)
+
+    def subscribe(self, callback: Callable[[Batch], None]):
+        """Call `callback` on the writer thread with every batch once it is committed."""
+        self._subscribers.append(callback)
+
+    def flush(self):
+        """Block until every queued batch has been written."""
+        self._queue.join()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                task, future = item
+                try:
+                    task()
+                except Exception as e:
+                    print(f"Write failed: {e!r}")
+                    future.set_exception(e)
+                else:
+                    future.set_result(None)
+            finally:
+                self._queue.task_done()
+
+    def _cached_rows(self, table: Table, scope: Tuple[str, str, str]) -> Dict[Any, Row]:
+        if (table, scope) not in self._rows:
+            self._rows[(table, scope)] = {row[0]: row[1:] for row in self.conn.execute(table.select_sql, scope)}
+        return self._rows[(table, scope)]
+
+    def _apply(self, batch: Batch):
+        with DB_WRITE_SECONDS.time():
+            self._write(batch)
+        for callback in self._subscribers:
+            try:
+                callback(batch)
+            except Exception as e:
+                print(f"Subscriber failed: {e!r}")
+
+    def _write(self, batch: Batch):
+        updates = {}
+        counts: Dict[Tuple[str, str], int] = {}
+        events: List[Event] = []
+        seq = self._seq
+
+        def emit(type: str, wallet_type: str, key: Optional[str], values, previous=None):
+            nonlocal seq
+            seq += 1
+            events.append(Event(seq, batch.ts, type, batch.account, batch.venue, wallet_type, key, values, previous))
+
+        with self.conn:
+            if batch.equity:
+                samples = [
+                    (batch.account, batch.venue, wallet_type, batch.ts, values.get('equity'), values.get('notional'))
+                    for wallet_type, values in batch.equity.items()
+                ]
+                self.conn.executemany(EQUITY_UPSERT_SQL, samples)
+                update_rollups(self.conn, samples)
+                counts[('equity', 'inserted')] = len(samples)
+                counts[('equity_rollup', 'upserted')] = len(samples) * len(RESOLUTIONS)
+                for wallet_type, values in batch.equity.items():
+                    emit(EQUITY_SAMPLE, wallet_type, None, dict(values))
+
+            syncs = dict(batch.syncs)
+            for wallet_type, (quantities, _, _) in batch.holdings.items():
+                syncs[(HOLDINGS, wallet_type)] = {asset: (quantity,) for asset, quantity in quantities.items()}
+            exposure: Dict[str, List[float]] = {}
+            for (table, wallet_type), rows in syncs.items():
+                scope = (batch.account, batch.venue, wallet_type)
+                current = self._cached_rows(table, scope)
+                changed = [scope + (key, batch.ts) + row for key, row in rows.items() if current.get(key) != row]
+                deleted = [scope + (key,) for key in current if key not in rows]
+                if table in EXPOSURE_TABLES:
+                    for row in changed:
+                        add_deltas(exposure, table, row[3], current.get(row[3]), row[5:])
+                    for row in deleted:
+                        add_deltas(exposure, table, row[3], current[row[3]], None)
+                if changed:
+                    self.conn.executemany(table.upsert_sql, changed)
+                    replaced = sum(1 for row in changed if row[3] in current)
+                    counts[(table.name, 'replaced')] = counts.get((table.name, 'replaced'), 0) + replaced
+                    counts[(table.name, 'inserted')] = counts.get((table.name, 'inserted'), 0) + len(changed) - replaced
+                if deleted:
+                    self.conn.executemany(table.delete_sql, deleted)
+                    counts[(table.name, 'deleted')] = counts.get((table.name, 'deleted'), 0) + len(deleted)
+                    for row in deleted:
+                        print(f"Deleted {row[-1]} from {batch.account} {wallet_type} {table.name}")
+                if table in EVENT_TABLES:
+                    for row in changed:
+                        old = current.get(row[3])
+                        emit(row_event_type(table, old, row[5:]), wallet_type, row[3], row_values(table, row[5:]), row_values(table, old))
+                    for row in deleted:
+                        old = current[row[-1]]
+                        emit(row_event_type(table, old, None), wallet_type, row[-1], None, row_values(table, old))
+                if table in HISTORY_TABLES and (changed or deleted):
+                    record_history(self.conn, table, scope, batch.ts, [row[3:4] + row[5:] for row in changed], [row[-1] for row in deleted])
+                    counts[(history_name(table), 'inserted')] = counts.get((history_name(table), 'inserted'), 0) + len(changed)
+                updates[(table, scope)] = rows
+            if exposure:
+                apply_exposure(self.conn, exposure, batch.ts)
+            if events:
+                self.conn.executemany(EVENTS_INSERT_SQL, [event.to_row() for event in events])
+                counts[('events', 'inserted')] = len(events)
+
+        # Only trust the new rows once the transaction has committed
+        self._rows.update(updates)
+        self._seq = seq
+        self.sequence += 1
+        self.account_sequence[batch.account] = self.sequence
+        self.events.publish(events)
+        for (table, op), count in counts.items():
+            DB_ROWS.inc(count, table=table, op=op)
+
+    @contextmanager
+    def cycle(self, account: str, venue: str) -> Iterator[Batch]:
+        batch = Batch(account, venue)
+        yield batch
+        with stage('enqueue'):
+            self.write(batch)
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+        self.conn.close()
+
+
+_store: Optional[Store] = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> Store:
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = Store()
+            # Commit whatever is still queued when the process exits
+            atexit.register(_store.close)
+        return _store
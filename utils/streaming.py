@@ -0,0 +1,503 @@
+import asyncio
+import hashlib
+import hmac
+import json
+import math
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import aiohttp
+import ccxt.async_support as ccxt_async
+
+from utils import binance_async as binance_async_utils
+from utils import binance_classic as binance_classic_utils
+from utils import bybit as bybit_utils
+from utils import bybit_async as bybit_async_utils
+from utils.accounts import BINANCE, BYBIT
+from utils.binance_classic import CM, UM
+from utils.exposure import base_asset
+
+BYBIT_PRIVATE_URL = 'wss://stream.bybit.com/v5/private'
+BYBIT_TESTNET_PRIVATE_URL = 'wss://stream-testnet.bybit.com/v5/private'
+BYBIT_PING_INTERVAL = 20
+# Listen keys expire after 60 minutes without a keep-alive
+LISTEN_KEY_INTERVAL = 30 * 60
+RECONNECT_DELAY = 5
+DEBOUNCE = 1.0
+# Shortest time between two REST refreshes requested by stream events
+REFRESH_INTERVAL = 15.0
+
+
+class Transport:
+    """A websocket connection carrying JSON messages. Streams only use these four calls."""
+
+    async def connect(self, url: str):
+        raise NotImplementedError
+
+    async def send(self, message: Dict[str, Any]):
+        raise NotImplementedError
+
+    async def recv(self) -> Optional[Dict[str, Any]]:
+        """Return the next message, or None once the connection is closed."""
+        raise NotImplementedError
+
+    async def close(self):
+        raise NotImplementedError
+
+
+class AiohttpTransport(Transport):
+    def __init__(self):
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._ws: Optional[aiohttp.ClientWebSocketResponse] = None
+
+    async def connect(self, url: str):
+        self._session = aiohttp.ClientSession()
+        self._ws = await self._session.ws_connect(url, heartbeat=30)
+
+    async def send(self, message: Dict[str, Any]):
+        await self._ws.send_str(json.dumps(message))
+
+    async def recv(self) -> Optional[Dict[str, Any]]:
+        msg = await self._ws.receive()
+        if msg.type == aiohttp.WSMsgType.TEXT:
+            return json.loads(msg.data)
+        if msg.type in (aiohttp.WSMsgType.CLOSE, aiohttp.WSMsgType.CLOSING, aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.ERROR):
+            return None
+        return {}
+
+    async def close(self):
+        try:
+            if self._ws is not None:
+                await self._ws.close()
+        finally:
+            if self._session is not None:
+                await self._session.close()
+
+
+class Debouncer:
+    """Run `callback` once `delay` seconds after the first trigger, coalescing triggers that arrive meanwhile."""
+
+    def __init__(self, callback: Callable[[], Awaitable[None]], delay: float = DEBOUNCE):
+        self.callback = callback
+        self.delay = delay
+        self._pending = False
+        self._task: Optional[asyncio.Task] = None
+
+    def trigger(self):
+        self._pending = True
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        while self._pending:
+            await asyncio.sleep(self.delay)
+            self._pending = False
+            try:
+                await self.callback()
+            except Exception as e:
+                print(f"Stream refresh failed: {e!r}")
+
+
+class Stream:
+    """
+    One long-lived websocket subscription of one account.
+
+    `run` keeps the connection open, reconnecting after errors. After every
+    (re)connect the stream calls `reconcile`, so events missed while
+    disconnected are picked up from REST.
+    """
+    name = 'stream'
+    keepalive_interval: Optional[float] = None
+
+    def __init__(self, account, exchange: ccxt_async.Exchange, transport_factory: Callable[[], Transport] = AiohttpTransport,
+                 reconnect_delay: float = RECONNECT_DELAY):
+        self.account = account
+        self.exchange = exchange
+        self.transport_factory = transport_factory
+        self.reconnect_delay = reconnect_delay
+        self.connected = asyncio.Event()
+
+    async def url(self) -> str:
+        raise NotImplementedError
+
+    async def on_connect(self, transport: Transport):
+        pass
+
+    async def keepalive(self, transport: Transport):
+        pass
+
+    def handle(self, message: Dict[str, Any]):
+        raise NotImplementedError
+
+    async def reconcile(self):
+        raise NotImplementedError
+
+    async def run(self):
+        while True:
+            try:
+                await self.session()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"{self.account.section} {self.name} failed: {e!r}")
+            self.connected.clear()
+            await asyncio.sleep(self.reconnect_delay)
+
+    async def session(self):
+        transport = self.transport_factory()
+        keepalive = None
+        try:
+            await transport.connect(await self.url())
+            await self.on_connect(transport)
+            await self.reconcile()
+            if self.keepalive_interval:
+                keepalive = asyncio.ensure_future(self._keepalive_loop(transport))
+            self.connected.set()
+            print(f"{self.account.section} {self.name} connected")
+            while True:
+                message = await transport.recv()
+                if message is None:
+                    print(f"{self.account.section} {self.name} closed")
+                    return
+                if message:
+                    self.handle(message)
+        finally:
+            if keepalive is not None:
+                keepalive.cancel()
+            await transport.close()
+
+    async def _keepalive_loop(self, transport: Transport):
+        while True:
+            await asyncio.sleep(self.keepalive_interval)
+            await self.keepalive(transport)
+
+
+class BybitStream(Stream):
+    """
+    Bybit private wallet and position topics applied to an in-memory snapshot.
+
+    Messages carry the same fields as the REST responses, so they are parsed
+    with the exchange's own parse_balance/parse_position and persisted with
+    the same transforms as a polled cycle; the store writes only changed rows.
+    """
+    name = 'private stream'
+    keepalive_interval = BYBIT_PING_INTERVAL
+
+    def __init__(self, account, exchange: ccxt_async.Exchange, transport_factory: Callable[[], Transport] = AiohttpTransport,
+                 url: Optional[str] = None, persist: Callable[[str, bybit_utils.AccountState], None] = bybit_utils.persist,
+                 debounce: float = DEBOUNCE, reconnect_delay: float = RECONNECT_DELAY):
+        super().__init__(account, exchange, transport_factory, reconnect_delay)
+        self._url = url
+        self.persist = persist
+        self.balance: Optional[Dict[str, Any]] = None
+        self.positions: Dict[str, Dict[str, Any]] = {}
+        self.debouncer = Debouncer(self.flush, debounce)
+
+    async def url(self) -> str:
+        if self._url:
+            return self._url
+        return BYBIT_TESTNET_PRIVATE_URL if getattr(self.exchange, 'isSandboxModeEnabled', False) else BYBIT_PRIVATE_URL
+
+    async def on_connect(self, transport: Transport):
+        expires = int((time.time() + 10) * 1000)
+        signature = hmac.new(self.exchange.secret.encode(), f"GET/realtime{expires}".encode(), hashlib.sha256).hexdigest()
+        await transport.send({'op': 'auth', 'args': [self.exchange.apiKey, expires, signature]})
+        reply = await transport.recv()
+        if not reply or not reply.get('success'):
+            raise RuntimeError(f"Bybit auth failed: {reply}")
+        await transport.send({'op': 'subscribe', 'args': ['wallet', 'position']})
+
+    async def keepalive(self, transport: Transport):
+        await transport.send({'op': 'ping'})
+
+    def handle(self, message: Dict[str, Any]):
+        topic = message.get('topic')
+        if topic == 'wallet':
+            for entry in message['data']:
+                if entry.get('accountType') == 'UNIFIED':
+                    self.balance = self.exchange.parse_balance({'result': {'list': [entry]}})
+        elif topic == 'position':
+            for raw in message['data']:
+                self.apply_position(self.exchange.parse_position(raw))
+        else:
+            return
+        self.debouncer.trigger()
+
+    def apply_position(self, position: Dict[str, Any]):
+        if position['contracts']:
+            self.positions[position['symbol']] = position
+        else:
+            self.positions.pop(position['symbol'], None)
+
+    async def reconcile(self):
+        snapshot = await bybit_async_utils.fetch_snapshot(self.exchange)
+        self.balance = snapshot.balance
+        self.positions = {}
+        for position in snapshot.positions:
+            self.apply_position(position)
+        await self.flush()
+
+    async def flush(self):
+        if self.balance is None:
+            return
+        snapshot = bybit_utils.Snapshot(self.balance, list(self.positions.values()))
+        self.persist(self.account.user, bybit_utils.parse_snapshot(snapshot))
+
+
+@dataclass(frozen=True)
+class ListenKeyEndpoint:
+    """The REST calls that create and extend a Binance listen key, and the stream they open."""
+    name: str
+    create: str
+    keepalive: str
+    base_url: str
+
+
+PM_USER_STREAM = ListenKeyEndpoint('portfolio margin', 'papiPostListenKey', 'papiPutListenKey', 'wss://fstream.binance.com/pm/ws/')
+SPOT_USER_STREAM = ListenKeyEndpoint('spot', 'publicPostUserDataStream', 'publicPutUserDataStream', 'wss://stream.binance.com:9443/ws/')
+UM_USER_STREAM = ListenKeyEndpoint('um', 'fapiPrivatePostListenKey', 'fapiPrivatePutListenKey', 'wss://fstream.binance.com/ws/')
+CM_USER_STREAM = ListenKeyEndpoint('cm', 'dapiPrivatePostListenKey', 'dapiPrivatePutListenKey', 'wss://dstream.binance.com/ws/')
+
+# Events that change balances or positions
+BINANCE_ACCOUNT_EVENTS = {
+    'ACCOUNT_UPDATE',
+    'outboundAccountPosition',
+    'balanceUpdate',
+    'liabilityChange',
+    'openOrderLoss',
+}
+# Deltas that Binance follows with an outboundAccountPosition carrying the new balance
+FOLLOWED_EVENTS = {'balanceUpdate'}
+
+
+class Throttle:
+    """Run `callback` when triggered, but at most once every `interval` seconds; triggers meanwhile coalesce into one run."""
+
+    def __init__(self, callback: Callable[[], Awaitable[None]], interval: float = REFRESH_INTERVAL):
+        self.callback = callback
+        self.interval = interval
+        self.last = -math.inf
+        self._pending = False
+        self._task: Optional[asyncio.Task] = None
+
+    def trigger(self):
+        self._pending = True
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        while self._pending:
+            await asyncio.sleep(max(self.last + self.interval - time.monotonic(), 0))
+            self._pending = False
+            self.last = time.monotonic()
+            try:
+                await self.callback()
+            except Exception as e:
+                print(f"Stream refresh failed: {e!r}")
+
+
+def position_update(raw: Dict[str, Any]) -> Tuple[float, float, float]:
+    """(amount, entry price, unrealized profit) of a position in an ACCOUNT_UPDATE."""
+    return float(raw['pa']), float(raw['ep']), float(raw['up'])
+
+
+class BinanceAccountState:
+    """The REST state of one Binance account with its user-stream events applied."""
+
+    def __init__(self, account, fetch: Callable[[], Awaitable[Tuple]], write: Callable[..., None],
+                 debounce: float = DEBOUNCE, refresh_interval: float = REFRESH_INTERVAL):
+        self.account = account
+        self.fetch = fetch
+        self.write = write
+        self.snapshot: Optional[Tuple] = None
+        self.writes = Debouncer(self.flush, debounce)
+        self.refreshes = Throttle(self.reconcile, refresh_interval)
+
+    async def reconcile(self):
+        self.snapshot = tuple(await self.fetch())
+        await self.flush()
+
+    async def flush(self):
+        if self.snapshot is not None:
+            self.write(self.account.user, *self.snapshot)
+
+    def handle(self, wallet: str, message: Dict[str, Any]):
+        if self.snapshot is None or message['e'] in FOLLOWED_EVENTS:
+            return
+        if self.apply(wallet, message):
+            self.writes.trigger()
+        else:
+            self.refreshes.trigger()
+
+    def apply(self, wallet: str, message: Dict[str, Any]) -> bool:
+        """Apply an account event to the snapshot; False if it needs a REST refresh."""
+        raise NotImplementedError
+
+
+class PortfolioMarginState(BinanceAccountState):
+    """(coins, cm_positions, um_positions) of a portfolio-margin account."""
+
+    def apply(self, wallet: str, message: Dict[str, Any]) -> bool:
+        coins, cm_positions, um_positions = self.snapshot
+        if message['e'] == 'outboundAccountPosition':
+            for raw in message['B']:
+                coin = coins.get(raw['a'])
+                if coin is None:
+                    if float(raw['f']) or float(raw['l']):
+                        return False
+                    continue
+                coin.cross_margin_free, coin.cross_margin_locked = float(raw['f']), float(raw['l'])
+                coin.cross_margin_asset = coin.cross_margin_free + coin.cross_margin_locked
+                coin.total_wallet_balance = coin.cross_margin_asset + coin.um_wallet_balance + coin.cm_wallet_balance
+            return True
+        if message['e'] != 'ACCOUNT_UPDATE':
+            return False
+
+        um = message.get('fs') == 'UM'
+        update = message['a']
+        for raw in update.get('B', []):
+            coin = coins.get(raw['a'])
+            if coin is None:
+                if float(raw['wb']):
+                    return False
+                continue
+            if um:
+                coin.um_wallet_balance = float(raw['wb'])
+            else:
+                coin.cm_wallet_balance = float(raw['wb'])
+            coin.total_wallet_balance = coin.cross_margin_asset + coin.um_wallet_balance + coin.cm_wallet_balance
+        positions = um_positions if um else cm_positions
+        for raw in update.get('P', []):
+            amount, entry, pnl = position_update(raw)
+            position = positions.get(raw['s'])
+            if position is None:
+                if amount:
+                    return False
+                continue
+            # The profit moves from the coin's unrealized to its wallet balance, which B carries
+            coin = coins.get(raw.get('ma') or ('USDT' if um else base_asset(raw['s'])))
+            if coin is not None and um:
+                coin.um_unrealized_pnl += pnl - position.un_realized_profit
+            elif coin is not None:
+                coin.cm_unrealized_pnl += pnl - position.un_realized_profit
+            if not amount:
+                del positions[raw['s']]
+                continue
+            position.position_amt, position.entry_price, position.un_realized_profit = amount, entry, pnl
+            position.mark_price = entry + pnl / amount
+            if um:
+                position.notional = amount * position.mark_price
+            else:
+                position.notional_value = amount * position.contract_size / position.mark_price
+        return True
+
+
+class ClassicState(BinanceAccountState):
+    """(coins, um_info, cm_info) of a classic account, as binance_classic.write_data takes them."""
+
+    def apply(self, wallet: str, message: Dict[str, Any]) -> bool:
+        coins, um_info, cm_info = self.snapshot
+        if message['e'] == 'outboundAccountPosition':
+            for raw in message['B']:
+                coin = coins.get(raw['a'])
+                free, locked = float(raw['f']), float(raw['l'])
+                if coin is None:
+                    if free or locked:
+                        return False
+                    continue
+                if free or locked:
+                    coin.free, coin.locked = free, locked
+                else:
+                    del coins[raw['a']]
+            return True
+        if message['e'] != 'ACCOUNT_UPDATE' or wallet not in (UM, CM):
+            return False
+
+        info = um_info if wallet == UM else cm_info
+        update = message['a']
+        for raw in update.get('B', []):
+            coin = info['coins'].get(raw['a'])
+            if coin is None:
+                if float(raw['wb']):
+                    return False
+                continue
+            if wallet == UM:
+                info['total_wallet_balance'] += (float(raw['wb']) - coin.walletBalance) * coin.price_in_usdt
+            coin.walletBalance = float(raw['wb'])
+        for raw in update.get('P', []):
+            amount, entry, pnl = position_update(raw)
+            position = info['position'].get(raw['s'])
+            if position is None:
+                if amount:
+                    return False
+                continue
+            coin = info['coins'].get(raw.get('ma') or ('USDT' if wallet == UM else base_asset(raw['s'])))
+            if coin is not None:
+                coin.unrealizedProfit += pnl - position.unrealized_profit
+                if wallet == UM:
+                    info['total_unrealized_profit'] += (pnl - position.unrealized_profit) * coin.price_in_usdt
+            if not amount:
+                del info['position'][raw['s']]
+                continue
+            position.position_amt, position.unrealized_profit = amount, pnl
+            if wallet == UM:
+                position.notional = amount * entry + pnl
+        return True
+
+
+class BinanceUserStream(Stream):
+    """
+    A Binance user-data stream applying account events to a shared BinanceAccountState.
+
+    A classic account has one stream per wallet, all applying to the same
+    state; a portfolio-margin account has one. Reconciling a stream fetches
+    the whole account state from REST again.
+    """
+    keepalive_interval = LISTEN_KEY_INTERVAL
+
+    def __init__(self, account, exchange: ccxt_async.Exchange, endpoint: ListenKeyEndpoint, state: BinanceAccountState,
+                 transport_factory: Callable[[], Transport] = AiohttpTransport, reconnect_delay: float = RECONNECT_DELAY):
+        super().__init__(account, exchange, transport_factory, reconnect_delay)
+        self.endpoint = endpoint
+        self.state = state
+        self.name = f"{endpoint.name} user stream"
+        self.listen_key: Optional[str] = None
+
+    async def url(self) -> str:
+        res = await getattr(self.exchange, self.endpoint.create)()
+        self.listen_key = res['listenKey']
+        return self.endpoint.base_url + self.listen_key
+
+    async def keepalive(self, transport: Transport):
+        await getattr(self.exchange, self.endpoint.keepalive)({'listenKey': self.listen_key})
+
+    def handle(self, message: Dict[str, Any]):
+        event = message.get('e')
+        if event == 'listenKeyExpired':
+            raise RuntimeError('listen key expired')
+        if event in BINANCE_ACCOUNT_EVENTS:
+            self.state.handle(self.endpoint.name, message)
+
+    async def reconcile(self):
+        await self.state.reconcile()
+
+
+def make_streams(account, exchange: ccxt_async.Exchange, fetch: Callable[[], Awaitable[Any]],
+                 transport_factory: Callable[[], Transport] = AiohttpTransport) -> List[Stream]:
+    """
+    Build the streams of one account.
+
+    `fetch` returns the account's REST state without writing it
+    (accounts.make_async_fetch); Binance streams seed and reconcile their
+    in-memory state with it. Bybit streams fetch their own snapshot.
+    """
+    if account.venue == BYBIT:
+        return [BybitStream(account, exchange, transport_factory)]
+    if account.venue == BINANCE:
+        state: BinanceAccountState = PortfolioMarginState(account, fetch, binance_async_utils.write_data)
+        endpoints = [PM_USER_STREAM]
+    else:
+        state = ClassicState(account, fetch, binance_classic_utils.write_data)
+        endpoints = [SPOT_USER_STREAM, UM_USER_STREAM, CM_USER_STREAM]
+    return [BinanceUserStream(account, exchange, endpoint, state, transport_factory) for endpoint in endpoints]
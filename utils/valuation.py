@@ -0,0 +1,207 @@
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from utils.metrics import timed
+from utils.schema import POSITIONS
+from utils.storage import Batch
+
+QUOTE = 'USDT'
+INITIAL_WALLETS = 64
+INITIAL_ASSETS = 256
+
+WalletKey = Tuple[str, str, str]
+
+
+class AssetIndex:
+    """Column of every asset seen in any account; the quote asset is column 0."""
+
+    def __init__(self, quote: str = QUOTE):
+        self.ids: Dict[str, int] = {}
+        self.names: List[str] = []
+        self.id(quote)
+
+    def id(self, asset: str) -> int:
+        if asset not in self.ids:
+            self.ids[asset] = len(self.names)
+            self.names.append(asset)
+        return self.ids[asset]
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+
+@dataclass
+class Valuation:
+    """Equity, borrowed value and notional of every wallet at one price vector, in the quote asset."""
+    wallets: List[WalletKey]
+    equity: np.ndarray
+    borrowed: np.ndarray
+    notional: np.ndarray
+
+    def wallet(self, account: str, venue: str, wallet_type: str) -> Tuple[float, float, float]:
+        i = self.wallets.index((account, venue, wallet_type))
+        return float(self.equity[i]), float(self.borrowed[i]), float(self.notional[i])
+
+    def by_account(self) -> Dict[str, Tuple[float, float, float]]:
+        accounts, codes = np.unique([key[0] for key in self.wallets], return_inverse=True)
+        sums = [np.bincount(codes, weights=values, minlength=len(accounts)) for values in (self.equity, self.borrowed, self.notional)]
+        return {account: (float(sums[0][i]), float(sums[1][i]), float(sums[2][i])) for i, account in enumerate(accounts)}
+
+    def total(self) -> Tuple[float, float, float]:
+        return float(self.equity.sum()), float(self.borrowed.sum()), float(self.notional.sum())
+
+
+class ValuationEngine:
+    """
+    Holdings of every account's wallets as rows of one matrix over a shared
+    asset index, valued together against a single price vector.
+
+    A wallet's row holds the amount of each asset its equity is made of
+    (net of borrowing), a second matrix the borrowed amounts, and a vector
+    its notional. Valuing every wallet is two matrix-vector products, and a
+    new tick only replaces the price vector, so repricing needs no balances
+    to be fetched again. Assets without a known price are valued at 0.
+    Updaters put their wallets in with `value_wallet` and `value_notional`,
+    which also record the equity sample the engine values them at.
+    """
+
+    def __init__(self, assets: Optional[AssetIndex] = None):
+        self.assets = assets or AssetIndex()
+        self.rows: Dict[WalletKey, int] = {}
+        self.keys: List[WalletKey] = []
+        self.quantity = np.zeros((INITIAL_WALLETS, INITIAL_ASSETS))
+        self.borrowed = np.zeros((INITIAL_WALLETS, INITIAL_ASSETS))
+        self.notional = np.zeros(INITIAL_WALLETS)
+        self.prices = np.zeros(INITIAL_ASSETS)
+        self.prices[0] = 1.0
+        self._lock = threading.RLock()
+
+    def _grow(self, wallets: int, assets: int):
+        rows, columns = self.quantity.shape
+        if wallets <= rows and assets <= columns:
+            return
+        rows = 2 * wallets if wallets > rows else rows
+        columns = 2 * assets if assets > columns else columns
+        for name in ('quantity', 'borrowed'):
+            old = getattr(self, name)
+            new = np.zeros((rows, columns))
+            new[:old.shape[0], :old.shape[1]] = old
+            setattr(self, name, new)
+        self.notional = np.concatenate([self.notional, np.zeros(rows - len(self.notional))])
+        self.prices = np.concatenate([self.prices, np.zeros(columns - len(self.prices))])
+
+    def _row(self, key: WalletKey) -> int:
+        if key not in self.rows:
+            self.rows[key] = len(self.keys)
+            self.keys.append(key)
+        return self.rows[key]
+
+    def _columns(self, assets) -> np.ndarray:
+        return np.fromiter((self.assets.id(asset) for asset in assets), dtype=np.intp)
+
+    def _fill(self, matrix: np.ndarray, row: int, amounts: Dict[str, float]):
+        matrix[row] = 0.0
+        if amounts:
+            matrix[row, self._columns(amounts)] = np.fromiter(amounts.values(), dtype=float, count=len(amounts))
+
+    def hold(self, key: WalletKey, quantities: Dict[str, float], borrowed: Optional[Dict[str, float]] = None,
+             notional: Optional[float] = None):
+        """Replace a wallet's holdings; notional is kept when not given."""
+        with self._lock:
+            row = self._row(key)
+            # Index the assets before growing so new columns fit
+            for asset in list(quantities) + list(borrowed or ()):
+                self.assets.id(asset)
+            self._grow(len(self.keys), len(self.assets))
+            self._fill(self.quantity, row, quantities)
+            self._fill(self.borrowed, row, borrowed or {})
+            if notional is not None:
+                self.notional[row] = notional
+
+    def take(self, key: WalletKey, quantities: Dict[str, float], borrowed: Optional[Dict[str, float]] = None,
+             prices: Optional[Dict[str, float]] = None) -> float:
+        """Replace a wallet's holdings and the prices of its assets, and return its equity."""
+        with self._lock:
+            if prices:
+                self.set_prices(prices)
+            self.hold(key, quantities, borrowed)
+            assets = len(self.assets)
+            return float(self.quantity[self.rows[key], :assets] @ self.prices[:assets])
+
+    def set_notional(self, key: WalletKey, notional: float):
+        with self._lock:
+            row = self._row(key)
+            self._grow(len(self.keys), len(self.assets))
+            self.notional[row] = notional
+
+    def set_prices(self, prices: Dict[str, float]):
+        """Update the price of each given asset in the quote asset."""
+        with self._lock:
+            columns = self._columns(prices)
+            self._grow(len(self.keys), len(self.assets))
+            self.prices[columns] = np.fromiter(prices.values(), dtype=float, count=len(prices))
+            self.prices[0] = 1.0
+
+    def set_tickers(self, tickers: Dict[str, Dict[str, Any]]):
+        """Reprice from {'<asset>/<quote>': {'last': price}}, as returned by fetch_tickers or PriceCache."""
+        suffix = f"/{self.assets.names[0]}"
+        self.set_prices({
+            symbol[:-len(suffix)]: ticker['last']
+            for symbol, ticker in tickers.items()
+            if symbol.endswith(suffix) and ticker.get('last') is not None
+        })
+
+    def value(self) -> Valuation:
+        with self._lock:
+            wallets, assets = len(self.keys), len(self.assets)
+            prices = self.prices[:assets]
+            return Valuation(
+                list(self.keys),
+                self.quantity[:wallets, :assets] @ prices,
+                self.borrowed[:wallets, :assets] @ prices,
+                self.notional[:wallets].copy(),
+            )
+
+
+_engine: Optional[ValuationEngine] = None
+_engine_lock = threading.Lock()
+
+
+def get_engine() -> ValuationEngine:
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = ValuationEngine()
+        return _engine
+
+
+@timed('value')
+def value_wallet(batch: Batch, wallet_type: str, quantities: Dict[str, float], borrowed: Optional[Dict[str, float]] = None,
+                 prices: Optional[Dict[str, float]] = None, equity: Optional[float] = None,
+                 engine: Optional[ValuationEngine] = None) -> float:
+    """
+    Hold a wallet's assets in the batch and the engine, and record its equity
+    sample: the engine's valuation, or `equity` where the venue reports it.
+    """
+    batch.hold(wallet_type, quantities, borrowed, prices)
+    valued = (engine or get_engine()).take((batch.account, batch.venue, wallet_type), quantities, borrowed, prices)
+    if equity is None:
+        equity = valued
+    batch.record_equity(wallet_type, equity=equity)
+    return equity
+
+
+def value_notional(batch: Batch, wallet_type: str, *position_wallets: str, engine: Optional[ValuationEngine] = None) -> float:
+    """Record the gross notional of the positions the batch syncs under `position_wallets`, by default the wallet's own."""
+    column = POSITIONS.columns.index('notional')
+    notionals = np.fromiter(
+        (row[column] or 0.0 for wallet in position_wallets or (wallet_type,) for row in batch.syncs.get((POSITIONS, wallet), {}).values()),
+        dtype=float,
+    )
+    notional = float(np.abs(notionals).sum())
+    (engine or get_engine()).set_notional((batch.account, batch.venue, wallet_type), notional)
+    batch.record_equity(wallet_type, notional=notional)
+    return notional